@@ -1,4 +1,5 @@
 # Standard library imports
+import argparse
 import os
 import subprocess
 import re
@@ -8,12 +9,25 @@ import logging
 from pathlib import Path
 
 # Local application/library-specific imports
+from libs import aur_builder
+from libs import cache_proxy
 from libs import disk_operations, file_system_options
+from libs import download_tuner
+from libs import event_log
+from libs import graphics
+from libs import install_plan
+from libs import makepkg_tuner
+from libs import install_session
+from libs import mirrors
+from libs import package_cache
+from libs import power_tuner
 from libs import system_config
 from libs import utils
+from libs.disks import btrfs
+from libs.trace import tracer
 
-# Setting up logging
-logging.basicConfig(filename='menu.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# One queue-backed JSON-lines log for every module
+event_log.setup_logging()
 
 def display_intro():
     """Display the introduction to the script."""
@@ -74,6 +88,10 @@ class Menu:
     def __init__(self):
         self.menu_items = [
             ("Install Filesystem", file_system_options.install_filesystem_menu),
+            ("Run full install plan", install_plan.run_install_plan),
+            ("Rank mirrors", mirrors.rank_mirrors_menu),
+            ("Tune parallel downloads", download_tuner.tune_parallel_downloads_menu),
+            ("Seed package cache", package_cache.seed_package_cache_menu),
             ("Install essential packages", system_config.install_essential_packages),
             ("Configure fstab", disk_operations.configure_fstab),
             ("Chroot into system", utils.chroot_into_system),
@@ -87,9 +105,14 @@ class Menu:
             ("Install additional packages", system_config.install_additional_packages),
             ("Install custom packages", system_config.install_custom_packages),
             ("Desktop Environment Installation", system_config.install_desktop_environment),
+            ("Graphics drivers", graphics.graphics_menu),
+            ("CPU power profile", power_tuner.power_profile_menu),
             ("Display Services Menu", utils.display_services_menu),
             ("Setup Chaotic-AUR", system_config.setup_chaotic_aur),
             ("Setup CachyOS Repository", system_config.setup_cachyos_repo),
+            ("Tune makepkg", makepkg_tuner.tune_makepkg_menu),
+            ("Build AUR packages", aur_builder.build_aur_packages_menu),
+            ("Install queued packages", system_config.install_queued_packages),
             ("Quit", exit)
         ]
         self.current_row = 0
@@ -148,10 +171,11 @@ class Menu:
             elif key == curses.KEY_DOWN and self.current_row < len(self.menu_items) - 1:
                 self.current_row += 1
             elif key == curses.KEY_ENTER or key in [10, 13]:  # Enter key
-                _, selected_function = self.menu_items[self.current_row]
+                item_name, selected_function = self.menu_items[self.current_row]
                 try:
                     if selected_function:
-                        selected_function(stdscr)
+                        with tracer.step(item_name):
+                            selected_function(stdscr)
                 except Exception as e:
                     logging.error(f"Error occurred while executing function: {str(e)}")
                     # Display a user-friendly error message
@@ -166,8 +190,42 @@ class Menu:
 
         stdscr.getch()
 
+def parse_arguments():
+    """Parse the command line options."""
+    parser = argparse.ArgumentParser(description="Arch BTRFS Installation Script")
+    parser.add_argument("--serve-cache", action="store_true",
+                        help="run as a caching package proxy for other installer instances on the LAN")
+    parser.add_argument("--cache-dir", default=cache_proxy.DEFAULT_CACHE_DIR,
+                        help="directory holding the proxy's cached packages")
+    parser.add_argument("--cache-size", type=float, default=cache_proxy.DEFAULT_CACHE_SIZE / 1024 ** 3,
+                        help="proxy cache size budget in GiB")
+    parser.add_argument("--port", type=int, default=cache_proxy.DEFAULT_PORT,
+                        help="HTTP port of the proxy")
+    parser.add_argument("--upstream", action="append",
+                        help="upstream mirror URL template (repeatable, defaults to the ranked mirrorlist)")
+    parser.add_argument("--benchmark-btrfs", action="store_true",
+                        help="time Btrfs mounts and RAID profiles on loop devices, then exit")
+    return parser.parse_args()
+
 # To start the menu
 if __name__ == "__main__":
+    args = parse_arguments()
+    if args.serve_cache:
+        cache_proxy.serve(args.cache_dir, int(args.cache_size * 1024 ** 3), args.port, args.upstream)
+        sys.exit(0)
+    if args.benchmark_btrfs:
+        print(btrfs.benchmark_layouts())
+        sys.exit(0)
+
+    # Drive, Wi-Fi, service and time zone probes run in the background while the intro is shown
+    utils.probes.start()
     display_intro()
     menu = Menu()
-    curses.wrapper(menu.display)
+    # Initramfs and snapshot hooks run once when the installer finishes instead of per transaction
+    session = install_session.InstallSession()
+    try:
+        with session:
+            curses.wrapper(menu.display)
+    finally:
+        print(session.report())
+        print(tracer.export())
@@ -0,0 +1,394 @@
+# Standard library imports
+import curses
+import glob
+import logging
+import os
+import pwd
+import shlex
+import shutil
+import time
+
+from libs import install_plan
+from libs import makepkg_tuner
+from libs import pacman_conf
+from libs.package_cache import HOST_CACHE, PACKAGE_SUFFIXES, SYNC_DB_DIR
+from libs.packages import transaction
+from libs.sync_db import configured_repos, strip_version
+from libs.utils import run_command, stream_command
+
+# Vendored PKGBUILDs shipped next to the installer, one directory per package base
+VENDORED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "aur")
+
+BUILD_ROOT = "/var/lib/arch-install/aur-chroot"
+SOURCE_CACHE = "/var/cache/arch-install/aur-sources"
+CCACHE_DIR = "/var/cache/arch-install/ccache"
+REPO_DIR = "/var/cache/arch-install/aur-repo"
+REPO_NAME = "arch-install-aur"
+
+# makechrootpkg runs makepkg as builduser with HOME=/build
+CHROOT_CCACHE_DIR = "/build/.cache/ccache"
+# Host account whose uid builduser gets when the installer runs as plain root
+BUILD_USER = "arch-install-build"
+
+_DEPENDENCY_KEYS = ("depends", "makedepends", "checkdepends")
+
+
+class AurPackage:
+    """One package base read from its .SRCINFO."""
+    def __init__(self, path, pkgbase):
+        self.path = path
+        self.pkgbase = pkgbase
+        self.pkgnames = []
+        self.version = ""
+        self.depends = set()
+        self.provides = set()
+        self.files = []       # Built package files
+        self.seconds = None   # Build time
+        self.error = None
+
+    @property
+    def names(self):
+        """Every name other packages may depend on."""
+        return set(self.pkgnames) | self.provides
+
+
+def parse_srcinfo(text, path):
+    """Parses the text of a .SRCINFO file into an AurPackage."""
+    package = None
+    epoch, pkgver, pkgrel = "", "", ""
+    for line in text.splitlines():
+        if "=" not in line:
+            continue
+        key, value = (part.strip() for part in line.split("=", 1))
+        # Architecture-specific keys (depends_x86_64) count like the plain ones
+        base_key = key.split("_")[0] if key.endswith("_x86_64") else key
+        if key == "pkgbase":
+            package = AurPackage(path, value)
+        elif package is None:
+            continue
+        elif key == "pkgname":
+            package.pkgnames.append(value)
+        elif key == "pkgver":
+            pkgver = value
+        elif key == "pkgrel":
+            pkgrel = value
+        elif key == "epoch":
+            epoch = value + ":"
+        elif base_key in _DEPENDENCY_KEYS:
+            package.depends.add(strip_version(value))
+        elif base_key == "provides":
+            package.provides.add(strip_version(value))
+    if package is None:
+        raise Exception(f"No pkgbase in the .SRCINFO of {path}")
+    package.version = f"{epoch}{pkgver}-{pkgrel}"
+    return package
+
+
+def read_package(path):
+    """Reads the metadata of a PKGBUILD directory, generating .SRCINFO when it is missing."""
+    srcinfo = os.path.join(path, ".SRCINFO")
+    if os.path.exists(srcinfo):
+        with open(srcinfo, "r") as f:
+            return parse_srcinfo(f.read(), path)
+    # makepkg refuses to run as root; --printsrcinfo only sources the PKGBUILD
+    result = stream_command(f"cd {shlex.quote(path)} && runuser -u nobody -- makepkg --printsrcinfo",
+                            log_file="aur-build.log")
+    if result.returncode != 0:
+        raise Exception(f"Cannot read {path}/PKGBUILD: {result.stderr}")
+    return parse_srcinfo(result.stdout, path)
+
+
+def find_pkgbuild_dirs(paths):
+    """Expands each path to itself if it holds a PKGBUILD, else to its subdirectories that do."""
+    found = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, "PKGBUILD")):
+            found.append(os.path.abspath(path))
+        elif os.path.isdir(path):
+            found.extend(os.path.dirname(os.path.abspath(pkgbuild))
+                         for pkgbuild in sorted(glob.glob(os.path.join(path, "*", "PKGBUILD"))))
+    return found
+
+
+def local_dependencies(packages):
+    """Maps each package base to the package bases among packages it depends on."""
+    owners = {}
+    for package in packages:
+        for name in package.names:
+            owners.setdefault(name, package.pkgbase)
+    return {package.pkgbase: {owners[name] for name in package.depends
+                              if name in owners and owners[name] != package.pkgbase}
+            for package in packages}
+
+
+class AurBuildReport:
+    """Outcome of one AUR build run."""
+    def __init__(self, packages, wall_time, ccache_hit_rate=None):
+        self.packages = packages
+        self.wall_time = wall_time
+        self.ccache_hit_rate = ccache_hit_rate
+
+    @property
+    def built(self):
+        return [package for package in self.packages if package.files]
+
+    @property
+    def failed(self):
+        return [package for package in self.packages if not package.files]
+
+    def lines(self):
+        lines = []
+        for package in sorted(self.packages, key=lambda package: -(package.seconds or 0)):
+            if package.files:
+                lines.append(f"{package.seconds:7.1f}s  {package.pkgbase} {package.version}")
+            else:
+                lines.append(f"{'failed' if package.error else 'skipped':>8}  {package.pkgbase}")
+        hit_rate = f"{self.ccache_hit_rate:.0%}" if self.ccache_hit_rate is not None else "unknown"
+        lines.append(f"Built {len(self.built)}/{len(self.packages)} packages in {self.wall_time:.1f}s, "
+                     f"ccache hit rate {hit_rate}")
+        return lines
+
+    def report(self):
+        return "\n".join(self.lines())
+
+
+def ensure_build_tools():
+    """Installs devtools on the live system if makechrootpkg is missing."""
+    if shutil.which("makechrootpkg") is None:
+        run_command("pacman -S --needed --noconfirm devtools")
+
+
+def ensure_build_user(name=BUILD_USER):
+    """
+    Returns an unprivileged user for makechrootpkg -U, creating a system user when needed.
+
+    makechrootpkg gives builduser the uid of SUDO_USER; the installer runs as root
+    without one, which would make builduser root, and makepkg refuses to run as root.
+    """
+    user = os.environ.get("SUDO_USER")
+    if user and user != "root":
+        return user
+    try:
+        pwd.getpwnam(name)
+    except KeyError:
+        run_command(f"useradd --system --no-create-home --shell /usr/bin/nologin {name}")
+    return name
+
+
+def offline_pacman_conf(repos, sync_dir=SYNC_DB_DIR, cache_dir=HOST_CACHE):
+    """
+    Returns a pacman.conf that installs only from local files.
+
+    Every repository's server is the host's sync directory, so the database refresh
+    mkarchroot (pacstrap -Sy) does copies the databases already synced there, and
+    packages come from the package cache. Nothing is fetched from a mirror; a
+    package missing from the cache fails the build instead.
+    """
+    conf = pacman_conf.PacmanConf()
+    conf.set_option("Architecture", "auto")
+    conf.set_option("CacheDir", cache_dir)
+    conf.set_option("SigLevel", "Required DatabaseOptional")
+    conf.set_option("LocalFileSigLevel", "Optional")
+    for repo in repos:
+        conf.add_repo(repo, servers=[f"file://{sync_dir}"])
+    return conf.render()
+
+
+def prepare_build_root(build_root=BUILD_ROOT, parallel=1):
+    """
+    Creates the clean build chroot once and configures it for ccache and the split core count.
+
+    The chroot is created with an offline pacman.conf (see offline_pacman_conf), which
+    mkarchroot also installs as the chroot's own, so creating it and installing build
+    dependencies works without network once the host cache holds them.
+    """
+    root = os.path.join(build_root, "root")
+    if not os.path.isdir(root):
+        os.makedirs(build_root, exist_ok=True)
+        repos = [repo for repo in configured_repos()
+                 if repo != REPO_NAME and os.path.exists(os.path.join(SYNC_DB_DIR, f"{repo}.db"))]
+        offline_conf = os.path.join(build_root, "pacman.conf")
+        pacman_conf.atomic_write(offline_conf, offline_pacman_conf(repos))
+        run_command(f"mkarchroot -C {offline_conf} -c {HOST_CACHE} {root} base-devel ccache")
+
+    conf_path = os.path.join(root, "etc/makepkg.conf")
+    with open(conf_path, "r") as f:
+        original = f.read()
+    cores = max(1, (os.cpu_count() or 1) // parallel)
+    text = makepkg_tuner.tune_makepkg_text(original, makepkg_tuner.plan_makepkg_tuning(cores=cores))
+    buildenv = makepkg_tuner.get_variable(text, "BUILDENV")
+    if buildenv is not None and "!ccache" in buildenv:
+        text = makepkg_tuner.set_variable(text, "BUILDENV", buildenv.replace("!ccache", "ccache"))
+    if text != original:
+        pacman_conf.atomic_write(conf_path, text)
+    return root
+
+
+def ccache_command(build_root, arguments):
+    """Runs ccache on the shared cache, from the host if installed or else inside the build chroot."""
+    if shutil.which("ccache"):
+        return stream_command(f"CCACHE_DIR={CCACHE_DIR} ccache {arguments}", log_file="aur-build.log")
+    return stream_command(f"arch-nspawn {os.path.join(build_root, 'root')} --bind={CCACHE_DIR}:/ccache "
+                          f"env CCACHE_DIR=/ccache ccache {arguments}", log_file="aur-build.log")
+
+
+def ccache_hit_rate(build_root):
+    """Reads the hit rate since the last reset from ccache --print-stats."""
+    result = ccache_command(build_root, "--print-stats")
+    if result.returncode != 0:
+        return None
+    stats = {}
+    for line in result.stdout.splitlines():
+        parts = line.split("\t")
+        if len(parts) == 2 and parts[1].strip().isdigit():
+            stats[parts[0]] = int(parts[1])
+    hits = stats.get("direct_cache_hit", 0) + stats.get("preprocessed_cache_hit", 0)
+    total = hits + stats.get("cache_miss", 0)
+    return hits / total if total else None
+
+
+def build_package(package, dependencies, build_root=BUILD_ROOT, build_user=BUILD_USER):
+    """
+    Builds one package base in its own copy of the clean chroot.
+
+    Parameters:
+    - package: AurPackage to build.
+    - dependencies: Already built AurPackages it depends on; they are installed into the chroot first.
+    - build_user: Unprivileged host user makepkg runs as (see ensure_build_user).
+    """
+    staging = os.path.join(REPO_DIR, f".build-{package.pkgbase}")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    command = ["makechrootpkg", "-c", "-r", build_root, "-l", f"aur-{package.pkgbase}", "-U", build_user,
+               "-d", f"{CCACHE_DIR}:{CHROOT_CCACHE_DIR}"]
+    for dependency in dependencies:
+        for path in dependency.files:
+            command += ["-I", path]
+    command += ["--", "--noconfirm"]
+
+    start = time.monotonic()
+    result = stream_command(f"cd {shlex.quote(package.path)} && "
+                            f"PKGDEST={shlex.quote(staging)} SRCDEST={shlex.quote(SOURCE_CACHE)} "
+                            + " ".join(shlex.quote(arg) for arg in command),
+                            log_file=f"aur-build-{package.pkgbase}.log")
+    package.seconds = time.monotonic() - start
+    if result.returncode != 0:
+        shutil.rmtree(staging, ignore_errors=True)
+        errors = result.stderr.strip().splitlines()
+        package.error = errors[-1] if errors else "makechrootpkg failed"
+        raise Exception(f"Building {package.pkgbase} failed: {package.error}")
+
+    for filename in os.listdir(staging):
+        if filename.endswith(PACKAGE_SUFFIXES):
+            destination = os.path.join(REPO_DIR, filename)
+            os.replace(os.path.join(staging, filename), destination)
+            package.files.append(destination)
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def publish_repository(packages):
+    """
+    Adds the built packages to a local repository the next install transaction can use.
+
+    The repository database is placed straight into pacman's sync directory, so no
+    network refresh is needed before the transaction. The repository is only
+    registered in the live system's pacman.conf until that transaction has run.
+    """
+    files = [path for package in packages for path in package.files]
+    db_path = os.path.join(REPO_DIR, f"{REPO_NAME}.db.tar.zst")
+    run_command(f"repo-add -q -R {shlex.quote(db_path)} " + " ".join(shlex.quote(path) for path in files))
+    shutil.copy2(db_path, os.path.join(SYNC_DB_DIR, f"{REPO_NAME}.db"))
+    with pacman_conf.edit() as conf:
+        conf.add_repo(REPO_NAME, servers=[f"file://{REPO_DIR}"], sig_level="Optional TrustAll")
+    if withdraw_repository not in transaction.after_commit:
+        transaction.after_commit.append(withdraw_repository)
+
+
+def withdraw_repository():
+    """Removes the local repository from the live system's pacman.conf and sync directory again."""
+    if withdraw_repository in transaction.after_commit:
+        transaction.after_commit.remove(withdraw_repository)
+    with pacman_conf.edit() as conf:
+        conf.remove_repo(REPO_NAME)
+    db_copy = os.path.join(SYNC_DB_DIR, f"{REPO_NAME}.db")
+    if os.path.exists(db_copy):
+        os.unlink(db_copy)
+
+
+def build_aur_packages(paths, parallel=None, build_root=BUILD_ROOT):
+    """
+    Builds local PKGBUILDs in dependency order, independent ones in parallel, and queues them.
+
+    Parameters:
+    - paths: PKGBUILD directories, or directories holding one PKGBUILD directory per package.
+    - parallel: Number of simultaneous builds (defaults to one per 4 CPUs).
+    - build_root: Directory of the clean build chroot.
+
+    Returns:
+    - AurBuildReport, or None when there was nothing to build.
+    """
+    dirs = find_pkgbuild_dirs(paths)
+    if not dirs:
+        return None
+    packages = [read_package(path) for path in dirs]
+    by_base = {package.pkgbase: package for package in packages}
+    dependencies = local_dependencies(packages)
+    parallel = parallel or max(1, (os.cpu_count() or 1) // 4)
+
+    for directory in (SOURCE_CACHE, CCACHE_DIR, REPO_DIR):
+        os.makedirs(directory, exist_ok=True)
+    # The unprivileged build user inside the chroots writes to the shared caches
+    for directory in (SOURCE_CACHE, CCACHE_DIR):
+        os.chmod(directory, 0o777)
+    ensure_build_tools()
+    build_user = ensure_build_user()
+    prepare_build_root(build_root, parallel)
+    ccache_command(build_root, "--zero-stats")
+
+    # Each package base is a step whose artifact unlocks the packages depending on it
+    plan = install_plan.InstallPlan(max_workers=parallel)
+    for package in packages:
+        plan.add_step(install_plan.PlanStep(
+            f"Build {package.pkgbase}",
+            lambda package=package: build_package(
+                package, [by_base[base] for base in dependencies[package.pkgbase]], build_root, build_user),
+            inputs={f"aur:{base}" for base in dependencies[package.pkgbase]},
+            outputs={f"aur:{package.pkgbase}"}))
+    start = time.monotonic()
+    failed = plan.run()
+    report = AurBuildReport(packages, time.monotonic() - start, ccache_hit_rate(build_root))
+    for step in failed:
+        logging.error(f"AUR {step.name} failed: {str(step.error)}")
+
+    if report.built:
+        publish_repository(report.built)
+        transaction.add([name for package in report.built for name in package.pkgnames], "AUR packages")
+    logging.info(report.report())
+    return report
+
+
+def build_vendored_packages():
+    """Builds the PKGBUILDs vendored next to the installer, if there are any."""
+    if not os.path.isdir(VENDORED_DIR):
+        return None
+    return build_aur_packages([VENDORED_DIR])
+
+
+def build_aur_packages_menu(stdscr):
+    """Menu entry that asks for PKGBUILD directories and builds them."""
+    stdscr.clear()
+    h, w = stdscr.getmaxyx()
+    stdscr.addstr(0, 0, f"PKGBUILD directories (space-separated, empty for {VENDORED_DIR}):"[:w - 1])
+    curses.echo()
+    paths = stdscr.getstr(1, 0).decode('utf-8').split() or [VENDORED_DIR]
+    curses.noecho()
+    stdscr.addstr(3, 0, "Building packages in clean chroots...")
+    stdscr.refresh()
+    report = build_aur_packages(paths)
+    stdscr.clear()
+    lines = report.lines() if report else ["No PKGBUILD found."]
+    for idx, line in enumerate(lines[-(h - 1):]):
+        stdscr.addstr(idx, 0, line[:w - 1])
+    stdscr.refresh()
+    stdscr.getch()
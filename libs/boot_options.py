@@ -0,0 +1,177 @@
+# Standard library imports
+import glob
+import logging
+import os
+import re
+import threading
+
+from libs.chroot import target_path
+from libs.makepkg_tuner import get_variable, set_variable
+from libs.pacman_conf import atomic_write
+
+GRUB_DEFAULTS = "/etc/default/grub"
+MKINITCPIO_CONF = "/etc/mkinitcpio.conf"
+REFIND_LINUX_CONF = "/boot/refind_linux.conf"
+LOADER_ENTRIES = "/boot/loader/entries"
+
+# A refind_linux.conf menu line: "Title" "kernel options"
+_REFIND_LINE = re.compile(r'^(\s*"[^"]*"\s+")([^"]*)(".*)$')
+
+
+def _param_key(param):
+    return param.split("=", 1)[0]
+
+
+def merge_cmdline(cmdline, params):
+    """
+    Adds kernel parameters to a command line, replacing earlier values of the same parameter.
+
+    Parameters:
+    - cmdline: Existing command line, e.g. "loglevel=3 quiet".
+    - params: Parameters to set, e.g. ["nvidia-drm.modeset=1"].
+
+    Returns:
+    - The merged command line.
+    """
+    merged = cmdline.split()
+    for param in params:
+        keys = [_param_key(existing) for existing in merged]
+        if _param_key(param) in keys:
+            merged[keys.index(_param_key(param))] = param
+        else:
+            merged.append(param)
+    return " ".join(merged)
+
+
+def _shell_array(value):
+    return value.strip("()").split() if value else []
+
+
+class BootOptions:
+    """
+    Collects the kernel parameters and initramfs changes every installer step asks for.
+
+    The options are applied to the target's /etc/default/grub, rEFInd's refind_linux.conf,
+    the systemd-boot loader entries and /etc/mkinitcpio.conf in one pass, before the
+    bootloader configuration and the initramfs are generated.
+    """
+    def __init__(self):
+        self.params = []
+        self.modules = []
+        self.removed_hooks = []
+        self.lock = threading.Lock()
+
+    def add_params(self, params, step=None):
+        """Queues kernel parameters; a later value of the same parameter wins."""
+        with self.lock:
+            for param in params:
+                self.params = [p for p in self.params if _param_key(p) != _param_key(param)] + [param]
+        logging.info(f"Queued kernel parameters for {step or 'boot'}: {' '.join(params)}")
+
+    def remove_params(self, params, step=None):
+        """Drops queued kernel parameters, whatever value they were queued with."""
+        keys = {_param_key(param) for param in params}
+        with self.lock:
+            self.params = [p for p in self.params if _param_key(p) not in keys]
+        logging.info(f"Dropped kernel parameters for {step or 'boot'}: {' '.join(params)}")
+
+    def add_modules(self, modules, step=None):
+        """Queues kernel modules to load from the initramfs (early KMS)."""
+        with self.lock:
+            self.modules.extend(module for module in modules if module not in self.modules)
+        logging.info(f"Queued initramfs modules for {step or 'boot'}: {' '.join(modules)}")
+
+    def remove_hooks(self, hooks, step=None):
+        """Queues mkinitcpio hooks to drop, e.g. kms when a proprietary driver replaces nouveau."""
+        with self.lock:
+            self.removed_hooks.extend(hook for hook in hooks if hook not in self.removed_hooks)
+        logging.info(f"Queued mkinitcpio hooks to remove for {step or 'boot'}: {' '.join(hooks)}")
+
+    def tune_grub_text(self, text):
+        """Applies the kernel parameters to GRUB_CMDLINE_LINUX_DEFAULT of a /etc/default/grub."""
+        if not self.params:
+            return text
+        current = (get_variable(text, "GRUB_CMDLINE_LINUX_DEFAULT") or '""').strip("\"'")
+        return set_variable(text, "GRUB_CMDLINE_LINUX_DEFAULT", f'"{merge_cmdline(current, self.params)}"')
+
+    def tune_refind_text(self, text):
+        """Applies the kernel parameters to every menu line of a refind_linux.conf."""
+        if not self.params:
+            return text
+        lines = []
+        for line in text.splitlines(keepends=True):
+            match = _REFIND_LINE.match(line)
+            if match and not line.lstrip().startswith("#"):
+                line = match.group(1) + merge_cmdline(match.group(2), self.params) + match.group(3) + "\n"
+            lines.append(line)
+        return "".join(lines)
+
+    def tune_loader_entry_text(self, text):
+        """Applies the kernel parameters to the options line of a systemd-boot loader entry."""
+        if not self.params:
+            return text
+        lines = text.splitlines()
+        for index, line in enumerate(lines):
+            key, _, value = line.strip().partition(" ")
+            if key == "options":
+                lines[index] = f"options {merge_cmdline(value, self.params)}"
+                break
+        else:
+            lines.append(f"options {' '.join(self.params)}")
+        return "\n".join(lines) + "\n"
+
+    def tune_mkinitcpio_text(self, text):
+        """Applies the modules and hook removals to a mkinitcpio.conf."""
+        if self.modules:
+            modules = _shell_array(get_variable(text, "MODULES"))
+            modules += [module for module in self.modules if module not in modules]
+            text = set_variable(text, "MODULES", "(" + " ".join(modules) + ")")
+        hooks = get_variable(text, "HOOKS")
+        if self.removed_hooks and hooks:
+            kept = [hook for hook in _shell_array(hooks) if hook not in self.removed_hooks]
+            text = set_variable(text, "HOOKS", "(" + " ".join(kept) + ")")
+        return text
+
+    def apply(self):
+        """
+        Writes the queued options into the target system.
+
+        Returns:
+        - List of the target files that changed.
+        """
+        entries = sorted(os.path.join(LOADER_ENTRIES, os.path.basename(entry))
+                         for entry in glob.glob(os.path.join(target_path(LOADER_ENTRIES), "*.conf")))
+        bootloader_configs = [(GRUB_DEFAULTS, self.tune_grub_text), (REFIND_LINUX_CONF, self.tune_refind_text)]
+        bootloader_configs += [(entry, self.tune_loader_entry_text) for entry in entries]
+        found = [(path, tune) for path, tune in bootloader_configs if os.path.exists(target_path(path))]
+        if self.params and not found:
+            logging.warning(f"No GRUB, rEFInd or systemd-boot configuration found in the target; add these "
+                            f"kernel parameters by hand: {' '.join(self.params)}")
+
+        changed = []
+        for path, tune in found + [(MKINITCPIO_CONF, self.tune_mkinitcpio_text)]:
+            real_path = target_path(path)
+            if not os.path.exists(real_path):
+                continue
+            with open(real_path, "r") as f:
+                original = f.read()
+            tuned = tune(original)
+            if tuned != original:
+                atomic_write(real_path, tuned)
+                changed.append(path)
+        if changed:
+            logging.info(f"Applied boot options to {', '.join(changed)}: {self.report()}")
+        return changed
+
+    def report(self):
+        return (f"kernel parameters: {' '.join(self.params) or 'none'}; "
+                f"initramfs modules: {' '.join(self.modules) or 'none'}")
+
+
+# Shared accumulator used by every installer step
+boot_options = BootOptions()
+
+
+def apply_boot_options():
+    """Writes the queued kernel parameters and initramfs modules into the target."""
+    return boot_options.apply()
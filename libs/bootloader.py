@@ -7,8 +7,10 @@ import curses
 import logging
 from pathlib import Path
 
-# Initialize logging
-logging.basicConfig(filename='bootloader.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+from libs.boot_options import apply_boot_options
+from libs.packages import transaction
+from libs.trace import tracer
+
 
 def install_bootloader(stdscr, bootloader_choice):
     """
@@ -20,20 +22,27 @@ def install_bootloader(stdscr, bootloader_choice):
     """
     try:
         if bootloader_choice == 'GRUB':
-            # Install GRUB package
-            subprocess.run(['pacman', '-S', 'grub', '--noconfirm'])
+            # Install GRUB together with everything else queued so far
+            transaction.add(['grub'], 'Bootloader')
+            transaction.commit()
             # Install GRUB for EFI systems
-            subprocess.run(['grub-install', '--target=x86_64-efi', '--efi-directory=/boot', '--bootloader-id=GRUB'])
+            tracer.run(['grub-install', '--target=x86_64-efi', '--efi-directory=/boot', '--bootloader-id=GRUB'])
+            # Kernel parameters queued by earlier steps go into /etc/default/grub first
+            apply_boot_options()
             # Generate GRUB configuration file
-            subprocess.run(['grub-mkconfig', '-o', '/boot/grub/grub.cfg'])
+            tracer.run(['grub-mkconfig', '-o', '/boot/grub/grub.cfg'])
         elif bootloader_choice == 'rEFInd':
-            # Install rEFInd package
-            subprocess.run(['pacman', '-S', 'refind-efi', '--noconfirm'])
+            # Install rEFInd together with everything else queued so far
+            transaction.add(['refind-efi'], 'Bootloader')
+            transaction.commit()
             # Install rEFInd bootloader
-            subprocess.run(['refind-install'])
+            tracer.run(['refind-install'])
+            apply_boot_options()
         elif bootloader_choice == 'systemd-boot':
             # Install and configure systemd-boot
-            subprocess.run(['bootctl', '--path=/boot', 'install'])
+            transaction.commit()
+            tracer.run(['bootctl', '--path=/boot', 'install'])
+            apply_boot_options()
     except Exception as e:
         logging.error(f"Error occurred while installing {bootloader_choice}: {str(e)}")
         # Display error message if bootloader installation fails
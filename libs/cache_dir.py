@@ -0,0 +1,34 @@
+# Standard library imports
+import logging
+import os
+import stat
+
+# Installer state that outlives one run: benchmarks, tuning results, parsed databases
+CACHE_ROOT = "/var/cache/arch-install"
+
+
+def private_dir(path=CACHE_ROOT):
+    """
+    Creates a directory if needed and checks that only the installer's user can use it.
+
+    Cached results decide which mirrors and packages are trusted, so a directory that
+    another user can write (or replace with a symlink) is never used.
+
+    Returns:
+    - True if the directory can be used.
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        info = os.lstat(path)
+    except OSError as e:
+        logging.error(f"Error creating cache directory {path}: {str(e)}")
+        return False
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        logging.error(f"Not using cache directory {path}: it is not a private directory")
+        return False
+    return True
+
+
+def cache_file(path):
+    """Returns path if its directory is private, else None."""
+    return path if private_dir(os.path.dirname(path)) else None
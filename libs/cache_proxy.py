@@ -0,0 +1,287 @@
+# Standard library imports
+import collections
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from libs import mirrors
+from libs.pacman_conf import PACMAN_CONF, atomic_write, edit as edit_pacman_conf
+
+DEFAULT_PORT = 7879
+DISCOVERY_PORT = 7878
+DISCOVERY_REQUEST = b"ARCH-INSTALL-CACHE?"
+DISCOVERY_REPLY = b"ARCH-INSTALL-CACHE"
+DEFAULT_CACHE_DIR = "/var/cache/arch-install-proxy"
+DEFAULT_CACHE_SIZE = 20 * 1024 ** 3
+# Included only by the live host's pacman.conf; pacstrap copies the mirrorlist into the target, not this file
+PROXY_MIRRORLIST = "/etc/pacman.d/lan-cache-mirrorlist"
+
+# Package files never change once published, repository databases do
+IMMUTABLE_SUFFIXES = (".pkg.tar.zst", ".pkg.tar.xz", ".pkg.tar.zst.sig", ".pkg.tar.xz.sig")
+DATABASE_TTL = 60  # Seconds a cached .db/.files answer is reused for other clients
+
+
+class PackageStore:
+    """On-disk package store with LRU eviction and one upstream download per missing file."""
+    def __init__(self, cache_dir, max_size, upstreams, timeout=30):
+        """
+        Parameters:
+        - cache_dir: Directory the cached files live in.
+        - max_size: Size budget in bytes; least recently used files are evicted beyond it.
+        - upstreams: Mirror URL templates (with $repo and $arch) tried in order.
+        - timeout: Upstream connection timeout in seconds.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.upstreams = list(upstreams)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()  # relative path -> size, least recently used first
+        self.fetched_at = {}
+        self.inflight = {}
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_existing()
+
+    def _index_existing(self):
+        files = []
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".part"):
+                    continue
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_atime, os.path.relpath(path, self.cache_dir), stat.st_size))
+        for _, relative, size in sorted(files):
+            self.entries[relative] = size
+            self.total_size += size
+        self._evict()
+
+    def local_path(self, relative):
+        return os.path.join(self.cache_dir, relative)
+
+    def upstream_urls(self, relative):
+        """Maps a $repo/os/$arch/<file> request path to the matching URL on every upstream."""
+        parts = relative.split("/")
+        if len(parts) != 4 or parts[1] != "os":
+            return []
+        repo, _, arch, filename = parts
+        return [template.replace("$repo", repo).replace("$arch", arch).rstrip("/") + "/" + filename
+                for template in self.upstreams]
+
+    def _is_fresh(self, relative):
+        if relative not in self.entries:
+            return False
+        if relative.endswith(IMMUTABLE_SUFFIXES):
+            return True
+        return time.time() - self.fetched_at.get(relative, 0) < DATABASE_TTL
+
+    def _evict(self):
+        # Called with the lock held (or before the server starts)
+        while self.total_size > self.max_size and self.entries:
+            relative, size = self.entries.popitem(last=False)
+            self.total_size -= size
+            self.fetched_at.pop(relative, None)
+            try:
+                os.unlink(self.local_path(relative))
+            except OSError:
+                pass
+
+    def _download(self, relative):
+        destination = self.local_path(relative)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        partial = f"{destination}.{threading.get_ident()}.part"
+        for url in self.upstream_urls(relative):
+            try:
+                with urllib.request.urlopen(url, timeout=self.timeout) as response, open(partial, "wb") as f:
+                    shutil.copyfileobj(response, f, 1024 * 1024)
+                os.replace(partial, destination)
+                return os.path.getsize(destination)
+            except Exception as e:
+                logging.error(f"Cache proxy could not fetch {url}: {str(e)}")
+                if os.path.exists(partial):
+                    os.unlink(partial)
+        return None
+
+    def get(self, relative):
+        """
+        Returns the local path of a cached file, downloading it first if needed.
+
+        Concurrent requests for the same missing file wait for a single download.
+
+        Returns:
+        - Local file path, or None if no upstream has the file.
+        """
+        while True:
+            with self.lock:
+                if self._is_fresh(relative):
+                    self.entries.move_to_end(relative)
+                    self.hits += 1
+                    return self.local_path(relative)
+                waiter = self.inflight.get(relative)
+                if waiter is None:
+                    waiter = self.inflight[relative] = threading.Event()
+                    self.misses += 1
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                waiter.wait()
+                with self.lock:
+                    if relative not in self.entries:
+                        return None  # The owning download failed
+                continue
+
+            size = None
+            try:
+                size = self._download(relative)
+            finally:
+                with self.lock:
+                    if size is not None:
+                        self.total_size += size - self.entries.pop(relative, 0)
+                        self.entries[relative] = size
+                        self.fetched_at[relative] = time.time()
+                        self._evict()
+                    del self.inflight[relative]
+                waiter.set()
+            if size is None:
+                return None
+            with self.lock:
+                return self.local_path(relative) if relative in self.entries else None
+
+
+class CacheProxyHandler(BaseHTTPRequestHandler):
+    store = None  # Set by make_server
+
+    def _serve(self, include_body):
+        relative = os.path.normpath(self.path.split("?", 1)[0]).lstrip("/")
+        if relative.startswith("..") or not relative:
+            self.send_error(400)
+            return
+        path = self.store.get(relative)
+        if path is None:
+            self.send_error(404)
+            return
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404)  # Evicted between lookup and open
+            return
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            if include_body:
+                shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+    def log_message(self, format, *args):
+        logging.info("cache proxy: " + format % args)
+
+
+def make_server(store, host="0.0.0.0", port=DEFAULT_PORT):
+    """Creates the threaded HTTP server for a store without starting it."""
+    handler = type("BoundCacheProxyHandler", (CacheProxyHandler,), {"store": store})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def answer_discovery(http_port, udp_port=DISCOVERY_PORT, stop_event=None):
+    """Replies to discovery broadcasts from other installer instances with the proxy's HTTP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("", udp_port))
+        sock.settimeout(1.0)
+        while stop_event is None or not stop_event.is_set():
+            try:
+                data, sender = sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            if data.strip() == DISCOVERY_REQUEST:
+                sock.sendto(DISCOVERY_REPLY + b" " + str(http_port).encode(), sender)
+
+
+def discover_cache_proxy(timeout=1.0, address="<broadcast>", udp_port=DISCOVERY_PORT):
+    """
+    Looks for a cache proxy on the local network.
+
+    Returns:
+    - Base URL of the first proxy that answered, or None.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.settimeout(timeout)
+        try:
+            sock.sendto(DISCOVERY_REQUEST, (address, udp_port))
+            data, sender = sock.recvfrom(512)
+        except OSError:
+            return None
+    parts = data.split()
+    if len(parts) != 2 or parts[0] != DISCOVERY_REPLY or not parts[1].isdigit():
+        return None
+    return f"http://{sender[0]}:{int(parts[1])}"
+
+
+def use_cache_proxy(proxy_url, mirrorlist=PROXY_MIRRORLIST, pacman_conf=PACMAN_CONF):
+    """
+    Puts the proxy in front of every repository of the live host.
+
+    The proxy goes into its own mirrorlist that the host's pacman.conf includes first.
+    The regular mirrorlist is left alone, since pacstrap copies it into the target and
+    the installed system must not keep a server that is only reachable during the install.
+    """
+    atomic_write(mirrorlist, f"## LAN package cache\nServer = {proxy_url}/$repo/os/$arch\n")
+    with edit_pacman_conf(pacman_conf) as conf:
+        conf.prepend_include(mirrorlist)
+
+
+def detect_and_use_cache_proxy():
+    """Points the live mirrorlist at a LAN cache proxy if one answers."""
+    proxy_url = discover_cache_proxy()
+    if proxy_url:
+        logging.info(f"Using LAN package cache at {proxy_url}")
+        use_cache_proxy(proxy_url)
+    return proxy_url
+
+
+def serve(cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE, port=DEFAULT_PORT, upstreams=None):
+    """
+    Runs the caching proxy until interrupted.
+
+    Parameters:
+    - cache_dir: Directory holding cached packages.
+    - max_size: Cache size budget in bytes.
+    - port: HTTP port to listen on.
+    - upstreams: Mirror URL templates; defaults to the ranked live mirrorlist.
+    """
+    if not upstreams:
+        upstreams = [result.url for result in mirrors.ranked_mirrors()[:mirrors.DEFAULT_MIRROR_COUNT]]
+    if not upstreams:
+        print("No upstream mirror available for the cache proxy.")
+        return
+    store = PackageStore(cache_dir, max_size, upstreams)
+    server = make_server(store, port=port)
+    stop_event = threading.Event()
+    threading.Thread(target=answer_discovery, args=(port, DISCOVERY_PORT, stop_event), daemon=True).start()
+    print(f"Serving package cache from {cache_dir} on port {port} ({max_size / 1024 ** 3:.1f} GiB budget)")
+    print(f"Upstream: {upstreams[0]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+        print(f"Cache hits: {store.hits}, misses: {store.misses}, stored: {store.total_size / 1048576:.1f} MiB")
@@ -0,0 +1,320 @@
+# Standard library imports
+import collections
+import contextlib
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+
+from libs import utils
+from libs.trace import tracer
+
+# The same API file systems arch-chroot mounts, as (source, target, mount arguments)
+CHROOT_MOUNTS = [
+    ("proc", "proc", ["-t", "proc", "-o", "nosuid,noexec,nodev"]),
+    ("sys", "sys", ["-t", "sysfs", "-o", "nosuid,noexec,nodev,ro"]),
+    ("efivarfs", "sys/firmware/efi/efivars", ["-t", "efivarfs", "-o", "nosuid,noexec,nodev"]),
+    ("udev", "dev", ["-t", "devtmpfs", "-o", "mode=0755,nosuid"]),
+    ("devpts", "dev/pts", ["-t", "devpts", "-o", "mode=0620,gid=5,nosuid,noexec"]),
+    ("shm", "dev/shm", ["-t", "tmpfs", "-o", "mode=1777,nosuid,nodev"]),
+    ("/run", "run", ["--bind", "--make-private"]),
+    ("tmp", "tmp", ["-t", "tmpfs", "-o", "mode=1777,strictatime,nodev,nosuid"]),
+    ("/etc/resolv.conf", "etc/resolv.conf", ["--bind"]),
+]
+
+TARGET_PATH = "/usr/local/sbin:/usr/local/bin:/usr/bin:/usr/sbin:/bin:/sbin"
+# Directory holding the libs package, so a fresh interpreter can start the worker module
+_SOURCE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_active_session = None
+
+
+def _worker_run(conn, send_lock, command, input=None):
+    """
+    Runs one command inside the chroot and streams its output back to the installer.
+
+    Returns:
+    - The exit code and the command's (user CPU, system CPU, peak RSS in KiB). The command
+      is not the installer's child, so its RUSAGE_CHILDREN never sees it; the worker runs
+      one command at a time, so its own delta belongs to this command alone.
+    """
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True,
+                               stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                               text=True, errors="replace", bufsize=1)
+    if input is not None:
+        utils.feed_stdin(process, input)
+
+    def pump(stream_name, pipe):
+        for line in pipe:
+            with send_lock:
+                conn.send(("line", stream_name, line))
+        pipe.close()
+
+    stderr_reader = threading.Thread(target=pump, args=("stderr", process.stderr), daemon=True)
+    stderr_reader.start()
+    pump("stdout", process.stdout)
+    stderr_reader.join()
+    returncode = process.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return returncode, (after.ru_utime - before.ru_utime, after.ru_stime - before.ru_stime, after.ru_maxrss)
+
+
+def _worker(conn, root):
+    """Main loop of the worker process living inside the target system."""
+    os.chroot(root)
+    os.chdir("/")
+    os.environ["PATH"] = TARGET_PATH
+    send_lock = threading.Lock()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        kind = message[0]
+        if kind == "stop":
+            return
+        try:
+            usage = None
+            if kind == "run":
+                code, usage = _worker_run(conn, send_lock, message[1], message[2])
+            elif kind == "write":
+                path, data, append, mode = message[1:]
+                with open(path, "a" if append else "w") as f:
+                    f.write(data)
+                if mode is not None:
+                    os.chmod(path, mode)
+                code = 0
+            else:
+                raise Exception(f"Unknown chroot request: {kind}")
+            conn.send(("exit", code, usage))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class ChrootSession:
+    """
+    A long-lived worker process inside the target system.
+
+    The API file systems are mounted once and a worker chroots into the target.
+    The worker is a fresh interpreter rather than a fork: forking the installer
+    while its pool, logging or probe threads hold a lock would deadlock the
+    child. Commands and file writes are sent to it as framed messages over a
+    pipe, and output lines stream back as they are produced.
+    """
+    def __init__(self, root="/mnt", log_file="install_log.txt"):
+        self.root = root
+        self.log_file = log_file
+        self.mounts = []
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def _mount(self):
+        for source, target, args in CHROOT_MOUNTS:
+            path = os.path.join(self.root, target)
+            if source == "efivarfs" and not os.path.isdir(path):
+                continue
+            if source == "/etc/resolv.conf":
+                # A symlinked resolv.conf (systemd-resolved) is left alone, as arch-chroot does
+                if not os.path.exists(source) or os.path.islink(path):
+                    continue
+                if not os.path.exists(path):
+                    open(path, "a").close()
+            elif os.path.ismount(path):
+                continue
+            else:
+                os.makedirs(path, exist_ok=True)
+            tracer.run(["mount", source, path] + args, check=True, capture_output=True)
+            self.mounts.append(path)
+
+    def _unmount(self):
+        for path in reversed(self.mounts):
+            if tracer.run(["umount", path], capture_output=True).returncode != 0:
+                # Something still holds the mount; detach it so the target can be unmounted later
+                tracer.run(["umount", "--lazy", path], capture_output=True)
+        self.mounts = []
+
+    def _start_worker(self):
+        parent_conn, child_conn = Pipe()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [_SOURCE_ROOT, env.get("PYTHONPATH")]))
+        try:
+            # The terminal belongs to the curses UI; all worker output goes through the pipe
+            self.process = subprocess.Popen([sys.executable, "-m", "libs.chroot", str(child_conn.fileno()), self.root],
+                                            pass_fds=[child_conn.fileno()], env=env, stdin=subprocess.DEVNULL,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        finally:
+            child_conn.close()
+        self.conn = parent_conn
+
+    def start(self):
+        """Mounts the API file systems and starts the worker inside the target."""
+        global _active_session
+        try:
+            self._mount()
+            self._start_worker()
+        except Exception:
+            self._unmount()
+            raise
+        _active_session = self
+        logging.info(f"Started chroot session in {self.root} (worker pid {self.process.pid})")
+
+    def stop(self):
+        """Stops the worker and unmounts everything the session mounted, even after errors."""
+        global _active_session
+        if _active_session is self:
+            _active_session = None
+        if self.conn is not None:
+            try:
+                self.conn.send(("stop",))
+            except OSError:
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.wait()
+            self.process = None
+        self._unmount()
+
+    def _request(self, message, callbacks=None, span=None):
+        if self.conn is None:
+            raise Exception("Chroot session is not running")
+        callbacks = callbacks or []
+        log = utils.get_log_handle(self.log_file)
+        tails = {
+            "stdout": collections.deque(maxlen=utils.OUTPUT_TAIL_LINES),
+            "stderr": collections.deque(maxlen=utils.OUTPUT_TAIL_LINES),
+        }
+        # The worker handles one request at a time; parallel steps queue here
+        with self.lock:
+            self.conn.send(message)
+            while True:
+                reply = self.conn.recv()
+                if reply[0] == "line":
+                    _, stream_name, line = reply
+                    tails[stream_name].append(line)
+                    log.write(line)
+                    for callback in callbacks:
+                        callback(stream_name, line)
+                elif reply[0] == "exit":
+                    _, returncode, usage = reply
+                    if span is not None and usage is not None:
+                        span.cpu_user, span.cpu_system, span.max_rss_kib = usage
+                        span.usage_reported = True
+                    break
+                else:
+                    raise Exception(f"Chroot worker error: {reply[1]}")
+        return subprocess.CompletedProcess(message[1], returncode, "".join(tails["stdout"]), "".join(tails["stderr"]))
+
+    def run(self, command, callbacks=None, input=None):
+        """
+        Runs a shell command inside the target.
+
+        Parameters:
+        - command: The shell command to execute.
+        - callbacks: Optional list of callables receiving (stream, line) for every output line.
+        - input: Text written to the command's stdin, e.g. a password for chpasswd.
+
+        Returns:
+        - subprocess.CompletedProcess with the exit code and the output tails.
+        """
+        with tracer.command(command) as span:
+            def count_output(stream_name, line):
+                span.output_bytes += len(line)
+
+            result = self._request(("run", command, input), list(callbacks or []) + [count_output], span)
+            span.exit_status = result.returncode
+            return result
+
+    def write_file(self, path, content, append=False, mode=None):
+        """Writes (or appends) text to a file inside the target."""
+        return self._request(("write", path, content, append, mode))
+
+
+def active_session():
+    """Returns the running chroot session, if any."""
+    return _active_session
+
+
+def target_path(path):
+    """Maps an absolute path in the target system to the path the installer can open directly."""
+    session = _active_session
+    if session is None:
+        return path
+    return os.path.join(session.root, path.lstrip("/"))
+
+
+@contextlib.contextmanager
+def target_session(root="/mnt"):
+    """
+    Makes sure commands and file writes reach the target system.
+
+    Reuses the active chroot session; otherwise a temporary one is started for the
+    duration of the block. Yields None when the installer already runs inside the
+    target's chroot, where plain commands and paths are the target's.
+    """
+    if _active_session is not None:
+        yield _active_session
+        return
+    if utils.is_inside_chroot():
+        yield None
+        return
+    if not os.path.ismount(root):
+        raise Exception(f"No target system is mounted at {root}")
+    with ChrootSession(root) as session:
+        yield session
+
+
+def run_in_target(command, check=True, input=None):
+    """
+    Runs a command in the target system.
+
+    Uses the active chroot session when there is one; otherwise the command runs in
+    the current environment, which is expected to be the chroot already. With
+    check=False a failing command is returned to the caller instead of ending the installer.
+    Secrets such as passwords are passed as input on stdin, so they never show up in
+    the command line, the trace or the logs.
+    """
+    session = _active_session
+    if session is None:
+        result = utils.stream_command(command, input=input)
+    else:
+        result = session.run(command, input=input)
+    if check and result.returncode != 0:
+        # Same contract as run_command
+        print(f"Error executing: {command}\n{result.stderr}")
+        exit(1)
+    return result
+
+
+def write_target_file(path, content, append=False):
+    """Writes a file in the target system, through the active chroot session when there is one."""
+    session = _active_session
+    if session is None:
+        with open(path, "a" if append else "w") as f:
+            f.write(content)
+        return
+    result = session.write_file(path, content, append)
+    if result.returncode != 0:
+        raise Exception(f"Error writing {path} in the target system")
+
+
+if __name__ == "__main__":
+    # Started by ChrootSession.start() as: python -m libs.chroot <connection fd> <root>
+    try:
+        _worker(Connection(int(sys.argv[1])), sys.argv[2])
+    except BaseException:
+        sys.exit(1)
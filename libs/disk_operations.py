@@ -7,10 +7,13 @@ import curses
 import logging
 from pathlib import Path
 from libs.bootloader import bootloader_menu
-from libs.utils import is_strong_password, run_command
+from libs.trace import tracer
+from libs.utils import is_strong_password, probes, run_command
+
+from libs.disks import btrfs
+from libs.disks import luks
+from libs.disks import partitions
 
-# Initialize logging
-logging.basicConfig(filename='disk_operations.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class SubvolumeModification:
     """Class to represent a Btrfs subvolume modification."""
@@ -38,18 +41,7 @@ def setup_encryption_choice(stdscr):
 
 def format_btrfs(stdscr, drive):
     """Format a drive with the Btrfs filesystem."""
-    stdscr.addstr(6, 0, "Do you want to enable Btrfs compression? (y/n): ")
-    choice = stdscr.getch()
-    try:
-        if choice == ord('y'):
-            run_command(f"mkfs.btrfs -f --compress=zstd {drive}2")
-        else:
-            run_command(f"mkfs.btrfs -f {drive}2")
-        stdscr.addstr(7, 0, "Partitions formatted successfully!")
-    except Exception as e:
-        logging.error(f"Error formatting drive: {str(e)}")
-        stdscr.addstr(7, 0, f"Error formatting drive: {str(e)}")
-    stdscr.getch()
+    btrfs.format_btrfs(stdscr, drive)
 
 def format_partitions_curses(stdscr, drive):
     if not drive:
@@ -60,10 +52,14 @@ def format_partitions_curses(stdscr, drive):
     if not confirm_formatting(stdscr, drive):
         return
 
+    layout = partitions.partition_disk(drive)
+    root = partitions.format_partitions(layout)
+
     if setup_encryption_choice(stdscr):
-        drive = setup_luks_encryption_curses(stdscr, drive)
+        root = setup_luks_encryption_curses(stdscr, root)
 
-    format_btrfs(stdscr, drive)
+    format_btrfs(stdscr, root)
+    return layout, root
 
 class FileSystemMenu:
     def __init__(self):
@@ -78,18 +74,24 @@ class FileSystemMenu:
         ]
         self.current_option = 0
         self.drive = None
+        self.layout = None
+        self.root = None  # Root partition, or its opened LUKS mapping
 
     def choose_drive(self, stdscr):
         self.drive = choose_drive_curses(stdscr)
 
     def format_partitions(self, stdscr):
-        format_partitions_curses(stdscr, self.drive)
+        formatted = format_partitions_curses(stdscr, self.drive)
+        if formatted:
+            self.layout, self.root = formatted
 
     def create_subvolumes(self, stdscr):
-        create_subvolumes_curses(stdscr, self.drive)
+        create_subvolumes_curses(stdscr, self.root or self.drive)
 
     def mount_file_system(self, stdscr):
-        mount_file_system_curses(stdscr, self.drive)
+        mount_file_system_curses(stdscr, self.root or self.drive)
+        if self.layout:
+            partitions.mount_boot_partitions(self.layout)
 
     def setup_zram(self, stdscr):
         setup_zram(self, stdscr)
@@ -139,8 +141,9 @@ class FileSystemMenu:
             elif key == curses.KEY_DOWN and self.current_option < len(self.menu_options) - 1:
                 self.current_option += 1
             elif key == curses.KEY_ENTER or key in [10, 13]:
-                _, selected_function = self.menu_options[self.current_option]
-                selected_function(stdscr)
+                option_name, selected_function = self.menu_options[self.current_option]
+                with tracer.step(option_name):
+                    selected_function(stdscr)
 
             stdscr.refresh()
 
@@ -159,7 +162,7 @@ def choose_drive_curses(stdscr):
     curses.init_pair(6, curses.COLOR_BLUE, curses.COLOR_BLACK)   # Bottom border
     curses.init_pair(7, curses.COLOR_YELLOW, curses.COLOR_BLACK) # Left border
 
-    drives = get_connected_drives()
+    drives = describe_connected_drives()
     current_option = 0
 
     while True:
@@ -222,13 +225,14 @@ def choose_drive_curses(stdscr):
                 install_filesystem_menu(stdscr)  # Return to the main menu
                 return
             else:
-                return drives[current_option]
+                return drives[current_option].split()[0]
 
         stdscr.refresh()
 
 
-def get_connected_drives():
-    result = run_command("lsblk -dpno NAME,SIZE,MODEL")
+def describe_connected_drives():
+    """Returns one "NAME SIZE MODEL" line per connected disk."""
+    result = probes.get("drives")
     lines = result.stdout.split("\n")
     drives = []
     for line in lines:
@@ -236,6 +240,10 @@ def get_connected_drives():
             drives.append(line.strip())
     return drives
 
+def get_connected_drives():
+    """Returns the device paths of the connected disks, e.g. /dev/nvme0n1."""
+    return [line.split()[0] for line in describe_connected_drives()]
+
 def setup_luks_encryption_curses(stdscr, drive):
     while True:
         stdscr.clear()
@@ -260,51 +268,21 @@ def setup_luks_encryption_curses(stdscr, drive):
             continue
         break
 
+    # Encrypt with the cipher, sector size and Argon2 cost tuned for this machine, then open it
+    stdscr.addstr(5, 0, "Benchmarking ciphers...")
+    stdscr.refresh()
+    plan = luks.plan_luks(drive)
+    stdscr.addstr(6, 0, f"Encrypting {drive}: {plan.report()}")
+    stdscr.refresh()
+    return luks.format_luks(drive, passphrase, plan)  # Return the path to the opened encrypted partition
+
 
 def create_subvolumes_curses(stdscr, drive):
-    # Unmount /mnt before creating subvolumes
-    run_command("umount /mnt")
-
-    # Mount the drive to /mnt
-    run_command(f"mount {drive} /mnt")
-
-    # Define the subvolumes
-    subvolumes = [
-        SubvolumeModification(Path('@'), Path('/')),
-        SubvolumeModification(Path('@home'), Path('/home')),
-        SubvolumeModification(Path('@log'), Path('/var/log')),
-        SubvolumeModification(Path('@pkg'), Path('/var/cache/pacman/pkg')),
-        SubvolumeModification(Path('@.snapshots'), Path('/.snapshots'))
-    ]
-
-    # Create the specified subvolumes
-    for idx, subvol in enumerate(subvolumes):
-        run_command(f"btrfs subvolume create /mnt{subvol.name}")
-        stdscr.addstr(idx, 0, f"Created subvolume: {subvol.name}")
-
-    # Unmount after creating subvolumes
-    run_command("umount /mnt")
-    stdscr.addstr(len(subvolumes), 0, "Subvolumes created successfully!")
-    stdscr.getch()
+    btrfs.create_subvolumes_curses(stdscr, drive)
 
 def mount_file_system_curses(stdscr, drive):
-    # Unmount /mnt before mounting the new system
-    run_command("umount /mnt")
-
-    run_command(f"mount -o compress=zstd,subvol=@ {drive} /mnt")
-    stdscr.addstr(0, 0, "Mounted root filesystem.")
-
-
-    stdscr.addstr(6, 0, "Filesystem mounted successfully!")
-    stdscr.getch()
-
-    # Encrypt the partition
-    run_command(f"echo -n {passphrase} | cryptsetup luksFormat {drive} -")
-
-    # Open the encrypted partition
-    run_command(f"echo -n {passphrase} | cryptsetup open {drive} cryptroot -")
-
-    return "/dev/mapper/cryptroot"  # Return the path to the opened encrypted partition
+    # Subvolumes are mounted with options planned for the device
+    btrfs.mount_file_system_curses(stdscr, drive)
 
 
 # Define the SubvolumeModification class outside of the function for clarity
@@ -316,7 +294,16 @@ class SubvolumeModification:
 
 def configure_fstab():
     """Generate the fstab file."""
-    run_command("genfstab -U /mnt >> /mnt/etc/fstab")
+    planned = btrfs.fstab_lines()
+    if not planned:
+        run_command("genfstab -U /mnt >> /mnt/etc/fstab")
+        return
+    # genfstab covers everything else, e.g. the ESP; the subvolumes use the planned lines
+    planned_mount_points = {line.split("\t")[1] for line in planned}
+    generated = [line for line in run_command("genfstab -U /mnt").stdout.splitlines()
+                 if len(line.split()) < 2 or line.split()[1] not in planned_mount_points]
+    with open("/mnt/etc/fstab", "a") as fstab:
+        fstab.write("\n".join(planned + generated) + "\n")
 
 def setup_zram(self, stdscr):
     """Setup ZRAM for swap on Btrfs filesystem."""
@@ -325,16 +312,16 @@ def setup_zram(self, stdscr):
     zram_size = int(total_memory * 0.5)  # Using 50% of RAM for ZRAM
 
     # Load the zram module
-    os.system("modprobe zram")
+    tracer.system("modprobe zram")
 
     # Create a zram device
-    os.system(f"echo {zram_size} > /sys/block/zram0/disksize")
+    tracer.system(f"echo {zram_size} > /sys/block/zram0/disksize")
 
     # Format the zram device as swap
-    os.system("mkswap /dev/zram0")
+    tracer.system("mkswap /dev/zram0")
 
     # Enable the swap
-    os.system("swapon /dev/zram0")
+    tracer.system("swapon /dev/zram0")
 
     # Add the zram swap to fstab to ensure it's available after reboot
     with open("/etc/fstab", "a") as fstab:
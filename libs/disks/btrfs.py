@@ -1,10 +1,16 @@
 import os
+import curses
+import functools
+import hashlib
 import logging
+import time
+import zlib
 from pathlib import Path
-from libs.utils import run_command
+from libs import hardware
+from libs.trace import tracer
+from libs.disks import luks
+from libs.utils import is_strong_password, run_command, stream_command
 
-# Initialize logging
-logging.basicConfig(filename='btrfs.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def setup_luks_encryption_curses(stdscr, drive):
     while True:
@@ -30,21 +36,598 @@ def setup_luks_encryption_curses(stdscr, drive):
             continue
         break
 
+    # Encrypt with the cipher, sector size and Argon2 cost tuned for this machine, then open it
+    stdscr.addstr(5, 0, "Benchmarking ciphers...")
+    stdscr.refresh()
+    plan = luks.plan_luks(drive)
+    stdscr.addstr(6, 0, f"Encrypting {drive}: {plan.report()}")
+    stdscr.refresh()
+    return luks.format_luks(drive, passphrase, plan)  # Return the path to the opened encrypted partition
+
+
+MOUNT_ROOT = "/mnt"
+SYS_BLOCK = "sys/class/block"
+
+# Seconds between transaction commits; longer intervals batch more writes into each seek on disks
+COMMIT_INTERVAL_FLASH = 60
+COMMIT_INTERVAL_ROTATIONAL = 120
+
+
 class SubvolumeModification:
     """Class to represent a Btrfs subvolume modification."""
-    def __init__(self, name, mount_point):
+    def __init__(self, name, mount_point, compress=True):
         self.name = name
         self.mount_point = mount_point
+        self.compress = compress  # False for data that is already compressed
 
-def format_btrfs(stdscr, drive):
-    """Format a drive with the Btrfs filesystem."""
-    stdscr.addstr(6, 0, "Do you want to enable Btrfs compression? (y/n): ")
-    choice = stdscr.getch()
+
+SUBVOLUMES = [
+    SubvolumeModification(Path('@'), Path('/')),
+    SubvolumeModification(Path('@home'), Path('/home')),
+    SubvolumeModification(Path('@log'), Path('/var/log')),
+    # Packages are zstd archives already; compressing them again only costs CPU
+    SubvolumeModification(Path('@pkg'), Path('/var/cache/pacman/pkg'), compress=False),
+    SubvolumeModification(Path('@.snapshots'), Path('/.snapshots'))
+]
+
+
+class BlockDeviceInfo:
+    """Queue properties of the block device holding the filesystem, read from sysfs."""
+    def __init__(self, name, rotational=False, discard_granularity=0, transport=''):
+        self.name = name
+        self.rotational = rotational
+        self.discard_granularity = discard_granularity
+        self.transport = transport  # nvme, mmc, virtio, sata (sd*), loop, or '' when unknown
+
+    @property
+    def supports_discard(self):
+        return self.discard_granularity > 0
+
+    @classmethod
+    def read(cls, device, root='/'):
+        """
+        Reads the queue of a device node, following partitions to their disk and
+        device-mapper targets (LUKS) to the disk below them for the transport.
+
+        Parameters:
+        - device: Device node, e.g. /dev/nvme0n1p2 or /dev/mapper/cryptroot.
+        - root: Directory holding sys/; a fake sysfs tree can be used in tests.
+        """
+        name = os.path.basename(os.path.realpath(device))
+        block_dir = os.path.realpath(os.path.join(root, SYS_BLOCK, name))
+        queue_dir = os.path.join(block_dir, 'queue')
+        if os.path.exists(os.path.join(block_dir, 'partition')):
+            queue_dir = os.path.join(os.path.dirname(block_dir), 'queue')
+
+        def read_int(filename):
+            try:
+                with open(os.path.join(queue_dir, filename)) as f:
+                    return int(f.read().strip())
+            except (OSError, ValueError):
+                return 0
+
+        # The transport is that of the lowest device, e.g. the NVMe disk under a dm-crypt mapping
+        base = name
+        slaves_dir = os.path.join(root, SYS_BLOCK, base, 'slaves')
+        while os.path.isdir(slaves_dir) and os.listdir(slaves_dir):
+            base = sorted(os.listdir(slaves_dir))[0]
+            slaves_dir = os.path.join(root, SYS_BLOCK, base, 'slaves')
+        return cls(name, read_int('rotational') == 1, read_int('discard_granularity'), _transport(base))
+
+
+def _transport(name):
+    for prefix, transport in (('nvme', 'nvme'), ('mmcblk', 'mmc'), ('vd', 'virtio'), ('sd', 'sata'), ('loop', 'loop')):
+        if name.startswith(prefix):
+            return transport
+    return ''
+
+
+class MountEntry:
+    """One subvolume mount: where it goes and the options it is mounted with."""
+    def __init__(self, subvolume, options):
+        self.subvolume = subvolume
+        self.options = options
+
+    @property
+    def mount_point(self):
+        return str(self.subvolume.mount_point)
+
+    def option_string(self):
+        return ",".join(self.options + [f"subvol=/{self.subvolume.name}"])
+
+    def fstab_line(self, uuid):
+        return f"UUID={uuid}\t{self.mount_point}\tbtrfs\t{self.option_string()}\t0 0"
+
+
+def plan_mounts(device_info, subvolumes=SUBVOLUMES):
+    """
+    Builds the mount options of every subvolume from the device's queue properties.
+
+    Btrfs applies most options (compression, discard, commit, space cache) to the
+    whole filesystem, so those are identical on every line; subvolumes that must
+    not be compressed get the compression property instead (see mount_subvolumes).
+
+    Parameters:
+    - device_info: BlockDeviceInfo of the filesystem's device.
+    - subvolumes: SubvolumeModification list.
+
+    Returns:
+    - MountEntry list in mount order: parents before the subvolumes mounted inside them.
+    """
+    options = ["noatime", "space_cache=v2"]
+    if not device_info.rotational:
+        options.append("ssd")
+    if device_info.supports_discard:
+        options.append("discard=async")
+    # Fast NVMe drives outrun zstd's default level, so its cheapest level keeps writes at device speed
+    options.append("compress=zstd:1" if device_info.transport == 'nvme' else "compress=zstd:3")
+    commit = COMMIT_INTERVAL_ROTATIONAL if device_info.rotational else COMMIT_INTERVAL_FLASH
+    options.append(f"commit={commit}")
+
+    ordered = sorted(subvolumes, key=lambda subvol: len(Path(subvol.mount_point).parts))
+    return [MountEntry(subvol, list(options)) for subvol in ordered]
+
+
+# Device and mounts of the last mount_subvolumes() run, used when fstab is written
+mounted_device = None
+mounted_entries = []
+
+
+def mount_subvolumes(device, entries, root=MOUNT_ROOT):
+    """Mounts the planned subvolumes under root in order and disables compression where planned."""
+    global mounted_device, mounted_entries
+    for entry in entries:
+        target = os.path.join(root, entry.mount_point.lstrip('/'))
+        os.makedirs(target, exist_ok=True)
+        run_command(f"mount -o {entry.option_string()} {device} {target}")
+        if not entry.subvolume.compress:
+            # New files inherit the property of the subvolume's top directory
+            run_command(f"btrfs property set -t inode {target} compression none")
+    mounted_device = device
+    mounted_entries = entries
+
+
+def fstab_lines(device=None, entries=None):
+    """Returns the fstab lines of the mounted subvolumes, identified by filesystem UUID."""
+    device = device or mounted_device
+    entries = mounted_entries if entries is None else entries
+    if not device or not entries:
+        return []
+    uuid = run_command(f"blkid -s UUID -o value {device}").stdout.strip()
+    return [entry.fstab_line(uuid) for entry in entries]
+
+SYS_BTRFS_FEATURES = "/sys/fs/btrfs/features"
+DEFAULT_NODESIZE = 16384
+BENCHMARK_BLOCK = 4096             # Checksums are computed per 4 KiB data block
+BENCHMARK_BYTES = 32 * 1024 * 1024
+BLAKE2_MIN_THROUGHPUT = 1024 ** 3  # Bytes/s per core below which blake2 would slow down writes
+
+
+@functools.lru_cache(maxsize=None)
+def progs_features():
+    """
+    Lists the mkfs features and checksums the installed btrfs-progs supports.
+
+    Returns:
+    - Tuple of (set of -O feature names, set of --csum algorithms).
+    """
+    result = stream_command("mkfs.btrfs -O list-all")
+    features = set()
+    for line in (result.stdout + result.stderr).splitlines():
+        name, _, description = line.partition(" - ")
+        if description and name.strip() and " " not in name.strip():
+            features.add(name.strip())
+    # --csum arrived in btrfs-progs 5.5 together with xxhash, sha256 and blake2
+    help_text = stream_command("mkfs.btrfs --help")
+    csums = {"crc32c"}
+    if "--csum" in help_text.stdout + help_text.stderr:
+        csums |= {"xxhash", "sha256", "blake2"}
+    return features, csums
+
+
+def kernel_supports(feature, features_dir=SYS_BTRFS_FEATURES):
+    """Checks the running kernel's btrfs feature list; unknown when the module is not loaded."""
+    if not os.path.isdir(features_dir):
+        return True
+    return os.path.exists(os.path.join(features_dir, feature.replace("-", "_")))
+
+
+def benchmark_checksums(total=BENCHMARK_BYTES, block=BENCHMARK_BLOCK):
+    """
+    Measures in-process hashing throughput per core in bytes/s.
+
+    zlib's CRC32 stands in for software crc32c, and hashlib's blake2b is the same
+    function btrfs uses for blake2. xxhash has no stdlib implementation.
+    """
+    data = os.urandom(block)
+    rounds = max(1, total // block)
+    results = {}
+    for name, func in (("crc32", zlib.crc32), ("blake2", lambda chunk: hashlib.blake2b(chunk, digest_size=32).digest())):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func(data)
+        results[name] = rounds * block / max(time.perf_counter() - start, 1e-9)
+    return results
+
+
+def choose_checksum(cpu_flags, csums, strong=False, benchmark=None):
+    """
+    Picks the checksum algorithm.
+
+    Parameters:
+    - cpu_flags: CPU feature flags; sse4_2 (x86) and crc32 (arm64) compute crc32c in hardware.
+    - csums: Algorithms btrfs-progs supports.
+    - strong: Prefer a cryptographic hash (e.g. for deduplication tools) if it is fast enough here.
+    - benchmark: Result of benchmark_checksums(), measured when needed and not given.
+
+    Returns:
+    - Tuple of (algorithm, reason).
+    """
+    if strong and "blake2" in csums:
+        benchmark = benchmark or benchmark_checksums()
+        if benchmark["blake2"] >= BLAKE2_MIN_THROUGHPUT:
+            return "blake2", f"blake2 hashes {benchmark['blake2'] / 1024 ** 2:.0f} MiB/s per core"
+        logging.info(f"blake2 only reaches {benchmark['blake2'] / 1024 ** 2:.0f} MiB/s per core; not using it")
+    if "sse4_2" in cpu_flags or "crc32" in cpu_flags:
+        return "crc32c", "crc32c is computed in hardware"
+    if "xxhash" in csums:
+        return "xxhash", "no hardware crc32c; xxhash is the fastest software checksum"
+    return "crc32c", "btrfs-progs only supports crc32c"
+
+
+class MkfsPlan:
+    """On-disk format chosen for a new Btrfs filesystem."""
+    def __init__(self, checksum="crc32c", nodesize=DEFAULT_NODESIZE, features=None,
+                 data_profile=None, metadata_profile=None, reason=""):
+        self.checksum = checksum
+        self.nodesize = nodesize
+        self.features = features or []
+        self.data_profile = data_profile
+        self.metadata_profile = metadata_profile
+        self.reason = reason
+
+    def command(self, devices):
+        """Builds the mkfs.btrfs command line for the given device nodes."""
+        if isinstance(devices, str):
+            devices = [devices]
+        parts = ["mkfs.btrfs", "-f"]
+        # crc32c is the default, and btrfs-progs older than 5.5 reject --csum altogether
+        if self.checksum != "crc32c":
+            parts.append(f"--csum {self.checksum}")
+        parts.append(f"--nodesize {self.nodesize}")
+        if self.features:
+            parts.append("-O " + ",".join(self.features))
+        if self.data_profile:
+            parts.append(f"-d {self.data_profile}")
+        if self.metadata_profile:
+            parts.append(f"-m {self.metadata_profile}")
+        return " ".join(parts + list(devices))
+
+    def report(self):
+        return (f"csum {self.checksum} ({self.reason}), nodesize {self.nodesize // 1024}K, "
+                f"features {','.join(self.features) or 'defaults'}, "
+                f"data {self.data_profile or 'default'}, metadata {self.metadata_profile or 'default'}")
+
+
+def plan_mkfs(device_count=1, data_profile=None, metadata_profile=None, strong_checksum=False,
+              cpu_flags=None, supported=None):
+    """
+    Chooses checksum, node size, features and profiles for mkfs.btrfs.
+
+    Parameters:
+    - device_count: Number of devices the filesystem spans.
+    - data_profile, metadata_profile: Block group profiles; chosen for the device count when None.
+    - strong_checksum: Prefer blake2 when this machine hashes it fast enough.
+    - cpu_flags: CPU flags (defaults to the hardware profile).
+    - supported: Result of progs_features() (defaults to the installed btrfs-progs).
+
+    Returns:
+    - MkfsPlan.
+    """
+    features, csums = supported or progs_features()
+    if cpu_flags is None:
+        cpu_flags = hardware.profile().cpu_flags
+    checksum, reason = choose_checksum(set(cpu_flags), csums, strong_checksum)
+
+    # A node smaller than a page cannot be mounted, e.g. on 64 KiB-page arm64 kernels
+    nodesize = max(DEFAULT_NODESIZE, os.sysconf("SC_PAGE_SIZE"))
+
+    planned = []
+    # free-space-tree (space_cache=v2) avoids rewriting the free space cache on every commit
+    if "free-space-tree" in features:
+        planned.append("free-space-tree")
+    # block-group-tree keeps block group items together, so mounting does not walk the extent tree
+    if "block-group-tree" in features and "free-space-tree" in planned and kernel_supports("block-group-tree"):
+        if "no-holes" in features:
+            planned.append("no-holes")  # Required by block-group-tree
+        planned.append("block-group-tree")
+
+    if device_count > 1:
+        data_profile = data_profile or "raid1"
+        metadata_profile = metadata_profile or "raid1"
+    else:
+        data_profile = data_profile or "single"
+        metadata_profile = metadata_profile or "dup"
+    return MkfsPlan(checksum, nodesize, planned, data_profile, metadata_profile, reason)
+
+
+def _create_block_groups(mount_point, count, chunk=1024 ** 3):
+    # Preallocated files take real block groups without writing data to the image
+    for idx in range(count):
+        tracer.system(f"fallocate -l {chunk} {mount_point}/fill{idx}")
+
+
+def time_loop_mount(plan, image="/tmp/btrfs-plan.img", size=64 * 1024 ** 3, block_groups=48,
+                    mount_point="/tmp/btrfs-plan-mnt"):
+    """
+    Formats a sparse loop image with the plan, fills it with block groups and times a cold mount.
+
+    Returns:
+    - Seconds the mount took, or None if the image could not be set up.
+    """
+    with open(image, "wb") as f:
+        f.truncate(size)
+    loop = stream_command(f"losetup -f --show {image}").stdout.strip()
+    if not loop:
+        os.unlink(image)
+        return None
+    os.makedirs(mount_point, exist_ok=True)
+    elapsed = None
     try:
-        if choice == ord('y'):
-            run_command(f"mkfs.btrfs -f --compress=zstd {drive}2")
+        if stream_command(plan.command(loop)).returncode != 0:
+            return None
+        run_command(f"mount {loop} {mount_point}")
+        _create_block_groups(mount_point, block_groups)
+        run_command(f"umount {mount_point}")
+        tracer.system("sync; echo 3 > /proc/sys/vm/drop_caches")
+        start = time.monotonic()
+        run_command(f"mount {loop} {mount_point}")
+        elapsed = time.monotonic() - start
+        run_command(f"umount {mount_point}")
+    finally:
+        tracer.system(f"losetup -d {loop}")
+        os.unlink(image)
+    return elapsed
+
+
+def compare_mount_times(plan, **kwargs):
+    """
+    Times cold mounts of a loop image with and without the planned features.
+
+    Returns:
+    - Tuple of (seconds with the default format, seconds with the plan).
+    """
+    baseline = MkfsPlan(plan.checksum, plan.nodesize, [], plan.data_profile, plan.metadata_profile)
+    times = time_loop_mount(baseline, **kwargs), time_loop_mount(plan, **kwargs)
+    logging.info(f"Cold mount: {_seconds(times[0])} with default features, "
+                 f"{_seconds(times[1])} with {','.join(plan.features) or 'defaults'}")
+    return times
+
+
+def _seconds(value):
+    return "failed" if value is None else f"{value:.3f}s"
+
+
+CHUNK_SIZE = 1024 ** 3  # Per-device stripe of a data chunk
+MISMATCH_WARNING_RATIO = 0.05  # Warn when this share of the raw space can never be used
+
+# Block group profiles: (copies, minimum devices for mkfs, minimum devices per chunk,
+# device count step, whether chunks are striped over all devices with free space).
+# Since Linux 5.15 raid0 and raid10 chunks may use fewer devices once the smaller ones are full.
+RAID_PROFILES = {
+    "single": (1, 1, 1, 1, False),
+    "raid0": (1, 2, 1, 1, True),
+    "raid1": (2, 2, 2, 2, False),
+    "raid1c3": (3, 3, 3, 3, False),
+    "raid1c4": (4, 4, 4, 4, False),
+    "raid10": (2, 4, 2, 2, True),
+}
+# Metadata profile for each data profile: metadata stays mirrored even when data is striped
+METADATA_FOR_DATA = {"raid0": "raid1", "raid1": "raid1", "raid10": "raid1", "raid1c3": "raid1c3",
+                     "raid1c4": "raid1c4", "single": "dup"}
+
+
+def raid_profiles_for(device_count):
+    """Returns the data profiles that can be used with the given number of devices."""
+    return [name for name, (_, minimum, _, _, _) in RAID_PROFILES.items() if name != "single" and device_count >= minimum]
+
+
+def simulate_usable_capacity(sizes, profile, chunk=CHUNK_SIZE):
+    """
+    Simulates btrfs chunk allocation to find how much data a set of devices can hold.
+
+    Like the kernel, every chunk goes to the devices with the most free space;
+    striped profiles use as many of them as the profile allows.
+
+    Parameters:
+    - sizes: Device sizes in bytes.
+    - profile: Data profile name from RAID_PROFILES.
+
+    Returns:
+    - Tuple of (usable bytes, list of bytes left unallocatable on each device).
+    """
+    copies, _, minimum, step, striped = RAID_PROFILES[profile]
+    free = [size // chunk for size in sizes]
+    usable = 0
+    while True:
+        candidates = sorted((idx for idx, units in enumerate(free) if units > 0), key=lambda idx: -free[idx])
+        if len(candidates) < minimum:
+            break
+        count = len(candidates) - len(candidates) % step if striped else minimum
+        if count < minimum:
+            break
+        # Allocate as many equal chunks at once as the smallest chosen device allows
+        chosen = candidates[:count]
+        if count < len(candidates):
+            units = free[chosen[-1]] - free[candidates[count]] or 1
         else:
-            run_command(f"mkfs.btrfs -f {drive}2")
+            units = free[chosen[-1]]
+        units = min(units, min(free[idx] for idx in chosen))
+        for idx in chosen:
+            free[idx] -= units
+        usable += units * chunk * count // copies
+    return usable, [units * chunk for units in free]
+
+
+class RaidLayout:
+    """A Btrfs filesystem spanning several devices, with its expected capacity."""
+    def __init__(self, devices, sizes, data_profile="raid1", metadata_profile=None):
+        self.devices = list(devices)
+        self.sizes = list(sizes)
+        self.data_profile = data_profile
+        self.metadata_profile = metadata_profile or METADATA_FOR_DATA[data_profile]
+        self.usable, self.leftover = simulate_usable_capacity(self.sizes, data_profile)
+
+    @property
+    def raw(self):
+        return sum(self.sizes)
+
+    def problems(self):
+        """Returns the reasons the layout cannot be created, if any."""
+        problems = []
+        for kind, profile in (("data", self.data_profile), ("metadata", self.metadata_profile)):
+            if profile == "dup":
+                continue
+            minimum = RAID_PROFILES[profile][1]
+            if len(self.devices) < minimum:
+                problems.append(f"{profile} {kind} needs at least {minimum} devices")
+        return problems
+
+    def warnings(self):
+        """Warns when mismatched device sizes leave part of the raw space unusable."""
+        wasted = sum(self.leftover)
+        if not self.raw or wasted <= self.raw * MISMATCH_WARNING_RATIO:
+            return []
+        largest = max(range(len(self.sizes)), key=lambda idx: self.sizes[idx])
+        return [f"Device sizes differ: {wasted / 1024 ** 3:.0f} GiB cannot be used with {self.data_profile} "
+                f"(most of it on {self.devices[largest]})"]
+
+    def mkfs_plan(self, **kwargs):
+        return plan_mkfs(len(self.devices), self.data_profile, self.metadata_profile, **kwargs)
+
+    def report(self):
+        return (f"{self.data_profile} data / {self.metadata_profile} metadata on {len(self.devices)} devices: "
+                f"{self.usable / 1024 ** 3:.0f} GiB usable of {self.raw / 1024 ** 3:.0f} GiB raw")
+
+
+def device_size(device):
+    """Returns the size of a block device in bytes."""
+    return int(run_command(f"blockdev --getsize64 {device}").stdout.strip())
+
+
+def format_raid(devices, data_profile, metadata_profile=None):
+    """
+    Creates one Btrfs filesystem across all devices with a single mkfs command.
+
+    Returns:
+    - RaidLayout that was created.
+    """
+    layout = RaidLayout(devices, [device_size(device) for device in devices], data_profile, metadata_profile)
+    problems = layout.problems()
+    if problems:
+        raise ValueError("; ".join(problems))
+    for warning in layout.warnings():
+        logging.warning(warning)
+    run_command(layout.mkfs_plan().command(devices))
+    # Members must be known to the kernel before any one of them can be mounted
+    run_command("btrfs device scan")
+    logging.info(f"Created Btrfs {layout.report()}")
+    return layout
+
+
+def measure_throughput(mount_point, size=1024 ** 3, block=4 * 1024 ** 2):
+    """
+    Writes and reads back a file on a mounted filesystem, bypassing the page cache for the read.
+
+    Returns:
+    - Tuple of (write bytes/s, read bytes/s).
+    """
+    path = os.path.join(mount_point, "throughput.bin")
+    data = os.urandom(block)  # Incompressible, so compression cannot inflate the numbers
+    start = time.monotonic()
+    with open(path, "wb") as f:
+        for _ in range(size // block):
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    write_time = time.monotonic() - start
+    tracer.system("sync; echo 3 > /proc/sys/vm/drop_caches")
+    start = time.monotonic()
+    with open(path, "rb") as f:
+        while f.read(block):
+            pass
+    read_time = time.monotonic() - start
+    os.unlink(path)
+    return size / max(write_time, 1e-9), size / max(read_time, 1e-9)
+
+
+def compare_raid_throughput(profiles=("raid0", "raid1", "raid10"), count=4, size=8 * 1024 ** 3,
+                            image_dir="/tmp", mount_point="/tmp/btrfs-raid-mnt", test_size=1024 ** 3):
+    """
+    Builds each layout on loop devices and measures its sequential throughput.
+
+    Returns:
+    - Dictionary of profile name to (usable bytes, write bytes/s, read bytes/s).
+    """
+    images = [os.path.join(image_dir, f"btrfs-raid{idx}.img") for idx in range(count)]
+    loops = []
+    results = {}
+    os.makedirs(mount_point, exist_ok=True)
+    try:
+        for image in images:
+            with open(image, "wb") as f:
+                f.truncate(size)
+            loops.append(run_command(f"losetup -f --show {image}").stdout.strip())
+        for profile in profiles:
+            if len(loops) < RAID_PROFILES[profile][1]:
+                continue
+            layout = format_raid(loops, profile)
+            run_command(f"mount {loops[0]} {mount_point}")
+            try:
+                results[profile] = (layout.usable,) + measure_throughput(mount_point, test_size)
+                logging.info(_throughput_line(profile, *results[profile]))
+            finally:
+                run_command(f"umount {mount_point}")
+    finally:
+        for loop in loops:
+            tracer.system(f"losetup -d {loop}")
+        for image in images:
+            if os.path.exists(image):
+                os.unlink(image)
+    return results
+
+
+def _throughput_line(profile, usable, write, read):
+    return (f"{profile}: {usable / 1024 ** 3:.1f} GiB usable, write {write / 1024 ** 2:.0f} MiB/s, "
+            f"read {read / 1024 ** 2:.0f} MiB/s")
+
+
+def benchmark_layouts(plan=None, **raid_kwargs):
+    """
+    Runs the loop-device benchmarks: cold mount times of the mkfs plan and RAID profile throughput.
+
+    Needs root, loop devices and btrfs-progs; nothing on real disks is touched.
+
+    Returns:
+    - The results as text, one line per measurement.
+    """
+    plan = plan or plan_mkfs()
+    default_time, planned_time = compare_mount_times(plan)
+    lines = [f"Cold mount with default features: {_seconds(default_time)}",
+             f"Cold mount with {','.join(plan.features) or 'defaults'}: {_seconds(planned_time)}"]
+    for profile, result in compare_raid_throughput(**raid_kwargs).items():
+        lines.append(_throughput_line(profile, *result))
+    return "\n".join(lines)
+
+
+def format_btrfs(stdscr, drive):
+    """Format a partition (or opened LUKS mapping) with the Btrfs filesystem."""
+    # Compression is a mount option (see plan_mounts), not an on-disk format choice
+    plan = plan_mkfs()
+    h, w = stdscr.getmaxyx()
+    stdscr.addstr(6, 0, plan.report()[:w - 1])
+    try:
+        run_command(plan.command(drive))
         stdscr.addstr(7, 0, "Partitions formatted successfully!")
     except Exception as e:
         logging.error(f"Error formatting drive: {str(e)}")
@@ -52,24 +635,17 @@ def format_btrfs(stdscr, drive):
     stdscr.getch()
 
 def create_subvolumes_curses(stdscr, drive):
-    # Unmount /mnt before creating subvolumes
-    run_command("umount /mnt")
+    # Unmount anything left at /mnt before creating subvolumes
+    tracer.system("umount -R /mnt 2>/dev/null")
 
     # Mount the drive to /mnt
     run_command(f"mount {drive} /mnt")
 
-    # Define the subvolumes
-    subvolumes = [
-        SubvolumeModification(Path('@'), Path('/')),
-        SubvolumeModification(Path('@home'), Path('/home')),
-        SubvolumeModification(Path('@log'), Path('/var/log')),
-        SubvolumeModification(Path('@pkg'), Path('/var/cache/pacman/pkg')),
-        SubvolumeModification(Path('@.snapshots'), Path('/.snapshots'))
-    ]
+    subvolumes = SUBVOLUMES
 
     # Create the specified subvolumes
     for idx, subvol in enumerate(subvolumes):
-        run_command(f"btrfs subvolume create /mnt{subvol.name}")
+        run_command(f"btrfs subvolume create /mnt/{subvol.name}")
         stdscr.addstr(idx, 0, f"Created subvolume: {subvol.name}")
 
     # Unmount after creating subvolumes
@@ -78,13 +654,19 @@ def create_subvolumes_curses(stdscr, drive):
     stdscr.getch()
 
 def mount_file_system_curses(stdscr, drive):
-    # Unmount /mnt before mounting the new system
-    run_command("umount /mnt")
+    # Unmount anything left at /mnt before mounting the new system
+    tracer.system("umount -R /mnt 2>/dev/null")
 
-    run_command(f"mount -o compress=zstd,subvol=@ {drive} /mnt")
-    stdscr.addstr(0, 0, "Mounted root filesystem.")
+    device_info = BlockDeviceInfo.read(drive)
+    entries = plan_mounts(device_info)
+    mount_subvolumes(drive, entries)
+    h, w = stdscr.getmaxyx()
+    kind = "rotational" if device_info.rotational else (device_info.transport or "flash")
+    stdscr.addstr(0, 0, f"Mounted {len(entries)} subvolumes ({kind} device):")
+    for idx, entry in enumerate(entries):
+        stdscr.addstr(1 + idx, 0, f"{entry.mount_point}: {entry.option_string()}"[:w - 1])
 
-    stdscr.addstr(6, 0, "Filesystem mounted successfully!")
+    stdscr.addstr(2 + len(entries), 0, "Filesystem mounted successfully!")
     stdscr.getch()
 
 def setup_zram(self, stdscr):
@@ -94,16 +676,16 @@ def setup_zram(self, stdscr):
     zram_size = int(total_memory * 0.5)  # Using 50% of RAM for ZRAM
 
     # Load the zram module
-    os.system("modprobe zram")
+    tracer.system("modprobe zram")
 
     # Create a zram device
-    os.system(f"echo {zram_size} > /sys/block/zram0/disksize")
+    tracer.system(f"echo {zram_size} > /sys/block/zram0/disksize")
 
     # Format the zram device as swap
-    os.system("mkswap /dev/zram0")
+    tracer.system("mkswap /dev/zram0")
 
     # Enable the swap
-    os.system("swapon /dev/zram0")
+    tracer.system("swapon /dev/zram0")
 
     # Add the zram swap to fstab to ensure it's available after reboot
     with open("/etc/fstab", "a") as fstab:
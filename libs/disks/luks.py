@@ -0,0 +1,183 @@
+import logging
+import re
+from libs import hardware
+from libs.disks import btrfs
+from libs.disks import partitions
+from libs.trace import tracer
+from libs.utils import probes, run_command, stream_command
+
+MAPPING_NAME = "cryptroot"
+TARGET_UNLOCK_MS = 2000          # Time the passphrase check should take at boot
+ARGON2_MIN_MEMORY = 64 * 1024    # KiB
+ARGON2_MAX_MEMORY = 1024 * 1024  # KiB; cryptsetup's default, and safe to need again in the initramfs
+ARGON2_MIN_ITERATIONS = 4
+ARGON2_MAX_PARALLEL = 4
+KEY_SIZE_PREFERENCE = 0.05  # A larger key wins unless the smaller one is this much faster
+
+# Only XTS modes qualify: they are the standard for disk encryption and resist the CBC malleability attacks
+_CIPHER_LINE = re.compile(r"^\s*(\S+-xts)\s+(\d+)b\s+([\d.]+)\s+MiB/s\s+([\d.]+)\s+MiB/s", re.MULTILINE)
+_ARGON2_LINE = re.compile(r"^argon2id\s+(\d+)\s+iterations,\s+(\d+)\s+memory,\s+(\d+)\s+parallel threads"
+                          r"(?:.*?requested\s+(\d+)\s+ms)?", re.MULTILINE)
+
+
+def parse_benchmark(text):
+    """
+    Parses the output of cryptsetup benchmark.
+
+    Returns:
+    - Tuple of (list of (cipher, key bits, encryption MiB/s, decryption MiB/s) for XTS ciphers,
+      (iterations, memory KiB, threads, milliseconds) of the argon2id test or None).
+    """
+    ciphers = [(name, int(bits), float(enc), float(dec)) for name, bits, enc, dec in _CIPHER_LINE.findall(text)]
+    match = _ARGON2_LINE.search(text)
+    argon2 = None
+    if match:
+        argon2 = (int(match.group(1)), int(match.group(2)), int(match.group(3)), int(match.group(4) or TARGET_UNLOCK_MS))
+    return ciphers, argon2
+
+
+def choose_cipher(ciphers):
+    """
+    Picks the XTS cipher and key size with the best sustained throughput.
+
+    Throughput is the slower of encryption and decryption. A 512-bit key (AES-256)
+    is preferred over a 256-bit one unless the latter is clearly faster.
+
+    Returns:
+    - Tuple of (cryptsetup cipher spec, key bits, MiB/s), defaulting to aes-xts-plain64/512.
+    """
+    if not ciphers:
+        return "aes-xts-plain64", 512, None
+    best = max(ciphers, key=lambda entry: min(entry[2], entry[3]))
+    best_speed = min(best[2], best[3])
+    for name, bits, enc, dec in sorted(ciphers, key=lambda entry: -entry[1]):
+        if name == best[0] and min(enc, dec) >= best_speed * (1 - KEY_SIZE_PREFERENCE):
+            best, best_speed = (name, bits, enc, dec), min(enc, dec)
+            break
+    return f"{best[0]}-plain64", best[1], best_speed
+
+
+class LuksPlan:
+    """cryptsetup settings chosen for a device."""
+    def __init__(self, cipher="aes-xts-plain64", key_size=512, sector_size=4096, pbkdf_memory=ARGON2_MAX_MEMORY,
+                 pbkdf_iterations=ARGON2_MIN_ITERATIONS, pbkdf_parallel=ARGON2_MAX_PARALLEL, perf_flags=(),
+                 throughput=None):
+        self.cipher = cipher
+        self.key_size = key_size
+        self.sector_size = sector_size
+        self.pbkdf_memory = pbkdf_memory  # KiB
+        self.pbkdf_iterations = pbkdf_iterations
+        self.pbkdf_parallel = pbkdf_parallel
+        self.perf_flags = list(perf_flags)
+        self.throughput = throughput  # MiB/s measured by the benchmark
+
+    def format_args(self):
+        return ["-q", "--type", "luks2", "--cipher", self.cipher, "--key-size", str(self.key_size),
+                "--sector-size", str(self.sector_size), "--pbkdf", "argon2id",
+                "--pbkdf-memory", str(self.pbkdf_memory), "--pbkdf-force-iterations", str(self.pbkdf_iterations),
+                "--pbkdf-parallel", str(self.pbkdf_parallel)]
+
+    def open_args(self):
+        # --persistent stores the flags in the LUKS2 header, so every later unlock uses them too
+        return self.perf_flags + ["--persistent"] if self.perf_flags else []
+
+    def report(self):
+        speed = f" ({self.throughput:.0f} MiB/s)" if self.throughput else ""
+        return (f"{self.cipher} {self.key_size}-bit{speed}, {self.sector_size}-byte sectors, argon2id "
+                f"{self.pbkdf_memory // 1024} MiB x {self.pbkdf_iterations} iterations, "
+                f"{' '.join(self.perf_flags) or 'dm-crypt workqueues kept'}")
+
+
+def plan_luks(device, benchmark=None, mem_available=None, rotational=None, cpu_count=None,
+              target_ms=TARGET_UNLOCK_MS):
+    """
+    Tunes LUKS2 for a device from cryptsetup benchmark and the machine's memory.
+
+    Parameters:
+    - device: Partition to encrypt.
+    - benchmark: Output of cryptsetup benchmark (run when None).
+    - mem_available: Available memory in bytes (defaults to the hardware profile).
+    - rotational: Whether the device is a spinning disk (read from sysfs when None).
+    - cpu_count: CPUs for Argon2 parallelism (defaults to the hardware profile).
+    - target_ms: Unlock time the Argon2 cost is sized for.
+
+    Returns:
+    - LuksPlan.
+    """
+    machine = hardware.profile()
+    if benchmark is None:
+        benchmark = stream_command("cryptsetup benchmark").stdout
+    if mem_available is None:
+        mem_available = machine.mem_available
+    if rotational is None:
+        rotational = btrfs.BlockDeviceInfo.read(device).rotational
+    cpu_count = cpu_count or machine.cpu_count
+
+    ciphers, argon2 = parse_benchmark(benchmark)
+    cipher, key_size, throughput = choose_cipher(ciphers)
+
+    # One IV and crypto call per 4 KiB instead of per 512 bytes; needs a 4 KiB-aligned device size
+    size = partitions.DiskTopology.read(device).size
+    sector_size = 4096 if size and size % 4096 == 0 else 512
+
+    # A quarter of the free memory, so unlocking also works on the same machine under load
+    memory = max(ARGON2_MIN_MEMORY, min(ARGON2_MAX_MEMORY, mem_available // 4 // 1024))
+    parallel = max(1, min(ARGON2_MAX_PARALLEL, cpu_count))
+    iterations = ARGON2_MIN_ITERATIONS
+    if argon2:
+        bench_iterations, bench_memory, bench_parallel, bench_ms = argon2
+        # Argon2 time grows with memory x iterations and shrinks with parallel lanes
+        cost = bench_iterations * bench_memory / max(bench_parallel, 1) * target_ms / bench_ms
+        iterations = max(ARGON2_MIN_ITERATIONS, round(cost * parallel / memory))
+
+    # The work queues help spinning disks merge I/O; on flash they only add latency and context switches
+    perf_flags = [] if rotational else ["--perf-no_read_workqueue", "--perf-no_write_workqueue"]
+    return LuksPlan(cipher, key_size, sector_size, memory, iterations, parallel, perf_flags, throughput)
+
+
+def _cryptsetup(args, passphrase):
+    # The passphrase goes through stdin so it never appears in a command line or log
+    result = tracer.run(["cryptsetup"] + args, input=passphrase, text=True, capture_output=True)
+    if result.returncode != 0:
+        print(f"Error executing: cryptsetup {args[0]}\n{result.stderr}")
+        exit(1)
+    return result
+
+
+def format_luks(device, passphrase, plan=None, name=MAPPING_NAME):
+    """
+    Formats a device with the tuned LUKS2 settings and opens it.
+
+    Returns:
+    - Path of the opened mapping, e.g. /dev/mapper/cryptroot.
+    """
+    plan = plan or plan_luks(device)
+    logging.info(f"Encrypting {device}: {plan.report()}")
+    _cryptsetup(["luksFormat"] + plan.format_args() + ["--key-file=-", device], passphrase)
+    _cryptsetup(["open"] + plan.open_args() + ["--key-file=-", device, name], passphrase)
+    probes.invalidate("drives")
+    return f"/dev/mapper/{name}"
+
+
+def verify_luks_tuning(image="/tmp/luks-tune.img", size=256 * 1024 ** 2, passphrase="loop-device-test"):
+    """
+    Formats a loop device with the tuned settings and checks them in the LUKS2 header.
+
+    Returns:
+    - Tuple of (LuksPlan, list of settings missing from the header; empty when all were applied).
+    """
+    loop = partitions.attach_loop_image(image, size)
+    name = "luks-tune-test"
+    try:
+        plan = plan_luks(loop)
+        format_luks(loop, passphrase, plan, name)
+        tracer.system(f"cryptsetup close {name}")
+        dump = run_command(f"cryptsetup luksDump {loop}").stdout
+    finally:
+        partitions.detach_loop_image(loop, image)
+
+    expected = [plan.cipher, f"sector: {plan.sector_size}", "argon2id"]
+    if plan.perf_flags:
+        expected += ["no-read-workqueue", "no-write-workqueue"]
+    missing = [setting for setting in expected if setting not in dump]
+    return plan, missing
@@ -0,0 +1,278 @@
+import os
+import logging
+import math
+from libs.trace import tracer
+from libs.utils import probes, run_command
+
+SYS_BLOCK = "sys/class/block"
+MiB = 1024 ** 2
+GiB = 1024 ** 3
+
+# Alignment every partition gets at least; hints beyond MAX_ALIGNMENT are treated as bogus
+DEFAULT_ALIGNMENT = MiB
+MAX_ALIGNMENT = 64 * MiB
+
+ESP_SIZE = GiB
+GPT_ENTRIES_BYTES = 128 * 128  # 128 partition entries of 128 bytes
+
+# GPT partition type GUIDs (Discoverable Partitions Specification)
+TYPE_ESP = "C12A7328-F81F-11D2-BA4B-00A0C93EC93B"
+TYPE_SWAP = "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F"
+TYPE_ROOT_X86_64 = "4F68BCE3-E8CD-4DB1-96E7-FBCAF984B709"
+TYPE_LINUX_DATA = "0FC63DAF-8483-4772-8E79-3D69D8477DE4"
+
+
+def partition_device(disk, number):
+    """
+    Returns the device node of a partition.
+
+    Disks whose name ends in a digit get a "p" separator: /dev/nvme0n1p2,
+    /dev/mmcblk0p2, /dev/loop0p2; others do not: /dev/sda2, /dev/vda2.
+    """
+    return f"{disk}p{number}" if disk[-1].isdigit() else f"{disk}{number}"
+
+
+class DiskTopology:
+    """Size and I/O geometry of a whole disk, read from sysfs."""
+    def __init__(self, name, size, logical_block_size=512, physical_block_size=512,
+                 minimum_io_size=0, optimal_io_size=0, discard_granularity=0, erase_size=0,
+                 alignment_offset=0):
+        self.name = name
+        self.size = size  # Bytes
+        self.logical_block_size = logical_block_size
+        self.physical_block_size = physical_block_size
+        self.minimum_io_size = minimum_io_size
+        self.optimal_io_size = optimal_io_size
+        self.discard_granularity = discard_granularity
+        self.erase_size = erase_size  # Preferred erase size of SD/eMMC cards
+        self.alignment_offset = alignment_offset
+
+    @classmethod
+    def read(cls, disk, root='/'):
+        """
+        Reads the geometry of a disk.
+
+        Parameters:
+        - disk: Device node, e.g. /dev/nvme0n1.
+        - root: Directory holding sys/; a fake sysfs tree can be used in tests.
+        """
+        name = os.path.basename(os.path.realpath(disk))
+        block_dir = os.path.join(root, SYS_BLOCK, name)
+
+        def read_int(*parts):
+            try:
+                with open(os.path.join(block_dir, *parts)) as f:
+                    return int(f.read().strip())
+            except (OSError, ValueError):
+                return 0
+
+        return cls(
+            name,
+            read_int('size') * 512,  # sysfs counts 512-byte sectors whatever the block size
+            read_int('queue', 'logical_block_size') or 512,
+            read_int('queue', 'physical_block_size') or 512,
+            read_int('queue', 'minimum_io_size'),
+            read_int('queue', 'optimal_io_size'),
+            read_int('queue', 'discard_granularity'),
+            read_int('device', 'preferred_erase_size'),
+            read_int('alignment_offset'),
+        )
+
+    def alignment(self):
+        """
+        Returns the partition alignment in bytes: the smallest multiple of 1 MiB that is
+        also a multiple of the physical block, I/O and erase-block sizes.
+        """
+        grain = DEFAULT_ALIGNMENT
+        for hint in (self.physical_block_size, self.minimum_io_size, self.optimal_io_size,
+                     self.discard_granularity, self.erase_size):
+            if hint <= 0 or grain % hint == 0:
+                continue
+            candidate = grain * hint // math.gcd(grain, hint)
+            if candidate > MAX_ALIGNMENT:
+                # Some USB bridges report e.g. 33553920 bytes; aligning to that wastes space for nothing
+                logging.warning(f"Ignoring I/O size hint of {hint} bytes on {self.name}")
+                continue
+            grain = candidate
+        return grain
+
+
+class Partition:
+    """One planned GPT partition, in logical sectors."""
+    def __init__(self, number, label, type_guid, start, sectors):
+        self.number = number
+        self.label = label
+        self.type_guid = type_guid
+        self.start = start
+        self.sectors = sectors
+
+    def script_line(self):
+        return f'start={self.start}, size={self.sectors}, type={self.type_guid}, name="{self.label}"'
+
+
+class PartitionLayout:
+    """Partitions planned for a disk, plus the sfdisk script that creates them."""
+    def __init__(self, disk, topology, partitions):
+        self.disk = disk
+        self.topology = topology
+        self.partitions = partitions
+
+    def find(self, type_guid):
+        return next((part for part in self.partitions if part.type_guid == type_guid), None)
+
+    def device(self, partition):
+        return partition_device(self.disk, partition.number)
+
+    @property
+    def esp(self):
+        part = self.find(TYPE_ESP)
+        return self.device(part) if part else None
+
+    @property
+    def root(self):
+        return self.device(self.find(TYPE_ROOT_X86_64))
+
+    @property
+    def swap(self):
+        part = self.find(TYPE_SWAP)
+        return self.device(part) if part else None
+
+    def sfdisk_script(self):
+        lines = ["label: gpt", "unit: sectors"]
+        if self.topology.logical_block_size != 512:
+            lines.append(f"sector-size: {self.topology.logical_block_size}")
+        lines.append("")
+        lines.extend(part.script_line() for part in self.partitions)
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        lbs = self.topology.logical_block_size
+        return ", ".join(f"{self.device(part)} {part.label} {part.sectors * lbs / GiB:.1f}G"
+                         for part in self.partitions) + f" (aligned to {self.topology.alignment() // 1024} KiB)"
+
+
+def plan_layout(disk, topology, esp_size=ESP_SIZE, swap_size=0, cache_size=0):
+    """
+    Plans ESP, optional swap, root and optional cache partitions with aligned starts and sizes.
+
+    Parameters:
+    - disk: Device node of the disk.
+    - topology: DiskTopology of the disk.
+    - esp_size, swap_size, cache_size: Sizes in bytes; 0 leaves swap or cache out.
+
+    Returns:
+    - PartitionLayout; root takes the space the others leave.
+    """
+    lbs = topology.logical_block_size
+    grain = topology.alignment() // lbs
+    offset = topology.alignment_offset // lbs
+    total = topology.size // lbs
+    # The backup GPT header and entries live in the last sectors of the disk
+    last_usable = total - 1 - (1 + GPT_ENTRIES_BYTES // lbs)
+
+    def align_up(sector):
+        return -(-(sector + offset) // grain) * grain - offset
+
+    def align_down(sector):
+        return (sector + offset) // grain * grain - offset
+
+    requests = [("EFI system partition", TYPE_ESP, esp_size)]
+    if swap_size:
+        requests.append(("swap", TYPE_SWAP, swap_size))
+    requests.append(("root", TYPE_ROOT_X86_64, None))
+    if cache_size:
+        requests.append(("cache", TYPE_LINUX_DATA, cache_size))
+
+    def aligned_sectors(size):
+        return -(-size // (grain * lbs)) * grain
+
+    partitions = []
+    # The first usable sector follows the protective MBR, the GPT header and its entries
+    start = align_up(2 + GPT_ENTRIES_BYTES // lbs)
+    for number, (label, type_guid, size) in enumerate(requests, 1):
+        if size:
+            sectors = aligned_sectors(size)
+        else:
+            # Root ends where the partitions after it begin
+            after = sum(aligned_sectors(later) for _, _, later in requests[number:])
+            sectors = align_down(last_usable + 1 - after) - start
+        if sectors <= 0 or start + sectors - 1 > last_usable:
+            raise ValueError(f"{disk} is too small for the partition layout")
+        partitions.append(Partition(number, label, type_guid, start, sectors))
+        start += sectors
+    return PartitionLayout(disk, topology, partitions)
+
+
+def write_layout(layout):
+    """Writes the whole GPT in one sfdisk run, wiping old signatures, and waits for the partition nodes."""
+    script = layout.sfdisk_script()
+    logging.info(f"Partitioning {layout.disk}:\n{script}")
+    result = tracer.run(["sfdisk", "--wipe", "always", "--wipe-partitions", "always", layout.disk],
+                        input=script, text=True, capture_output=True)
+    if result.returncode != 0:
+        print(f"Error executing: sfdisk {layout.disk}\n{result.stderr}")
+        exit(1)
+    tracer.system("udevadm settle")
+    for partition in layout.partitions:
+        if not os.path.exists(layout.device(partition)):
+            logging.warning(f"{layout.device(partition)} did not appear after partitioning")
+
+
+def partition_disk(disk, swap_size=0, cache_size=0):
+    """
+    Plans and writes the GPT of a disk.
+
+    Returns:
+    - PartitionLayout that was written.
+    """
+    layout = plan_layout(disk, DiskTopology.read(disk), swap_size=swap_size, cache_size=cache_size)
+    write_layout(layout)
+    # The cached lsblk listing no longer matches the disk
+    probes.invalidate("drives")
+    logging.info(f"Partitioned {disk}: {layout.report()}")
+    return layout
+
+
+def format_partitions(layout):
+    """
+    Formats the ESP and swap partitions; the root filesystem is formatted by its own planner.
+
+    Returns:
+    - Device node of the root partition.
+    """
+    if layout.esp:
+        run_command(f"mkfs.fat -F 32 -n EFI {layout.esp}")
+    if layout.swap:
+        run_command(f"mkswap -L swap {layout.swap}")
+    return layout.root
+
+
+def mount_boot_partitions(layout, root="/mnt"):
+    """Mounts the ESP at /boot of the mounted target and enables the swap partition."""
+    if layout.esp:
+        os.makedirs(os.path.join(root, "boot"), exist_ok=True)
+        run_command(f"mount -o umask=0077 {layout.esp} {os.path.join(root, 'boot')}")
+    if layout.swap:
+        run_command(f"swapon {layout.swap}")
+
+
+def attach_loop_image(image, size):
+    """
+    Creates a sparse image and attaches it as a loop device with partition scanning,
+    so the whole partitioning path can be exercised without a real disk.
+
+    Returns:
+    - Loop device node, e.g. /dev/loop0.
+    """
+    with open(image, "wb") as f:
+        f.truncate(size)
+    loop = run_command(f"losetup -f --show -P {image}").stdout.strip()
+    probes.invalidate("drives")
+    return loop
+
+
+def detach_loop_image(loop, image):
+    tracer.system(f"losetup -d {loop}")
+    probes.invalidate("drives")
+    if os.path.exists(image):
+        os.unlink(image)
@@ -0,0 +1,170 @@
+# Standard library imports
+import asyncio
+import json
+import logging
+import os
+import time
+
+from libs import mirrors
+from libs.cache_dir import CACHE_ROOT, cache_file as private_cache_file
+from libs.pacman_conf import PACMAN_CONF, atomic_write, edit as edit_pacman_conf
+
+RESULT_FILE = os.path.join(CACHE_ROOT, "parallel-downloads.json")
+
+# Larger sample than the mirror ranking so a single connection can reach full speed
+SAMPLE_FILE = "extra.db"
+SAMPLE_BYTES = 2 * 1024 * 1024
+SAMPLE_REPO = "extra"
+
+CANDIDATE_CONNECTIONS = (1, 2, 4, 8, 12, 16)
+MIN_GAIN = 0.15  # Extra connections must add at least 15% aggregate throughput
+DEFAULT_PARALLEL_DOWNLOADS = 5
+
+
+class DownloadTuning:
+    """Outcome of the download concurrency measurement."""
+    def __init__(self, parallel_downloads, measurements=None, mirror=None):
+        self.parallel_downloads = parallel_downloads
+        self.measurements = measurements or {}  # connections -> aggregate bytes per second
+        self.mirror = mirror
+
+    @property
+    def per_connection(self):
+        return self.measurements.get(1)
+
+    @property
+    def aggregate(self):
+        return self.measurements.get(self.parallel_downloads)
+
+    def report(self):
+        # The fallback value has no measurement of its own, e.g. when every download failed
+        if self.aggregate is None:
+            return f"ParallelDownloads = {self.parallel_downloads} (default, no measurement)"
+        text = f"ParallelDownloads = {self.parallel_downloads}: {self.aggregate / 1048576:.1f} MiB/s aggregate"
+        if self.per_connection is not None:
+            text += f", {self.per_connection / 1048576:.1f} MiB/s per connection"
+        return text + f" from {self.mirror}"
+
+
+async def measure_aggregate(url, connections, timeout=mirrors.DEFAULT_TIMEOUT):
+    """Downloads the sample over several simultaneous connections and returns the aggregate bytes per second."""
+    start = time.monotonic()
+    results = await asyncio.gather(*(mirrors.fetch(url, SAMPLE_BYTES, timeout) for _ in range(connections)),
+                                   return_exceptions=True)
+    elapsed = time.monotonic() - start
+    received = sum(result[1] for result in results if not isinstance(result, Exception))
+    return received / max(elapsed, 1e-6)
+
+
+def choose_parallel_downloads(measurements, min_gain=MIN_GAIN):
+    """
+    Picks the smallest connection count after which more connections stop paying off.
+
+    Parameters:
+    - measurements: Dictionary mapping connection counts to aggregate bytes per second.
+    - min_gain: Relative throughput gain required to step up to the next count.
+    """
+    counts = sorted(count for count, rate in measurements.items() if rate)
+    if not counts:
+        return DEFAULT_PARALLEL_DOWNLOADS
+    best = counts[0]
+    for count in counts[1:]:
+        if measurements[count] < measurements[best] * (1 + min_gain):
+            break
+        best = count
+    return best
+
+
+def measure_download_concurrency(server, candidates=CANDIDATE_CONNECTIONS):
+    """
+    Measures aggregate throughput against one mirror for increasing connection counts.
+
+    Returns:
+    - DownloadTuning with the chosen ParallelDownloads value.
+    """
+    url = server.replace("$repo", SAMPLE_REPO).replace("$arch", mirrors.TEST_ARCH).rstrip("/") + "/" + SAMPLE_FILE
+    measurements = {}
+    for connections in candidates:
+        measurements[connections] = asyncio.run(measure_aggregate(url, connections))
+        previous = [count for count in measurements if count < connections]
+        # Stop as soon as throughput flattens; larger counts would only add load on the mirror
+        if previous and measurements[connections] < measurements[max(previous)] * (1 + MIN_GAIN):
+            break
+    return DownloadTuning(choose_parallel_downloads(measurements), measurements, server)
+
+
+def set_parallel_downloads(path, value):
+    """Sets ParallelDownloads in the [options] section of a pacman.conf, replacing any existing line."""
+    with edit_pacman_conf(path) as conf:
+        conf.set_option("ParallelDownloads", value)
+
+
+def save_tuning(tuning, result_file=RESULT_FILE):
+    if not private_cache_file(result_file):
+        return
+    try:
+        atomic_write(result_file, json.dumps({"parallel_downloads": tuning.parallel_downloads, "mirror": tuning.mirror,
+                                              "measurements": tuning.measurements}))
+    except OSError as e:
+        logging.error(f"Error saving download tuning: {str(e)}")
+
+
+def load_tuning(result_file=RESULT_FILE):
+    if not private_cache_file(result_file):
+        return None
+    try:
+        with open(result_file, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    measurements = {int(count): rate for count, rate in data.get("measurements", {}).items()}
+    return DownloadTuning(data["parallel_downloads"], measurements, data.get("mirror"))
+
+
+def tune_parallel_downloads(pacman_conf=PACMAN_CONF, ranked=None):
+    """
+    Measures the fastest mirror and sets ParallelDownloads for the live environment.
+
+    Parameters:
+    - pacman_conf: pacman.conf to update.
+    - ranked: Mirror ranking to use; defaults to the one of the "Rank mirrors" step, so
+      the mirrors are not benchmarked a second time.
+
+    Returns:
+    - DownloadTuning describing the chosen value.
+    """
+    ranked = mirrors.ranked_mirrors() if ranked is None else ranked
+    if ranked:
+        tuning = measure_download_concurrency(ranked[0].url)
+    else:
+        logging.error("No reachable mirror; using the default ParallelDownloads value")
+        tuning = DownloadTuning(DEFAULT_PARALLEL_DOWNLOADS)
+    set_parallel_downloads(pacman_conf, tuning.parallel_downloads)
+    save_tuning(tuning)
+    logging.info(tuning.report())
+    return tuning
+
+
+def apply_to_target(root="/mnt"):
+    """Copies the measured ParallelDownloads value into the installed system's pacman.conf."""
+    tuning = load_tuning() or DownloadTuning(DEFAULT_PARALLEL_DOWNLOADS)
+    target_conf = os.path.join(root, PACMAN_CONF.lstrip("/"))
+    if os.path.exists(target_conf):
+        set_parallel_downloads(target_conf, tuning.parallel_downloads)
+    return tuning
+
+
+def tune_parallel_downloads_menu(stdscr):
+    """Menu entry that tunes ParallelDownloads and shows the measurement."""
+    stdscr.clear()
+    h, w = stdscr.getmaxyx()
+    stdscr.addstr(0, 0, "Measuring download concurrency...")
+    stdscr.refresh()
+    tuning = tune_parallel_downloads()
+    apply_to_target()
+    stdscr.clear()
+    for idx, (connections, rate) in enumerate(sorted(tuning.measurements.items())):
+        stdscr.addstr(idx, 0, f"{connections:3d} connections: {rate / 1048576:8.2f} MiB/s"[:w - 1])
+    stdscr.addstr(len(tuning.measurements) + 1, 0, tuning.report()[:w - 1])
+    stdscr.refresh()
+    stdscr.getch()
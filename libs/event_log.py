@@ -0,0 +1,228 @@
+# Standard library imports
+import argparse
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+from libs.trace import redact, tracer
+
+LOG_FILE = "install_events.jsonl"
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+FSYNC_BATCH = 64        # Records written between two fsyncs
+FSYNC_INTERVAL = 2.0    # Seconds after which a pending batch is synced anyway
+
+# Structured fields a record may carry via extra={...}
+EVENT_FIELDS = ("event", "step", "command", "duration", "exit_code", "output_bytes", "cpu", "max_rss_kib")
+
+_listener = None
+
+
+class StepFilter(logging.Filter):
+    """Tags records with the installer step that is running on the logging thread."""
+    def filter(self, record):
+        if getattr(record, "step", None) is None:
+            record.step = tracer.current_step()
+        return True
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Formats every record as one JSON object per line."""
+    def format(self, record):
+        event = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": redact(record.getMessage()),
+        }
+        for field in EVENT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                event[field] = value
+        if "command" in event:
+            event["command"] = redact(event["command"])  # The persistent log never holds a secret
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            event["exception"] = record.exc_text
+        return json.dumps(event, default=str)
+
+
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Size-rotated log file that fsyncs in batches.
+
+    Records are flushed to the kernel as they are written, but only forced to disk
+    every FSYNC_BATCH records, every FSYNC_INTERVAL seconds, for warnings and
+    errors, before a rotation and on close.
+    """
+    def __init__(self, filename, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                 batch=FSYNC_BATCH, interval=FSYNC_INTERVAL):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.batch = batch
+        self.interval = interval
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def sync(self):
+        if self.stream is not None and self.unsynced:
+            self.stream.flush()
+            os.fsync(self.stream.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def emit(self, record):
+        super().emit(record)
+        self.unsynced += 1
+        if (self.unsynced >= self.batch or record.levelno >= logging.WARNING
+                or time.monotonic() - self.last_sync >= self.interval):
+            try:
+                self.sync()
+            except OSError:
+                self.handleError(record)
+
+    def doRollover(self):
+        self.sync()
+        super().doRollover()
+
+    def close(self):
+        try:
+            self.sync()
+        except (OSError, ValueError):
+            pass
+        super().close()
+
+
+def setup_logging(path=LOG_FILE, level=logging.DEBUG, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+    """
+    Routes all logging through a queue to a JSON-lines file written by a background thread.
+
+    The calling threads (including the curses UI) only put records on a queue; the
+    listener thread formats, writes, rotates and syncs them.
+
+    Returns:
+    - The running QueueListener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = BatchedRotatingFileHandler(path, max_bytes, backup_count)
+    file_handler.setFormatter(JsonLineFormatter())
+
+    records = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(StepFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    """Drains the queue and closes the log file."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+def log_files(path=LOG_FILE):
+    """Returns the log file and its rotated backups, oldest first."""
+    files = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        files.insert(0, f"{path}.{index}")
+        index += 1
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read_events(path=LOG_FILE):
+    """Yields the events of the log and its backups in chronological order."""
+    for filename in log_files(path):
+        with open(filename, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash
+
+
+def filter_events(events, step=None, min_duration=None, level=None):
+    """
+    Selects events by step, duration and level.
+
+    Parameters:
+    - step: Case-insensitive substring of the step name.
+    - min_duration: Only commands that ran at least this many seconds, slowest first.
+    - level: Minimum level name, e.g. "WARNING".
+    """
+    selected = []
+    min_level = logging.getLevelName(level.upper()) if level else None
+    for event in events:
+        if step and step.lower() not in (event.get("step") or "").lower():
+            continue
+        if min_duration is not None and (event.get("event") != "command"
+                                         or event.get("duration", 0) < min_duration):
+            continue
+        if min_level is not None and logging.getLevelName(event.get("level", "DEBUG")) < min_level:
+            continue
+        selected.append(event)
+    if min_duration is not None:
+        selected.sort(key=lambda event: event["duration"], reverse=True)
+    return selected
+
+
+def scrub_event(event):
+    """Masks secrets in an event, including ones written by versions that did not redact them."""
+    event = dict(event)
+    for field in ("command", "message"):
+        if isinstance(event.get(field), str):
+            event[field] = redact(event[field])
+    return event
+
+
+def format_event(event):
+    duration = f"{event['duration']:8.2f}s" if "duration" in event else " " * 9
+    exit_code = f"{event['exit_code']:>4}" if event.get("exit_code") is not None else "    "
+    return (f"{event.get('ts', '')} {event.get('level', ''):<7} {duration} {exit_code}  "
+            f"[{event.get('step') or '-'}] {event.get('command') or event.get('message', '')}")
+
+
+def main(argv=None):
+    """Command line query tool: python -m libs.event_log [--step NAME] [--slow SECONDS]"""
+    parser = argparse.ArgumentParser(description="Query the installer's structured event log")
+    parser.add_argument("--file", default=LOG_FILE, help="log file to read (rotated backups are included)")
+    parser.add_argument("--step", help="only events of steps whose name contains this text")
+    parser.add_argument("--slow", type=float, metavar="SECONDS", help="only commands slower than this, slowest first")
+    parser.add_argument("--level", help="minimum level, e.g. WARNING")
+    parser.add_argument("--json", action="store_true", help="print raw JSON lines")
+    args = parser.parse_args(argv)
+
+    for event in filter_events(read_events(args.file), args.step, args.slow, args.level):
+        event = scrub_event(event)
+        print(json.dumps(event) if args.json else format_event(event))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
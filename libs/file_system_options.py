@@ -7,12 +7,13 @@ import curses
 import logging
 from pathlib import Path
 from libs.bootloader import bootloader_menu
-from libs.utils import is_strong_password, run_command
+from libs.trace import tracer
+from libs.utils import is_strong_password, probes, run_command
 
 from libs.disks import btrfs
+from libs.disks import luks
+from libs.disks import partitions
 
-# Initialize logging
-logging.basicConfig(filename='disk_operations.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def confirm_formatting(stdscr, drive):
     """Prompt the user to confirm formatting a drive."""
@@ -26,8 +27,9 @@ def confirm_formatting(stdscr, drive):
         return False
     return True
 
-def get_connected_drives():
-    result = run_command("lsblk -dpno NAME,SIZE,MODEL")
+def describe_connected_drives():
+    """Returns one "NAME SIZE MODEL" line per connected disk."""
+    result = probes.get("drives")
     lines = result.stdout.split("\n")
     drives = []
     for line in lines:
@@ -35,6 +37,10 @@ def get_connected_drives():
             drives.append(line.strip())
     return drives
 
+def get_connected_drives():
+    """Returns the device paths of the connected disks, e.g. /dev/nvme0n1."""
+    return [line.split()[0] for line in describe_connected_drives()]
+
 def setup_encryption_choice(stdscr):
     """Prompt the user to choose whether to enable LUKS encryption."""
     stdscr.addstr(5, 0, "Do you want to enable LUKS encryption? (y/n): ")
@@ -50,14 +56,72 @@ def format_partitions_curses(stdscr, drive):
     if not confirm_formatting(stdscr, drive):
         return
 
+    layout = partitions.partition_disk(drive)
+    root = partitions.format_partitions(layout)
+
     if setup_encryption_choice(stdscr):
-        drive = btrfs.setup_luks_encryption_curses(stdscr, drive)
+        root = btrfs.setup_luks_encryption_curses(stdscr, root)
+
+    btrfs.format_btrfs(stdscr, root)
+    return layout, root
+
+def choose_raid_profile_curses(stdscr, member_sizes):
+    """Lets the user pick the data profile of a multi-device filesystem, showing usable capacity per profile."""
+    devices = list(member_sizes)
+    layouts = [btrfs.RaidLayout(devices, [member_sizes[d] for d in devices], profile)
+               for profile in btrfs.raid_profiles_for(len(devices))]
+    current_row = 0
+    while True:
+        stdscr.clear()
+        h, w = stdscr.getmaxyx()
+        stdscr.addstr(0, 0, f"Btrfs layout for {len(devices)} drives:")
+        for idx, layout in enumerate(layouts):
+            attr = curses.A_REVERSE if idx == current_row else curses.A_NORMAL
+            stdscr.addstr(2 + idx, 2, layout.report()[:w - 3], attr)
+        for idx, warning in enumerate(layouts[current_row].warnings()):
+            stdscr.addstr(3 + len(layouts) + idx, 0, f"WARNING: {warning}"[:w - 1])
+        key = stdscr.getch()
+        if key == curses.KEY_UP and current_row > 0:
+            current_row -= 1
+        elif key == curses.KEY_DOWN and current_row < len(layouts) - 1:
+            current_row += 1
+        elif key == curses.KEY_ENTER or key in [10, 13]:
+            return layouts[current_row]
+        elif key == 27:  # Escape
+            return None
+
+def format_raid_curses(stdscr, drives):
+    """Partitions every drive alike and creates one Btrfs filesystem across their root partitions."""
+    if not confirm_formatting(stdscr, ", ".join(drives)):
+        return
+
+    layouts = [partitions.plan_layout(drive, partitions.DiskTopology.read(drive)) for drive in drives]
+    member_sizes = {}
+    for layout in layouts:
+        root = layout.find(partitions.TYPE_ROOT_X86_64)
+        member_sizes[layout.root] = root.sectors * layout.topology.logical_block_size
+
+    stdscr.timeout(-1)
+    raid = choose_raid_profile_curses(stdscr, member_sizes)
+    stdscr.timeout(100)
+    if raid is None:
+        return
+
+    for layout in layouts:
+        partitions.write_layout(layout)
+    # Only the first drive's ESP is used; the others keep the sizes of the members equal
+    partitions.format_partitions(layouts[0])
+    btrfs.format_raid(raid.devices, raid.data_profile, raid.metadata_profile)
+    stdscr.addstr(0, 0, f"Created {raid.report()}")
+    stdscr.getch()
+    return layouts[0], raid.devices[0]
 
 class FileSystemMenu:
     def __init__(self):
         self.menu_options = [
             ("Choose Drive", self.choose_drive),
             ("Format Partitions", self.format_partitions),
+            ("Create Subvolumes", self.create_subvolumes),
             ("Mount File System", self.mount_file_system),
             ("Setup ZRAM", self.setup_zram),
             ("Install Bootloader", self.bootloader),
@@ -65,15 +129,29 @@ class FileSystemMenu:
         ]
         self.current_option = 0
         self.drive = None
+        self.drives = []
+        self.layout = None
+        self.root = None  # Root partition, or its opened LUKS mapping
 
     def choose_drive(self, stdscr):
-        self.drive = choose_drive_curses(stdscr)
+        self.drives = choose_drive_curses(stdscr, multiple=True) or []
+        self.drive = self.drives[0] if self.drives else None
 
     def format_partitions(self, stdscr):
-        format_partitions_curses(stdscr, self.drive)
+        if len(self.drives) > 1:
+            formatted = format_raid_curses(stdscr, self.drives)
+        else:
+            formatted = format_partitions_curses(stdscr, self.drive)
+        if formatted:
+            self.layout, self.root = formatted
+
+    def create_subvolumes(self, stdscr):
+        btrfs.create_subvolumes_curses(stdscr, self.root or self.drive)
 
     def mount_file_system(self, stdscr):
-        btrfs.mount_file_system_curses(stdscr, self.drive)
+        btrfs.mount_file_system_curses(stdscr, self.root or self.drive)
+        if self.layout:
+            partitions.mount_boot_partitions(self.layout)
 
     def setup_zram(self, stdscr):
         btrfs.setup_zram(self, stdscr)
@@ -123,8 +201,9 @@ class FileSystemMenu:
             elif key == curses.KEY_DOWN and self.current_option < len(self.menu_options) - 1:
                 self.current_option += 1
             elif key == curses.KEY_ENTER or key in [10, 13]:
-                _, selected_function = self.menu_options[self.current_option]
-                selected_function(stdscr)
+                option_name, selected_function = self.menu_options[self.current_option]
+                with tracer.step(option_name):
+                    selected_function(stdscr)
 
             stdscr.refresh()
 
@@ -133,7 +212,14 @@ def install_filesystem_menu(stdscr):
     menu = FileSystemMenu()
     menu.display(stdscr)
 
-def choose_drive_curses(stdscr):
+def choose_drive_curses(stdscr, multiple=False):
+    """
+    Lets the user pick a drive, or several with the space bar when multiple is set.
+
+    Returns:
+    - The device path, or with multiple the list of marked paths (the highlighted
+      one if none were marked); None when the user returns to the submenu.
+    """
     # Initialize color pairs
     curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_WHITE)  # Selected menu item
     curses.init_pair(2, curses.COLOR_WHITE, curses.COLOR_BLUE)   # Header/Footer
@@ -142,8 +228,9 @@ def choose_drive_curses(stdscr):
     curses.init_pair(6, curses.COLOR_BLUE, curses.COLOR_BLACK)   # Bottom border
     curses.init_pair(7, curses.COLOR_YELLOW, curses.COLOR_BLACK) # Left border
 
-    drives = get_connected_drives()
+    drives = describe_connected_drives()
     current_option = 0
+    marked = set()
 
     while True:
         stdscr.clear()
@@ -160,7 +247,7 @@ def choose_drive_curses(stdscr):
         stdscr.addch(curses.LINES - 1, 0, curses.ACS_LLCORNER, curses.color_pair(7))
 
         # Title
-        title = "Choose a Drive"
+        title = "Choose Drives (space marks, Enter confirms)" if multiple else "Choose a Drive"
         stdscr.addstr(0, (w - len(title)) // 2, title, curses.A_BOLD)
 
         # If no drives are detected
@@ -170,12 +257,15 @@ def choose_drive_curses(stdscr):
             return None
 
         # Calculate the starting x-coordinate to center the drives
-        max_drive_length = max([len(drive) for drive in drives])
+        prefix = 4 if multiple else 0
+        max_drive_length = max([len(drive) for drive in drives]) + prefix
         x_start = (w - max_drive_length) // 2
 
         # Display drives
         for idx, drive in enumerate(drives):
             y = 2 + idx
+            if multiple:
+                drive = ("[x] " if idx in marked else "[ ] ") + drive
 
             if idx == current_option:
                 stdscr.attron(curses.color_pair(1))
@@ -200,24 +290,19 @@ def choose_drive_curses(stdscr):
             current_option -= 1
         elif key == curses.KEY_DOWN and current_option < len(drives):
             current_option += 1
+        elif key == ord(' ') and multiple and current_option < len(drives):
+            marked ^= {current_option}
         elif key == curses.KEY_ENTER or key in [10, 13]:
             if current_option == len(drives):
                 install_filesystem_menu(stdscr)  # Return to the main menu
                 return
+            elif multiple:
+                return [drives[idx].split()[0] for idx in sorted(marked or {current_option})]
             else:
-                return drives[current_option]
+                return drives[current_option].split()[0]
 
         stdscr.refresh()
 
-def get_connected_drives():
-    result = run_command("lsblk -dpno NAME,SIZE,MODEL")
-    lines = result.stdout.split("\n")
-    drives = []
-    for line in lines:
-        if line:
-            drives.append(line.strip())
-    return drives
-
 def setup_luks_encryption_curses(stdscr, drive):
     while True:
         stdscr.clear()
@@ -242,13 +327,13 @@ def setup_luks_encryption_curses(stdscr, drive):
             continue
         break
 
-    # Encrypt the partition
-    run_command(f"echo -n {passphrase} | cryptsetup luksFormat {drive} -")
-
-    # Open the encrypted partition
-    run_command(f"echo -n {passphrase} | cryptsetup open {drive} cryptroot -")
-
-    return "/dev/mapper/cryptroot"  # Return the path to the opened encrypted partition
+    # Encrypt with the cipher, sector size and Argon2 cost tuned for this machine, then open it
+    stdscr.addstr(5, 0, "Benchmarking ciphers...")
+    stdscr.refresh()
+    plan = luks.plan_luks(drive)
+    stdscr.addstr(6, 0, f"Encrypting {drive}: {plan.report()}")
+    stdscr.refresh()
+    return luks.format_luks(drive, passphrase, plan)  # Return the path to the opened encrypted partition
 
 def mount_file_system_curses(stdscr, drive):
     # Unmount /mnt before mounting the new system
@@ -267,16 +352,16 @@ def setup_zram(self, stdscr):
     zram_size = int(total_memory * 0.5)  # Using 50% of RAM for ZRAM
 
     # Load the zram module
-    os.system("modprobe zram")
+    tracer.system("modprobe zram")
 
     # Create a zram device
-    os.system(f"echo {zram_size} > /sys/block/zram0/disksize")
+    tracer.system(f"echo {zram_size} > /sys/block/zram0/disksize")
 
     # Format the zram device as swap
-    os.system("mkswap /dev/zram0")
+    tracer.system("mkswap /dev/zram0")
 
     # Enable the swap
-    os.system("swapon /dev/zram0")
+    tracer.system("swapon /dev/zram0")
 
     # Add the zram swap to fstab to ensure it's available after reboot
     with open("/etc/fstab", "a") as fstab:
@@ -0,0 +1,187 @@
+# Standard library imports
+import logging
+
+from libs import hardware
+from libs.boot_options import boot_options
+from libs.packages import transaction
+from libs.pacman_conf import PACMAN_CONF, PacmanConf
+
+KERNELS = ("linux", "linux-lts", "linux-zen", "linux-hardened")
+
+# Kernels with a prebuilt NVIDIA module package; every other kernel needs DKMS
+NVIDIA_PREBUILT_MODULES = {"linux": "nvidia-open", "linux-lts": "nvidia-open-lts"}
+NVIDIA_OPEN_MIN_DEVICE = 0x1e00  # Turing (GTX 16xx / RTX 20xx) and newer run the open kernel modules
+NVIDIA_MODULES = ["nvidia", "nvidia_modeset", "nvidia_uvm", "nvidia_drm"]
+NVIDIA_PARAMS = ["nvidia-drm.modeset=1", "nvidia-drm.fbdev=1"]
+
+# Device ID high bytes of Intel GPUs older than Broadwell, which intel-media-driver does not support
+INTEL_LEGACY_VAAPI_PREFIXES = {0x01, 0x04, 0x0a, 0x0c, 0x0d, 0x0f, 0x27, 0x29, 0x2a, 0x2e, 0xa0}
+
+# Emulated display adapters of hypervisors; they need mesa but no vendor driver
+VIRTUAL_GPU_VENDORS = {0x1af4: "virtio", 0x15ad: "vmware", 0x80ee: "virtualbox", 0x1234: "bochs", 0x1b36: "qxl"}
+
+
+class GraphicsPlan:
+    """Driver, userspace and boot settings chosen for the machine's display controllers."""
+    def __init__(self):
+        self.vendors = []
+        self.packages = []
+        self.modules = []
+        self.kernel_params = []
+        self.removed_hooks = []
+        self.notes = []
+
+    def add(self, packages):
+        self.packages.extend(package for package in packages if package not in self.packages)
+
+    def report(self):
+        text = f"{', '.join(self.vendors) or 'no GPU'}: {' '.join(self.packages) or 'no packages'}"
+        if self.modules:
+            text += f"; early KMS: {' '.join(self.modules)}"
+        if self.kernel_params:
+            text += f"; kernel parameters: {' '.join(self.kernel_params)}"
+        return text
+
+
+def queued_kernels():
+    """Returns the kernels queued or already installed by the transaction, defaulting to linux."""
+    with transaction.lock:
+        packages = list(transaction.packages)
+        for batch in transaction.committed_batches:
+            packages.extend(batch)
+    return [kernel for kernel in KERNELS if kernel in packages] or ["linux"]
+
+
+def multilib_enabled(path=PACMAN_CONF):
+    """Checks if the pacman.conf used for the install enables [multilib]."""
+    try:
+        return "multilib" in PacmanConf.load(path).repos()
+    except OSError:
+        return False
+
+
+def _plan_nvidia(plan, device, kernels, multilib):
+    if device.device < NVIDIA_OPEN_MIN_DEVICE:
+        # Maxwell/Pascal/Volta drivers are no longer in the official repositories
+        plan.vendors.append("NVIDIA (nouveau)")
+        plan.add(["mesa", "vulkan-nouveau"] + (["lib32-mesa", "lib32-vulkan-nouveau"] if multilib else []))
+        plan.modules.append("nouveau")
+        plan.notes.append(f"NVIDIA device {device.device:04x} predates Turing; using nouveau. "
+                          "The proprietary driver for it is only available from the AUR.")
+        return
+
+    plan.vendors.append("NVIDIA")
+    if all(kernel in NVIDIA_PREBUILT_MODULES for kernel in kernels):
+        plan.add(NVIDIA_PREBUILT_MODULES[kernel] for kernel in kernels)
+    else:
+        # The DKMS package conflicts with the prebuilt ones, so it builds for every kernel
+        plan.add(["nvidia-open-dkms"] + [f"{kernel}-headers" for kernel in kernels])
+    plan.add(["nvidia-utils", "libva-nvidia-driver"] + (["lib32-nvidia-utils"] if multilib else []))
+    plan.modules.extend(NVIDIA_MODULES)
+    plan.kernel_params.extend(NVIDIA_PARAMS)
+    # The kms hook would put nouveau into the initramfs ahead of the NVIDIA modules
+    plan.removed_hooks.append("kms")
+
+
+def _plan_amd(plan, device, multilib):
+    plan.vendors.append("AMD")
+    # mesa ships the radeonsi VA-API and VDPAU drivers
+    plan.add(["mesa"] + (["lib32-mesa"] if multilib else []))
+    if device.driver == "radeon":
+        plan.modules.append("radeon")  # TeraScale and older have no Vulkan driver
+        return
+    plan.add(["vulkan-radeon"] + (["lib32-vulkan-radeon"] if multilib else []))
+    plan.modules.append("amdgpu")
+
+
+def _plan_intel(plan, device, multilib):
+    plan.vendors.append("Intel")
+    plan.add(["mesa", "vulkan-intel"] + (["lib32-mesa", "lib32-vulkan-intel"] if multilib else []))
+    if device.device >> 8 in INTEL_LEGACY_VAAPI_PREFIXES:
+        plan.add(["libva-intel-driver"])
+    else:
+        plan.add(["intel-media-driver"])
+    plan.modules.append(device.driver if device.driver in ("i915", "xe") else "i915")
+
+
+def plan_graphics(machine=None, kernels=None, multilib=None):
+    """
+    Chooses graphics drivers and boot settings from the PCI display controllers.
+
+    Parameters:
+    - machine: HardwareProfile (defaults to this machine); a profile built from fixture
+      PCI devices gives a plan without touching the system.
+    - kernels: Kernel packages the target gets (defaults to the queued ones).
+    - multilib: Add 32-bit userspace drivers (defaults to whether [multilib] is enabled).
+
+    Returns:
+    - GraphicsPlan.
+    """
+    machine = machine or hardware.profile()
+    kernels = kernels or queued_kernels()
+    if multilib is None:
+        multilib = multilib_enabled()
+
+    plan = GraphicsPlan()
+    displays = [device for device in machine.pci_devices if device.is_display]
+    planned_vendors = set()
+    for device in displays:
+        if device.vendor in planned_vendors:
+            continue
+        planned_vendors.add(device.vendor)
+        if device.vendor == hardware.PCI_VENDOR_NVIDIA:
+            _plan_nvidia(plan, device, kernels, multilib)
+        elif device.vendor == hardware.PCI_VENDOR_AMD:
+            _plan_amd(plan, device, multilib)
+        elif device.vendor == hardware.PCI_VENDOR_INTEL:
+            _plan_intel(plan, device, multilib)
+        elif device.vendor in VIRTUAL_GPU_VENDORS:
+            plan.vendors.append(f"virtual ({VIRTUAL_GPU_VENDORS[device.vendor]})")
+            plan.add(["mesa"] + (["vulkan-virtio"] if device.vendor == 0x1af4 else []))
+
+    if plan.packages:
+        plan.add(["vulkan-icd-loader"] + (["lib32-vulkan-icd-loader"] if multilib else []))
+    if "NVIDIA" in plan.vendors and len(planned_vendors) > 1:
+        # Hybrid laptop: the integrated GPU drives the display, prime-run offloads to NVIDIA
+        plan.add(["nvidia-prime"])
+    return plan
+
+
+def install_graphics_drivers(machine=None):
+    """
+    Queues the graphics stack for the detected GPUs and registers its boot settings.
+
+    Returns:
+    - GraphicsPlan that was applied.
+    """
+    plan = plan_graphics(machine)
+    transaction.add(plan.packages, "Graphics drivers")
+    if plan.modules:
+        boot_options.add_modules(plan.modules, "Graphics drivers")
+    if plan.kernel_params:
+        boot_options.add_params(plan.kernel_params, "Graphics drivers")
+    if plan.removed_hooks:
+        boot_options.remove_hooks(plan.removed_hooks, "Graphics drivers")
+    for note in plan.notes:
+        logging.warning(note)
+    logging.info(f"Graphics stack: {plan.report()}")
+    return plan
+
+
+def graphics_menu(stdscr):
+    """Menu entry that queues the graphics drivers and shows what was chosen."""
+    stdscr.clear()
+    h, w = stdscr.getmaxyx()
+    plan = install_graphics_drivers()
+    stdscr.addstr(0, 0, "Graphics drivers queued:")
+    lines = [plan.report()] + plan.notes
+    row = 2
+    for line in lines:
+        while line and row < h - 1:
+            stdscr.addstr(row, 0, line[:w - 1])
+            line = line[w - 1:]
+            row += 1
+    stdscr.refresh()
+    stdscr.timeout(-1)
+    stdscr.getch()
+    stdscr.timeout(100)
@@ -1,125 +1,313 @@
+import functools
+import json
 import os
-import subprocess
+
+# Flags each x86-64 microarchitecture level adds to the previous one, as named in /proc/cpuinfo
+ISA_LEVEL_FLAGS = {
+    1: {'lm', 'cmov', 'cx8', 'fpu', 'fxsr', 'mmx', 'syscall', 'sse', 'sse2'},
+    2: {'cx16', 'lahf_lm', 'popcnt', 'pni', 'sse4_1', 'sse4_2', 'ssse3'},
+    3: {'avx', 'avx2', 'bmi1', 'bmi2', 'f16c', 'fma', 'abm', 'movbe', 'xsave'},
+    4: {'avx512f', 'avx512bw', 'avx512cd', 'avx512dq', 'avx512vl'},
+}
+
+PCI_VENDOR_NVIDIA = 0x10de
+PCI_VENDOR_AMD = 0x1002
+PCI_VENDOR_INTEL = 0x8086
+PCI_CLASS_DISPLAY = 0x03  # Base class of VGA, 3D and other display controllers
+
+# DMI vendor or product fragments of hypervisors, mapped to systemd-detect-virt names
+_HYPERVISORS = (
+    ('VMware', 'vmware'),
+    ('VirtualBox', 'oracle'),
+    ('innotek', 'oracle'),
+    ('QEMU', 'qemu'),
+    ('KVM', 'kvm'),
+    ('Microsoft Corporation Virtual Machine', 'microsoft'),
+    ('Xen', 'xen'),
+    ('Parallels', 'parallels'),
+    ('Bochs', 'bochs'),
+)
+
+
+def _read(path, default=''):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+class PciDevice:
+    """One PCI function as listed in /sys/bus/pci/devices."""
+    __slots__ = ('slot', 'vendor', 'device', 'pci_class', 'driver')
+
+    def __init__(self, slot, vendor, device, pci_class, driver=''):
+        self.slot = slot
+        self.vendor = vendor
+        self.device = device
+        self.pci_class = pci_class  # 24-bit class code, e.g. 0x030000 for VGA
+        self.driver = driver
+
+    @property
+    def is_display(self):
+        return self.pci_class >> 16 == PCI_CLASS_DISPLAY
+
+    def to_list(self):
+        return [self.slot, self.vendor, self.device, self.pci_class, self.driver]
+
+
+class HardwareProfile:
+    """
+    Snapshot of the machine's hardware, collected in one pass without subprocesses.
+
+    Every file is read once; the accessors below only look at the snapshot. The
+    profile round-trips through JSON so it can be cached or used as a fixture.
+    """
+    __slots__ = ('cpu_vendor', 'cpu_model', 'cpu_flags', 'cpu_count', 'mem_total', 'mem_free',
+                 'mem_available', 'modules', 'pci_devices', 'sys_vendor', 'product_name', 'uefi',
+                 'virtualization', 'wifi_interfaces')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def probe(cls, root='/'):
+        """
+        Reads the hardware of the running system.
+
+        Parameters:
+        - root: Directory holding proc/ and sys/; a copied tree can be used as a fixture.
+        """
+        def path(*parts):
+            return os.path.join(root, *parts)
+
+        cpu = {}
+        cpu_count = 0
+        try:
+            with open(path('proc', 'cpuinfo'), 'r') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    key = key.strip()
+                    if key == 'processor':
+                        cpu_count += 1
+                    elif key in ('vendor_id', 'model name', 'flags') and key not in cpu:
+                        cpu[key] = value.strip()
+        except OSError:
+            pass
+
+        memory = {}
+        try:
+            with open(path('proc', 'meminfo'), 'r') as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in ('MemTotal', 'MemFree', 'MemAvailable'):
+                        memory[key] = int(value.split()[0]) * 1024
+        except OSError:
+            pass
+
+        try:
+            with open(path('proc', 'modules'), 'r') as f:
+                modules = [line.split(' ')[0] for line in f]
+        except OSError:
+            modules = []
+
+        pci_devices = []
+        pci_dir = path('sys', 'bus', 'pci', 'devices')
+        for slot in sorted(os.listdir(pci_dir)) if os.path.isdir(pci_dir) else []:
+            device_dir = os.path.join(pci_dir, slot)
+            driver = os.path.join(device_dir, 'driver')
+            pci_devices.append(PciDevice(
+                slot,
+                int(_read(os.path.join(device_dir, 'vendor'), '0'), 16),
+                int(_read(os.path.join(device_dir, 'device'), '0'), 16),
+                int(_read(os.path.join(device_dir, 'class'), '0'), 16),
+                os.path.basename(os.readlink(driver)) if os.path.islink(driver) else ''))
+
+        net_dir = path('sys', 'class', 'net')
+        wifi_interfaces = [name for name in (sorted(os.listdir(net_dir)) if os.path.isdir(net_dir) else [])
+                           if os.path.isdir(os.path.join(net_dir, name, 'wireless'))
+                           or os.path.exists(os.path.join(net_dir, name, 'phy80211'))]
+
+        dmi_dir = path('sys', 'devices', 'virtual', 'dmi', 'id')
+        profile = cls(
+            cpu_vendor=cpu.get('vendor_id', ''),
+            cpu_model=cpu.get('model name', ''),
+            cpu_flags=sorted(cpu.get('flags', '').split()),
+            cpu_count=cpu_count or os.cpu_count() or 1,
+            mem_total=memory.get('MemTotal', 0),
+            mem_free=memory.get('MemFree', 0),
+            mem_available=memory.get('MemAvailable', 0),
+            modules=modules,
+            pci_devices=pci_devices,
+            sys_vendor=_read(os.path.join(dmi_dir, 'sys_vendor')),
+            product_name=_read(os.path.join(dmi_dir, 'product_name')),
+            uefi=os.path.isdir(path('sys', 'firmware', 'efi')),
+            wifi_interfaces=wifi_interfaces,
+        )
+        profile.virtualization = profile._detect_virtualization(_read(path('sys', 'hypervisor', 'type')))
+        return profile
+
+    def _detect_virtualization(self, hypervisor_type):
+        """Names the hypervisor like systemd-detect-virt does, or 'none' on bare metal."""
+        if 'hypervisor' not in self.cpu_flags and not hypervisor_type:
+            return 'none'
+        dmi = f"{self.sys_vendor} {self.product_name}"
+        for fragment, name in _HYPERVISORS:
+            if fragment in dmi:
+                return name
+        return hypervisor_type or 'vm-other'
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['pci_devices'] = [device.to_list() for device in self.pci_devices]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        fields = dict(data)
+        fields['pci_devices'] = [PciDevice(*device) for device in data.get('pci_devices', [])]
+        return cls(**fields)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    def _has_display_vendor(self, vendor):
+        return any(device.is_display and device.vendor == vendor for device in self.pci_devices)
+
+    @property
+    def has_nvidia_graphics(self):
+        return self._has_display_vendor(PCI_VENDOR_NVIDIA)
+
+    @property
+    def has_amd_graphics(self):
+        return self._has_display_vendor(PCI_VENDOR_AMD)
+
+    @property
+    def has_intel_graphics(self):
+        return self._has_display_vendor(PCI_VENDOR_INTEL)
+
+    @property
+    def isa_level(self):
+        return isa_level_from_flags(set(self.cpu_flags))
+
+    @property
+    def is_vm(self):
+        return self.virtualization != 'none'
+
+    @property
+    def requires_sof_fw(self):
+        return any('snd_sof' in module for module in self.modules)
+
+    @property
+    def requires_alsa_fw(self):
+        return any('snd_hda_intel' in module for module in self.modules)
+
+
+@functools.lru_cache(maxsize=None)
+def profile() -> HardwareProfile:
+    """Returns the hardware profile of this machine, probed once per process."""
+    return HardwareProfile.probe()
 
 
 def has_uefi() -> bool:
     """Checks if the system supports UEFI."""
-    return os.path.isdir('/sys/firmware/efi')
+    return profile().uefi
 
 
-def _graphics_devices() -> list:
-    """Lists all graphics devices using the lspci command."""
-    lspci_output = subprocess.check_output(['lspci']).decode('utf-8')
-    return [line for line in lspci_output.splitlines() if 'VGA' in line or '3D' in line]
-
 def has_nvidia_graphics() -> bool:
     """Checks if the system has an NVIDIA graphics card."""
-    return any('NVIDIA' in device for device in _graphics_devices())
+    return profile().has_nvidia_graphics
 
 def has_amd_graphics() -> bool:
     """Checks if the system has an AMD graphics card."""
-    return any('AMD' in device for device in _graphics_devices())
+    return profile().has_amd_graphics
 
 def has_intel_graphics() -> bool:
     """Checks if the system has an Intel graphics card."""
-    return any('Intel' in device for device in _graphics_devices())
+    return profile().has_intel_graphics
 
 
 def cpu_vendor() -> str:
     """Retrieves the CPU vendor information."""
-    with open('/proc/cpuinfo', 'r') as f:
-        for line in f:
-            if line.startswith('vendor_id'):
-                return line.split(':')[1].strip()
-    return ''
+    return profile().cpu_vendor
 
 def cpu_model() -> str:
     """Retrieves the CPU model information."""
-    with open('/proc/cpuinfo', 'r') as f:
-        for line in f:
-            if line.startswith('model name'):
-                return line.split(':')[1].strip()
-    return ''
+    return profile().cpu_model
+
+
+def cpu_flags() -> frozenset:
+    """Retrieves the CPU feature flags."""
+    return frozenset(profile().cpu_flags)
+
+def isa_level_from_flags(flags) -> int:
+    """Returns the highest x86-64 level (1-4) the flags satisfy, or 0 if not even the baseline."""
+    level = 0
+    required = set()
+    for candidate in sorted(ISA_LEVEL_FLAGS):
+        required |= ISA_LEVEL_FLAGS[candidate]
+        if not required <= flags:
+            break
+        level = candidate
+    return level
+
+def isa_level() -> int:
+    """Determines the x86-64 microarchitecture level (x86-64-v1 to v4) of the CPU."""
+    return profile().isa_level
 
 
 def mem_available() -> str:
     """Retrieves the available memory information."""
-    with open('/proc/meminfo', 'r') as f:
-        for line in f:
-            if line.startswith('MemAvailable'):
-                return line.split(':')[1].strip()
-    return ''
+    return f"{profile().mem_available // 1024} kB"
 
 def mem_free() -> str:
     """Retrieves the free memory information."""
-    with open('/proc/meminfo', 'r') as f:
-        for line in f:
-            if line.startswith('MemFree'):
-                return line.split(':')[1].strip()
-    return ''
+    return f"{profile().mem_free // 1024} kB"
 
 def mem_total() -> str:
     """Retrieves the total memory information."""
-    with open('/proc/meminfo', 'r') as f:
-        for line in f:
-            if line.startswith('MemTotal'):
-                return line.split(':')[1].strip()
-    return ''
+    return f"{profile().mem_total // 1024} kB"
 
 
 def virtualization() -> str:
     """Detects the type of virtualization, if any."""
-    try:
-        return subprocess.check_output(['systemd-detect-virt']).decode('utf-8').strip()
-    except subprocess.CalledProcessError:
-        return 'None'
+    return profile().virtualization
 
 def is_vm() -> bool:
     """Determines if the system is running inside a virtual machine."""
-    virt_type = virtualization()
-    return virt_type != 'None' and virt_type != 'none'
+    return profile().is_vm
 
 
 def requires_sof_fw() -> bool:
     """Checks if SOF (Sound Open Firmware) modules are loaded."""
-    with open('/proc/modules', 'r') as f:
-        for line in f:
-            if 'snd_sof' in line:
-                return True
-    return False
+    return profile().requires_sof_fw
 
 def requires_alsa_fw() -> bool:
     """Checks if ALSA (Advanced Linux Sound Architecture) modules are loaded."""
-    with open('/proc/modules', 'r') as f:
-        for line in f:
-            if 'snd_hda_intel' in line:
-                return True
-    return False
+    return profile().requires_alsa_fw
 
 
 def has_wifi() -> bool:
     """Checks if any of the system's network interfaces support wireless connectivity."""
-    try:
-        interfaces = subprocess.check_output(['iwconfig'], stderr=subprocess.STDOUT).decode('utf-8')
-        return 'no wireless extensions' not in interfaces
-    except subprocess.CalledProcessError:
-        return False
-    
+    return bool(profile().wifi_interfaces)
+
 
 def sys_vendor() -> str:
     """Retrieves the system's vendor information."""
-    with open('/sys/devices/virtual/dmi/id/sys_vendor', 'r') as f:
-        return f.read().strip()
+    return profile().sys_vendor
 
 def product_name() -> str:
     """Retrieves the system's product name."""
-    with open('/sys/devices/virtual/dmi/id/product_name', 'r') as f:
-        return f.read().strip()
+    return profile().product_name
 
 
 def loaded_modules() -> list:
     """Retrieves a list of all loaded kernel modules."""
-    with open('/proc/modules', 'r') as f:
-        return [line.split(' ')[0] for line in f.readlines()]
-    
-    
\ No newline at end of file
+    return list(profile().modules)
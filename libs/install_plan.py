@@ -0,0 +1,360 @@
+# Standard library imports
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from libs import system_config
+from libs import aur_builder
+from libs import boot_options
+from libs import cache_proxy
+from libs import chroot
+from libs import disk_operations
+from libs import download_tuner
+from libs import graphics
+from libs import makepkg_tuner
+from libs import mirrors
+from libs import package_cache
+from libs import power_tuner
+from libs.packages import transaction
+from libs.trace import tracer
+
+# Upper bound on steps running at the same time
+DEFAULT_WORKERS = 4
+
+
+class PlanStep:
+    """A single installer step and the artifacts it consumes and produces."""
+    def __init__(self, name, func, inputs=(), outputs=(), resources=(), interactive=False, estimate=1.0):
+        """
+        Parameters:
+        - name: Unique step name shown in progress output.
+        - func: Callable taking no arguments that performs the step.
+        - inputs: Artifact names that must exist before the step can start.
+        - outputs: Artifact names the step creates.
+        - resources: Exclusive resources (e.g. the pacman database lock) the step holds while running.
+        - interactive: Whether the step talks to the user and must run on the UI thread.
+        - estimate: Rough seconds the step takes, used to start long chains first.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = set(inputs)
+        self.outputs = set(outputs)
+        self.resources = set(resources)
+        self.interactive = interactive
+        self.estimate = estimate
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class InstallPlan:
+    """A DAG of installer steps executed by a bounded worker pool."""
+    def __init__(self, max_workers=DEFAULT_WORKERS, provided=()):
+        """
+        Parameters:
+        - max_workers: Maximum number of non-interactive steps running at once.
+        - provided: Artifacts that already exist before the plan starts.
+        """
+        self.max_workers = max_workers
+        self.provided = set(provided)
+        self.steps = {}
+
+    def add_step(self, step):
+        if step.name in self.steps:
+            raise ValueError(f"Duplicate install plan step: {step.name}")
+        self.steps[step.name] = step
+        return step
+
+    def dependencies(self):
+        """
+        Resolves each step's inputs to the steps producing them.
+
+        Returns:
+        - Dictionary mapping a step name to the set of step names it depends on.
+        """
+        producers = {}
+        for step in self.steps.values():
+            for artifact in step.outputs:
+                producers.setdefault(artifact, set()).add(step.name)
+
+        deps = {}
+        for step in self.steps.values():
+            deps[step.name] = set()
+            for artifact in step.inputs:
+                if artifact in producers:
+                    deps[step.name] |= producers[artifact] - {step.name}
+                elif artifact not in self.provided:
+                    raise ValueError(f"Step {step.name} needs '{artifact}' but no step produces it")
+        return deps
+
+    def topological_order(self):
+        """Returns the step names in a valid execution order, raising ValueError on cycles."""
+        deps = self.dependencies()
+        remaining = {name: set(d) for name, d in deps.items()}
+        order = []
+        while remaining:
+            ready = [name for name, d in remaining.items() if not d]
+            if not ready:
+                raise ValueError(f"Install plan has a dependency cycle between: {', '.join(sorted(remaining))}")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+            for d in remaining.values():
+                d.difference_update(ready)
+        return order
+
+    def priorities(self):
+        """
+        Ranks the steps by the estimated length of the longest chain they start.
+
+        Returns:
+        - Dictionary mapping a step name to the estimated seconds from its start to the
+          end of its longest chain of dependent steps.
+        """
+        deps = self.dependencies()
+        dependents = {name: set() for name in deps}
+        for name, needed in deps.items():
+            for dep in needed:
+                dependents[dep].add(name)
+        priority = {}
+        for name in reversed(self.topological_order()):
+            priority[name] = self.steps[name].estimate + max((priority[d] for d in dependents[name]), default=0.0)
+        return priority
+
+    def run(self, on_event=None):
+        """
+        Executes the plan, starting every step as soon as its inputs exist.
+
+        When more steps are ready than workers are free, the steps heading the longest
+        remaining chains (see priorities()) start first, so the critical path is not
+        held up behind short side branches.
+
+        Parameters:
+        - on_event: Optional callable invoked as on_event(event, step) on the calling
+          thread, where event is "start", "done" or "failed".
+
+        Returns:
+        - List of failed steps (empty when the whole plan succeeded).
+        """
+        deps = self.dependencies()
+        priority = self.priorities()  # Also rejects cycles before anything runs
+        notify = on_event or (lambda event, step: None)
+
+        pending = set(self.steps)
+        done = set()
+        failed = []
+        held = set()
+        running = {}
+
+        def can_start(name):
+            step = self.steps[name]
+            return deps[name] <= done and not (step.resources & held)
+
+        # Steps on pool threads are nested under whatever step started the plan
+        parent_span = tracer.current()
+
+        def execute(step):
+            step.started = time.monotonic()
+            try:
+                with tracer.step(step.name, parent_span):
+                    step.func()
+            finally:
+                step.finished = time.monotonic()
+
+        def finish(step, error):
+            held.difference_update(step.resources)
+            if error is None:
+                done.add(step.name)
+                notify("done", step)
+            else:
+                step.error = error
+                failed.append(step)
+                logging.error(f"Install plan step {step.name} failed: {str(error)}")
+                notify("failed", step)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                if not failed:
+                    ready = sorted(pending, key=lambda name: (-priority[name], name))
+                    for name in ready:
+                        step = self.steps[name]
+                        if step.interactive or len(running) >= self.max_workers or not can_start(name):
+                            continue
+                        pending.discard(name)
+                        held.update(step.resources)
+                        notify("start", step)
+                        running[pool.submit(execute, step)] = step
+
+                    # Interactive steps run here on the UI thread while the pool keeps working
+                    interactive = [name for name in ready
+                                   if name in pending and self.steps[name].interactive and can_start(name)]
+                    if interactive:
+                        step = self.steps[interactive[0]]
+                        pending.discard(step.name)
+                        held.update(step.resources)
+                        notify("start", step)
+                        try:
+                            execute(step)
+                            finish(step, None)
+                        except (Exception, SystemExit) as e:
+                            finish(step, e)
+                        continue
+
+                if not running:
+                    break
+
+                completed, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in completed:
+                    step = running.pop(future)
+                    finish(step, future.exception())
+
+        return failed
+
+    def critical_path(self):
+        """
+        Finds the chain of dependent steps with the largest total measured duration.
+
+        Returns:
+        - Tuple of (list of step names along the path, total seconds).
+        """
+        deps = self.dependencies()
+        best = {}
+        for name in self.topological_order():
+            previous = max(deps[name], key=lambda d: best[d][1], default=None)
+            path, length = best[previous] if previous else ([], 0.0)
+            best[name] = (path + [name], length + self.steps[name].duration)
+        if not best:
+            return [], 0.0
+        return max(best.values(), key=lambda entry: entry[1])
+
+    def total_step_time(self):
+        """Returns the sum of all step durations, i.e. the time a serial run would take."""
+        return sum(step.duration for step in self.steps.values())
+
+
+def default_install_plan(stdscr, session=None):
+    """
+    Builds the plan for a full installation from the existing menu steps.
+
+    Parameters:
+    - stdscr: The curses window object used by interactive steps.
+    - session: ChrootSession started once the base system exists; configuration steps run through it.
+
+    Returns:
+    - InstallPlan ready to run, assuming the target filesystem is mounted at /mnt.
+    """
+    plan = InstallPlan(provided={"mounted-target"})
+    # Estimates are rough seconds on a typical machine; they only decide which ready step starts first
+    plan.add_step(PlanStep("Rank mirrors", mirrors.rank_and_write_mirrorlists,
+                           outputs={"mirrorlist"}, estimate=15))
+    plan.add_step(PlanStep("Detect LAN package cache", cache_proxy.detect_and_use_cache_proxy,
+                           inputs={"mirrorlist"}, outputs={"lan-cache"}))
+    plan.add_step(PlanStep("Tune parallel downloads", download_tuner.tune_parallel_downloads,
+                           inputs={"mirrorlist"}, outputs={"host-pacman-tuned"}, resources={"pacman.conf"}))
+    # Package selections only queue packages, so they run before the single pacstrap transaction
+    plan.add_step(PlanStep("Install essential packages", system_config.install_essential_packages,
+                           inputs={"mounted-target"}, outputs={"base-queued"}))
+    plan.add_step(PlanStep("Kernel Selector", lambda: system_config.kernel_selector(stdscr),
+                           inputs={"mounted-target"}, outputs={"kernel"}, interactive=True))
+    plan.add_step(PlanStep("Install additional packages", lambda: system_config.install_additional_packages(stdscr),
+                           inputs={"mounted-target"}, outputs={"packages"}, interactive=True))
+    plan.add_step(PlanStep("Desktop Environment Installation", lambda: system_config.install_desktop_environment(stdscr),
+                           inputs={"mounted-target"}, outputs={"desktop"}, interactive=True))
+    plan.add_step(PlanStep("Graphics drivers", graphics.install_graphics_drivers,
+                           inputs={"kernel", "desktop"}, outputs={"graphics"}))
+    plan.add_step(PlanStep("CPU power profile", power_tuner.queue_power_profile,
+                           inputs={"kernel"}, outputs={"power-queued"}))
+    plan.add_step(PlanStep("Seed package cache", package_cache.seed_package_cache,
+                           inputs={"base-queued", "kernel", "packages", "desktop", "graphics", "power-queued"},
+                           outputs={"package-cache"}, estimate=20))
+    plan.add_step(PlanStep("Build AUR packages", aur_builder.build_vendored_packages,
+                           inputs={"mirrorlist"}, outputs={"aur-packages"}, resources={"pacman.conf"}, estimate=180))
+    plan.add_step(PlanStep("Install queued packages", transaction.commit,
+                           inputs={"host-pacman-tuned", "lan-cache", "package-cache", "aur-packages"},
+                           outputs={"base-system"},
+                           resources={"pacman"}, estimate=300))
+    if session is not None:
+        plan.add_step(PlanStep("Start chroot session", session.start,
+                               inputs={"base-system"}, outputs={"chroot"}))
+    else:
+        plan.provided.add("chroot")
+    plan.add_step(PlanStep("Tune target pacman", download_tuner.apply_to_target,
+                           inputs={"base-system"}, outputs={"target-pacman-tuned"}, resources={"pacman.conf"}))
+    plan.add_step(PlanStep("Configure fstab", disk_operations.configure_fstab,
+                           inputs={"base-system"}, outputs={"fstab"}))
+    plan.add_step(PlanStep("Set time zone", system_config.set_time_zone,
+                           inputs={"chroot"}, outputs={"timezone"}))
+    plan.add_step(PlanStep("Localization", system_config.localization,
+                           inputs={"chroot"}, outputs={"locale"}))
+    plan.add_step(PlanStep("Set hostname", system_config.set_hostname,
+                           inputs={"chroot"}, outputs={"hostname"}, interactive=True))
+    plan.add_step(PlanStep("Setup Chaotic-AUR", system_config.setup_chaotic_aur,
+                           inputs={"chroot", "target-pacman-tuned"}, outputs={"repo-chaotic-aur"}, resources={"pacman", "pacman.conf"}))
+    plan.add_step(PlanStep("Setup CachyOS Repository", system_config.setup_cachyos_repo,
+                           inputs={"chroot", "target-pacman-tuned"}, outputs={"repo-cachyos"}, resources={"pacman", "pacman.conf"}))
+    plan.add_step(PlanStep("Apply boot options", boot_options.apply_boot_options,
+                           inputs={"base-system", "graphics", "power-queued"}, outputs={"boot-options"}))
+    plan.add_step(PlanStep("Configure CPU power", power_tuner.configure_power_profile,
+                           inputs={"chroot", "power-queued"}, outputs={"power"}))
+    plan.add_step(PlanStep("Tune makepkg", makepkg_tuner.tune_makepkg,
+                           inputs={"chroot"}, outputs={"makepkg-tuned"}, estimate=60))
+    return plan
+
+
+def run_install_plan(stdscr):
+    """
+    Runs the default install plan and reports progress and the critical path.
+
+    Parameters:
+    - stdscr: The curses window object.
+    """
+    session = chroot.ChrootSession()
+    plan = default_install_plan(stdscr, session)
+    status = {name: "waiting" for name in plan.steps}
+
+    def draw(event=None, step=None):
+        if step is not None:
+            status[step.name] = event
+        stdscr.clear()
+        h, w = stdscr.getmaxyx()
+        title = "Install Plan"
+        stdscr.addstr(1, (w - len(title)) // 2, title)
+        for idx, name in enumerate(plan.topological_order()):
+            if 3 + idx >= h - 1:
+                break
+            stdscr.addstr(3 + idx, 2, f"[{status[name]:^7}] {name}"[:w - 3])
+        stdscr.refresh()
+
+    draw()
+    wall_start = time.monotonic()
+    try:
+        failed = plan.run(on_event=draw)
+    finally:
+        session.stop()
+    wall_time = time.monotonic() - wall_start
+
+    path, path_time = plan.critical_path()
+    lines = [
+        f"Wall time: {wall_time:.1f}s (serial would be {plan.total_step_time():.1f}s)",
+        f"Critical path ({path_time:.1f}s): {' -> '.join(path)}",
+    ]
+    lines.append(transaction.report())
+    lines += [f"FAILED: {step.name}: {step.error}" for step in failed]
+    for line in lines:
+        logging.info(line)
+
+    stdscr.clear()
+    h, w = stdscr.getmaxyx()
+    for idx, line in enumerate(lines):
+        if idx >= h - 1:
+            break
+        stdscr.addstr(idx, 0, line[:w - 1])
+    stdscr.refresh()
+    while stdscr.getch() == -1:  # The main menu leaves the window in timeout mode
+        pass
@@ -0,0 +1,162 @@
+# Standard library imports
+import logging
+import os
+import time
+from pathlib import Path
+
+from libs.packages import estimate_hook_runs, transaction
+from libs.trace import tracer
+from libs.utils import run_command
+
+# pacman hooks that are held back while the installer runs
+DEFERRED_HOOKS = (
+    "90-mkinitcpio-install.hook",  # Rebuilds every initramfs on kernel/microcode/firmware changes
+    "05-snap-pac-pre.hook",        # snapper pre-transaction snapshot
+    "zz-snap-pac-post.hook",       # snapper post-transaction snapshot
+)
+
+# The deferred kernels are installed one after another. Building them in parallel was
+# tried first and dropped: each arch-chroot mounts and unmounts the target's /proc, /sys
+# and /dev, so concurrent runs on the same root raced.
+
+# The script behind 90-mkinitcpio-install.hook; besides building it copies each kernel to /boot and writes its preset
+MKINITCPIO_ALPM_SCRIPT = "/usr/share/libalpm/scripts/mkinitcpio"
+
+
+class InstallSession:
+    """
+    Holds back the initramfs and snapshot pacman hooks for a whole installer run.
+
+    A hook is disabled by placing a symlink to /dev/null with the same name in the
+    override hook directory. pacstrap runs pacman with the live host's HookDir while
+    pacman inside the chroot uses the target's, so both directories are masked; the
+    target's only once it is mounted, right before the first package transaction.
+    When the session ends the masks are removed and the hook's work runs once per
+    installed kernel: the kernel is copied to /boot, its preset written and its
+    initramfs built.
+    """
+    def __init__(self, root="/mnt", host_hook_dir="/etc/pacman.d/hooks"):
+        """
+        Parameters:
+        - root: Mount point of the target system.
+        - host_hook_dir: Override hook directory of the live host.
+        """
+        self.root = root
+        self.host_hook_dir = host_hook_dir
+        self.target_hook_dir = os.path.join(root, "etc/pacman.d/hooks")
+        self.masks = []
+        self.build_times = {}
+        self.rebuild_wall_time = 0.0
+        self.hook_runs_deferred = {"mkinitcpio": 0, "snapshots": 0}
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Always finish, even on errors, so the target never keeps masked hooks
+        self.end()
+        return False
+
+    def mask_hooks(self, hook_dir):
+        """Masks the deferred hooks in a hook directory, except the ones it already overrides."""
+        for hook in DEFERRED_HOOKS:
+            mask = Path(hook_dir) / hook
+            if mask.exists() or mask.is_symlink():
+                continue  # Respect hooks the user already overrides (and masks made earlier)
+            try:
+                mask.parent.mkdir(parents=True, exist_ok=True)
+                mask.symlink_to("/dev/null")
+                self.masks.append(mask)
+            except OSError as e:
+                logging.error(f"Could not defer pacman hook {mask}: {str(e)}")
+
+    def mask_target_hooks(self):
+        """
+        Masks the hooks in the target once it is mounted.
+
+        Registered to run before every package transaction: before the target is mounted
+        the path would be a directory on the live system, hidden by the later mount.
+        """
+        if os.path.ismount(self.root):
+            self.mask_hooks(self.target_hook_dir)
+
+    def begin(self):
+        """Masks the host's deferred hooks and arranges for the target's to be masked once it is mounted."""
+        self.mask_hooks(self.host_hook_dir)
+        transaction.before_commit.append(self.mask_target_hooks)
+
+    def restore_hooks(self):
+        """Removes every mask created by this session."""
+        for mask in self.masks:
+            try:
+                if mask.is_symlink():
+                    mask.unlink()
+            except OSError as e:
+                logging.error(f"Could not restore pacman hook {mask}: {str(e)}")
+        self.masks = []
+
+    def installed_kernels(self):
+        """Returns the kernel images installed in the target, relative to its root as pacman passes them to hooks."""
+        modules = Path(self.root) / "usr/lib/modules"
+        return sorted(str(vmlinuz.relative_to(self.root)) for vmlinuz in modules.glob("*/vmlinuz"))
+
+    def install_kernel(self, vmlinuz):
+        """
+        Does the deferred mkinitcpio hook work for one kernel inside the target.
+
+        The hook's script copies the kernel to /boot, writes its preset and builds the
+        images. The preset is built explicitly should the script have left it unbuilt.
+        """
+        start = time.monotonic()
+        result = tracer.run(["arch-chroot", self.root, MKINITCPIO_ALPM_SCRIPT, "install"],
+                            input=vmlinuz + "\n", text=True, capture_output=True)
+        if result.returncode != 0:
+            logging.error(f"mkinitcpio hook failed for {vmlinuz}: {result.stderr}")
+        pkgbase_file = Path(self.root) / os.path.dirname(vmlinuz) / "pkgbase"
+        pkgbase = pkgbase_file.read_text().strip() if pkgbase_file.exists() else os.path.basename(os.path.dirname(vmlinuz))
+        if not (Path(self.root) / f"boot/initramfs-{pkgbase}.img").exists():
+            run_command(f"arch-chroot {self.root} mkinitcpio -p {pkgbase}")
+        self.build_times[pkgbase] = time.monotonic() - start
+
+    def rebuild_initramfs(self):
+        """
+        Installs and builds every kernel of the target, one after another.
+
+        Each arch-chroot mounts and unmounts the target's /proc, /sys and /dev when it
+        exits, so running them in parallel on the same root would race.
+        """
+        kernels = self.installed_kernels()
+        if not kernels:
+            logging.warning(f"No kernel found in {self.root}; skipping the deferred initramfs build")
+            return
+        start = time.monotonic()
+        for vmlinuz in kernels:
+            self.install_kernel(vmlinuz)
+        self.rebuild_wall_time = time.monotonic() - start
+
+    def end(self):
+        """Restores the hooks and runs the deferred initramfs builds once."""
+        if self.mask_target_hooks in transaction.before_commit:
+            transaction.before_commit.remove(self.mask_target_hooks)
+        self.restore_hooks()
+        self.hook_runs_deferred = estimate_hook_runs(list(transaction.committed_batches))
+        if self.hook_runs_deferred["mkinitcpio"]:
+            self.rebuild_initramfs()
+        logging.info(self.report())
+
+    def time_saved(self):
+        """
+        Estimates the time saved compared with the mkinitcpio hook running per transaction.
+
+        Each hook run rebuilds all presets one after another, so it costs the sum of the
+        measured per-kernel build times, as the single deferred run does.
+        """
+        serial_build = sum(self.build_times.values())
+        return max(0.0, self.hook_runs_deferred["mkinitcpio"] * serial_build - self.rebuild_wall_time)
+
+    def report(self):
+        """Returns a one-line summary of the deferred hook work."""
+        return (f"Deferred {self.hook_runs_deferred['mkinitcpio']} initramfs rebuild(s) and "
+                f"{self.hook_runs_deferred['snapshots']} snapper snapshot(s); built {len(self.build_times)} "
+                f"initramfs in {self.rebuild_wall_time:.1f}s, saving about {self.time_saved():.1f}s")
@@ -0,0 +1,302 @@
+# Standard library imports
+import logging
+import os
+import re
+import time
+
+from libs import hardware
+from libs.chroot import run_in_target, target_path, target_session, write_target_file
+from libs.pacman_conf import atomic_write
+
+MAKEPKG_CONF = "/etc/makepkg.conf"
+RUST_CONF = "/etc/makepkg.conf.d/rust.conf"
+BUILDDIR = "/tmp/makepkg"
+BUILDDIR_TMPFILES = "/etc/tmpfiles.d/makepkg-builddir.conf"
+
+JOB_MEMORY = 2 * 1024 ** 3        # Memory budgeted per compile job
+TMPFS_MIN_MEMORY = 16 * 1024 ** 3  # Below this, builds stay on disk; /tmp is half of RAM
+
+SAMPLE_DIR = "/tmp/makepkg-sample"
+SAMPLE_UNITS = 32
+SAMPLE_FUNCTIONS = 40
+
+SAMPLE_PKGBUILD = """pkgname=makepkg-sample
+pkgver=1
+pkgrel=1
+pkgdesc="Sample package timed by the installer"
+arch=('x86_64')
+license=('custom')
+options=('!debug')
+
+build() {
+  cp "$startdir"/unit*.c "$startdir"/Makefile "$startdir"/data.txt .
+  make
+}
+
+package() {
+  install -Dm755 sample "$pkgdir/usr/bin/makepkg-sample"
+  install -Dm644 data.txt "$pkgdir/usr/share/makepkg-sample/data.txt"
+}
+"""
+
+SAMPLE_MAKEFILE = """OBJS := $(patsubst %.c,%.o,$(wildcard unit*.c))
+
+sample: $(OBJS)
+\t$(CC) $(CFLAGS) $(LDFLAGS) -o $@ $^
+
+%.o: %.c
+\t$(CC) $(CFLAGS) -c -o $@ $<
+"""
+
+
+def _assignment(name):
+    # Quoted values may span several lines, arrays sit in parentheses
+    return re.compile(rf'^{name}=("(?:[^"\\]|\\[\s\S])*"|\([^)]*\)|\S*)', re.MULTILINE)
+
+
+def get_variable(text, name):
+    """Returns the raw value of an active shell assignment, or None."""
+    match = _assignment(name).search(text)
+    return match.group(1) if match else None
+
+
+def set_variable(text, name, value):
+    """
+    Sets a shell assignment, replacing the active one or its commented-out default.
+
+    Returns:
+    - The edited text.
+    """
+    line = f"{name}={value}"
+    pattern = _assignment(name)
+    if pattern.search(text):
+        return pattern.sub(lambda match: line, text, count=1)
+    commented = re.compile(rf"^#\s*{name}=.*$", re.MULTILINE)
+    if commented.search(text):
+        return commented.sub(lambda match: line, text, count=1)
+    if text and not text.endswith("\n"):
+        text += "\n"
+    return text + line + "\n"
+
+
+def _replace_flag(flags, prefix, flag):
+    """Replaces every flag starting with prefix, or prepends the flag when there is none."""
+    # Edited in place so line continuations in multi-line values survive
+    pattern = re.compile(rf"(?<!\S){re.escape(prefix)}\S*")
+    if pattern.search(flags):
+        return pattern.sub(lambda match: flag, flags)
+    return f"{flag} {flags}" if flags else flag
+
+
+class MakepkgTuning:
+    """makepkg settings derived from the hardware, plus the timed sample build."""
+    def __init__(self, jobs, cpu_target, builddir=None):
+        self.jobs = jobs
+        self.cpu_target = cpu_target  # -march value, or None to leave compiler flags alone
+        self.builddir = builddir
+        self.baseline_time = None
+        self.tuned_time = None
+
+    @property
+    def speedup(self):
+        if not self.baseline_time or not self.tuned_time:
+            return None
+        return self.baseline_time / self.tuned_time
+
+    def report(self):
+        text = f"MAKEFLAGS=-j{self.jobs}, zstd -T0"
+        if self.cpu_target:
+            text += f", -march={self.cpu_target}"
+        text += f", BUILDDIR={self.builddir}" if self.builddir else ", builds on disk"
+        if self.speedup is not None:
+            text += (f"; sample build {self.baseline_time:.1f}s -> {self.tuned_time:.1f}s "
+                     f"({self.speedup:.1f}x)")
+        else:
+            text += "; sample build not timed"
+        return text
+
+
+def plan_makepkg_tuning(cores=None, memory=None, level=None, native=False):
+    """
+    Derives makepkg settings from the hardware.
+
+    Parameters:
+    - cores: Number of CPUs (defaults to the detected count).
+    - memory: Total RAM in bytes (defaults to the hardware profile).
+    - level: x86-64 level (defaults to the hardware profile).
+    - native: Build for exactly this CPU (-march=native) instead of its x86-64 level.
+
+    Returns:
+    - MakepkgTuning.
+    """
+    machine = hardware.profile()
+    cores = cores or machine.cpu_count
+    if memory is None:
+        memory = machine.mem_total
+    if level is None:
+        level = machine.isa_level
+
+    # Each job gets enough memory that large C++ builds do not start swapping
+    jobs = max(1, min(cores, memory // JOB_MEMORY))
+    if level == 0:
+        cpu_target = None
+    elif native:
+        cpu_target = "native"
+    else:
+        cpu_target = f"x86-64-v{level}" if level >= 2 else "x86-64"
+    builddir = BUILDDIR if memory >= TMPFS_MIN_MEMORY else None
+    return MakepkgTuning(jobs, cpu_target, builddir)
+
+
+def tune_makepkg_text(text, tuning):
+    """Applies the tuning to the text of a makepkg.conf."""
+    text = set_variable(text, "MAKEFLAGS", f'"-j{tuning.jobs}"')
+
+    compress = get_variable(text, "COMPRESSZST") or "(zstd -c -z -q -)"
+    args = [arg for arg in compress.strip("()").split() if not re.match(r"^(-T\d+|--threads=\d+)$", arg)]
+    if args and args[-1] == "-":
+        args.insert(len(args) - 1, "-T0")
+    else:
+        args.append("-T0")
+    text = set_variable(text, "COMPRESSZST", "(" + " ".join(args) + ")")
+
+    if tuning.cpu_target:
+        cflags = get_variable(text, "CFLAGS")
+        if cflags is not None:
+            flags = cflags[1:-1] if cflags.startswith('"') else cflags
+            flags = _replace_flag(flags, "-march=", f"-march={tuning.cpu_target}")
+            flags = _replace_flag(flags, "-mtune=", "-mtune=native" if tuning.cpu_target == "native" else "-mtune=generic")
+            text = set_variable(text, "CFLAGS", f'"{flags}"')
+
+    if tuning.builddir:
+        text = set_variable(text, "BUILDDIR", tuning.builddir)
+    return text
+
+
+def tune_rustflags_text(text, tuning):
+    """Adds -C target-cpu to the RUSTFLAGS of a makepkg configuration file."""
+    rustflags = get_variable(text, "RUSTFLAGS") or '""'
+    flags = re.sub(r"\s*-C\s*target-cpu=\S+", "", rustflags.strip('"')).strip()
+    target_cpu = f"-C target-cpu={tuning.cpu_target}"
+    return set_variable(text, "RUSTFLAGS", f'"{flags} {target_cpu}"' if flags else f'"{target_cpu}"')
+
+
+def apply_makepkg_tuning(tuning):
+    """
+    Writes the tuning into the target's makepkg configuration.
+
+    Returns:
+    - The makepkg.conf text before tuning, used as the baseline of the sample build.
+    """
+    conf_path = target_path(MAKEPKG_CONF)
+    with open(conf_path, "r") as f:
+        original = f.read()
+    tuned = tune_makepkg_text(original, tuning)
+
+    if tuning.cpu_target:
+        # RUSTFLAGS lives in a drop-in on current pacman, which is sourced after makepkg.conf
+        rust_path = target_path(RUST_CONF)
+        if os.path.exists(rust_path):
+            with open(rust_path, "r") as f:
+                rust_text = f.read()
+            new_rust_text = tune_rustflags_text(rust_text, tuning)
+            if new_rust_text != rust_text:
+                atomic_write(rust_path, new_rust_text)
+        else:
+            tuned = tune_rustflags_text(tuned, tuning)
+
+    if tuned != original:
+        atomic_write(conf_path, tuned)
+    if tuning.builddir:
+        write_target_file(BUILDDIR_TMPFILES, f"d {tuning.builddir} 1777 root root -\n")
+    logging.info(f"Tuned {MAKEPKG_CONF}: {tuning.report()}")
+    return original
+
+
+def _write_sample_sources(sample_dir):
+    for unit in range(SAMPLE_UNITS):
+        with open(os.path.join(sample_dir, f"unit{unit}.c"), "w") as f:
+            for function in range(SAMPLE_FUNCTIONS):
+                f.write(f"double f{unit}_{function}(const double *v, int n) {{\n"
+                        f"    double s = {function}.0;\n"
+                        f"    for (int i = 0; i < n; i++) s += v[i] * (i % {function + 3}) / (v[i] + {unit + 1}.0);\n"
+                        f"    return s;\n}}\n")
+            if unit == 0:
+                f.write("int main(void) { return 0; }\n")
+    with open(os.path.join(sample_dir, "data.txt"), "w") as f:
+        f.write("".join(f"{value}\n" for value in range(1500000)))
+    with open(os.path.join(sample_dir, "Makefile"), "w") as f:
+        f.write(SAMPLE_MAKEFILE)
+    with open(os.path.join(sample_dir, "PKGBUILD"), "w") as f:
+        f.write(SAMPLE_PKGBUILD)
+
+
+def time_sample_build(config=None):
+    """Builds the sample package in the target as an unprivileged user; returns the seconds taken or None."""
+    config_arg = f" --config {config}" if config else ""
+    start = time.monotonic()
+    result = run_in_target(f"cd {SAMPLE_DIR} && runuser -u nobody -- makepkg -Cf --nodeps --noconfirm{config_arg}",
+                           check=False)
+    if result.returncode != 0:
+        logging.error(f"Sample makepkg build failed: {result.stderr}")
+        return None
+    return time.monotonic() - start
+
+
+def verify_makepkg_tuning(tuning, baseline_text):
+    """Times the sample package with the original and the tuned makepkg.conf."""
+    if run_in_target("command -v gcc make makepkg runuser", check=False).returncode != 0:
+        logging.info("base-devel is not installed in the target; skipping the sample build")
+        return tuning
+    sample_dir = target_path(SAMPLE_DIR)
+    os.makedirs(sample_dir, exist_ok=True)
+    os.chmod(sample_dir, 0o777)
+    if tuning.builddir:
+        builddir = target_path(tuning.builddir)
+        os.makedirs(builddir, exist_ok=True)
+        os.chmod(builddir, 0o1777)
+    _write_sample_sources(sample_dir)
+    with open(os.path.join(sample_dir, "makepkg.conf.baseline"), "w") as f:
+        f.write(baseline_text)
+
+    tuning.baseline_time = time_sample_build(os.path.join(SAMPLE_DIR, "makepkg.conf.baseline"))
+    tuning.tuned_time = time_sample_build()
+    run_in_target(f"rm -rf {SAMPLE_DIR}", check=False)
+    return tuning
+
+
+def tune_makepkg(native=False, verify=True):
+    """
+    Tunes the target's makepkg.conf for this machine and times a sample build.
+
+    Returns:
+    - MakepkgTuning with the applied settings and the measured build times.
+    """
+    tuning = plan_makepkg_tuning(native=native)
+    # The menu entry has no session of its own; the live system's makepkg.conf must not change
+    with target_session():
+        baseline = apply_makepkg_tuning(tuning)
+        if verify:
+            verify_makepkg_tuning(tuning, baseline)
+    logging.info(tuning.report())
+    return tuning
+
+
+def tune_makepkg_menu(stdscr):
+    """Menu entry that tunes makepkg.conf in the target and shows the sample build times."""
+    stdscr.clear()
+    h, w = stdscr.getmaxyx()
+    stdscr.addstr(0, 0, "Build for this exact CPU (-march=native)? Packages will not run on older CPUs. (y/n): ")
+    stdscr.timeout(-1)
+    native = stdscr.getch() == ord('y')
+    stdscr.addstr(2, 0, "Tuning makepkg.conf and timing a sample build...")
+    stdscr.refresh()
+    try:
+        message = tune_makepkg(native=native).report()
+    except Exception as e:
+        logging.error(f"Error tuning makepkg: {str(e)}")
+        message = str(e)
+    stdscr.addstr(4, 0, message[:w - 1])
+    stdscr.refresh()
+    stdscr.getch()
+    stdscr.timeout(100)
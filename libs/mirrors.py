@@ -0,0 +1,278 @@
+# Standard library imports
+import asyncio
+import json
+import logging
+import os
+import re
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from libs.cache_dir import CACHE_ROOT, cache_file as private_cache_file
+from libs.pacman_conf import atomic_write
+
+MIRRORLIST = "/etc/pacman.d/mirrorlist"
+CACHE_FILE = os.path.join(CACHE_ROOT, "mirrors.json")
+CACHE_TTL = 3600  # Seconds a benchmark stays valid
+
+# Every mirror serves the same small file, and at most this many bytes of it are read
+TEST_FILE = "core.db"
+TEST_BYTES = 256 * 1024
+TEST_REPO = "core"
+TEST_ARCH = "x86_64"
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_MIRROR_COUNT = 10
+
+_SERVER_LINE = re.compile(r"^\s*#?\s*Server\s*=\s*(\S+)")
+
+
+class MirrorResult:
+    """Latency and throughput measured for one mirror."""
+    def __init__(self, url, latency=None, throughput=None, error=None):
+        self.url = url
+        self.latency = latency        # Seconds until the response headers arrived
+        self.throughput = throughput  # Bytes per second while reading the test file
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.throughput is not None
+
+    def to_dict(self):
+        return {"url": self.url, "latency": self.latency, "throughput": self.throughput, "error": self.error}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["url"], data.get("latency"), data.get("throughput"), data.get("error"))
+
+
+def read_mirrorlist(path=MIRRORLIST):
+    """
+    Reads every server from a mirrorlist, including commented-out ones.
+
+    Returns:
+    - List of server URL templates (containing $repo and $arch) without duplicates.
+    """
+    servers = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                match = _SERVER_LINE.match(line)
+                if match and match.group(1) not in servers:
+                    servers.append(match.group(1))
+    except OSError as e:
+        logging.error(f"Error reading mirrorlist {path}: {str(e)}")
+    return servers
+
+
+def test_url(server, test_file=TEST_FILE):
+    """Expands a server template into the URL of the benchmark file."""
+    base = server.replace("$repo", TEST_REPO).replace("$arch", TEST_ARCH)
+    return base.rstrip("/") + "/" + test_file
+
+
+async def fetch(url, max_bytes=TEST_BYTES, timeout=DEFAULT_TIMEOUT):
+    """
+    Downloads up to max_bytes of a URL over plain HTTP/1.0 or HTTPS.
+
+    Returns:
+    - Tuple of (seconds to the response headers, bytes read, seconds spent reading the body).
+    """
+    parts = urlsplit(url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+
+    start = time.monotonic()
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=ssl.create_default_context() if https else None),
+        timeout)
+    try:
+        # HTTP/1.0 keeps the body unchunked and lets the server close the connection
+        writer.write(f"GET {path} HTTP/1.0\r\nHost: {parts.hostname}\r\nUser-Agent: arch-install\r\n\r\n".encode())
+        await writer.drain()
+        status = await asyncio.wait_for(reader.readline(), timeout)
+        if not status.split(b" ")[1:2] == [b"200"]:
+            raise Exception(f"HTTP status {status.decode(errors='replace').strip()}")
+        while (await asyncio.wait_for(reader.readline(), timeout)) not in (b"\r\n", b"\n", b""):
+            pass
+        latency = time.monotonic() - start
+
+        received = 0
+        body_start = time.monotonic()
+        while received < max_bytes:
+            chunk = await asyncio.wait_for(reader.read(min(65536, max_bytes - received)), timeout)
+            if not chunk:
+                break
+            received += len(chunk)
+        return latency, received, time.monotonic() - body_start
+    finally:
+        writer.close()
+
+
+async def benchmark_mirror(server, semaphore, timeout=DEFAULT_TIMEOUT):
+    """Measures latency and throughput of a single mirror."""
+    async with semaphore:
+        try:
+            latency, received, elapsed = await fetch(test_url(server), timeout=timeout)
+            if not received:
+                raise Exception("empty response")
+            return MirrorResult(server, latency, received / max(elapsed, 1e-6))
+        except Exception as e:
+            return MirrorResult(server, error=str(e) or type(e).__name__)
+
+
+async def benchmark_mirrors_async(servers, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(benchmark_mirror(server, semaphore, timeout) for server in servers))
+
+
+def benchmark_mirrors(servers, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    """
+    Benchmarks many mirrors at the same time.
+
+    Parameters:
+    - servers: Server URL templates to measure.
+    - concurrency: Maximum number of mirrors measured at once.
+    - timeout: Per-operation timeout in seconds.
+
+    Returns:
+    - List of MirrorResult, one per server, in the order given.
+    """
+    return asyncio.run(benchmark_mirrors_async(servers, concurrency, timeout))
+
+
+def sort_results(results):
+    """Orders working mirrors by throughput, then latency."""
+    working = [result for result in results if result.ok]
+    return sorted(working, key=lambda result: (-result.throughput, result.latency))
+
+
+def _read_cache(cache_file):
+    if not private_cache_file(cache_file):
+        return None
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_cached_results(servers, cache_file=CACHE_FILE, ttl=CACHE_TTL):
+    """
+    Returns cached results for these servers if a benchmark younger than ttl covered all of them, else None.
+
+    A benchmark of the full mirrorlist also answers for the ranked subset written back
+    to it. Results for URLs that are not among the servers are never returned.
+    """
+    cache = _read_cache(cache_file)
+    if cache is None or time.time() - cache.get("timestamp", 0) > ttl:
+        return None
+    if not set(servers) <= set(cache.get("servers", [])):
+        return None
+    results = {}
+    for entry in cache.get("results", []):
+        result = MirrorResult.from_dict(entry)
+        if result.url in servers:
+            results[result.url] = result
+    return [results[server] for server in servers if server in results]
+
+
+def cached_best_throughput(cache_file=CACHE_FILE):
+    """Returns the throughput of the fastest mirror in the last benchmark, whatever its age, or None."""
+    cache = _read_cache(cache_file)
+    if cache is None:
+        return None
+    ranked = sort_results(MirrorResult.from_dict(entry) for entry in cache.get("results", []))
+    return ranked[0].throughput if ranked else None
+
+
+def save_cached_results(servers, results, cache_file=CACHE_FILE):
+    if not private_cache_file(cache_file):
+        return
+    try:
+        atomic_write(cache_file, json.dumps({"timestamp": time.time(), "servers": servers,
+                                             "results": [result.to_dict() for result in results]}))
+    except OSError as e:
+        logging.error(f"Error caching mirror benchmark: {str(e)}")
+
+
+# Working mirrors of the last ranking in this process, fastest first
+last_ranked = []
+
+
+def rank_mirrors(servers=None, use_cache=True, cache_file=CACHE_FILE, ttl=CACHE_TTL, **kwargs):
+    """
+    Benchmarks the given (or mirrorlist) servers, reusing a fresh cached benchmark.
+
+    Returns:
+    - List of working MirrorResult, fastest first.
+    """
+    global last_ranked
+    if servers is None:
+        servers = read_mirrorlist()
+    results = load_cached_results(servers, cache_file, ttl) if use_cache else None
+    if results is None:
+        results = benchmark_mirrors(servers, **kwargs)
+        save_cached_results(servers, results, cache_file)
+    last_ranked = sort_results(results)
+    return list(last_ranked)
+
+
+def ranked_mirrors():
+    """Returns the ranking from the "Rank mirrors" step, ranking the mirrorlist only if there is none yet."""
+    return list(last_ranked) or rank_mirrors()
+
+
+def write_mirrorlist(ranked, path, count=DEFAULT_MIRROR_COUNT):
+    """Writes the fastest mirrors to a mirrorlist file, replacing it atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lines = [f"## Ranked by arch-install on {time.strftime('%Y-%m-%d %H:%M:%S')}\n"]
+    for result in ranked[:count]:
+        lines.append(f"## {result.throughput / 1024:.0f} KiB/s, {result.latency * 1000:.0f} ms\n")
+        lines.append(f"Server = {result.url}\n")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+
+
+def rank_and_write_mirrorlists(targets=(MIRRORLIST,), count=DEFAULT_MIRROR_COUNT):
+    """
+    Ranks the live mirrorlist and writes the result for the live host.
+
+    pacstrap copies the host's mirrorlist into the target. Writing the target's before
+    that would conflict with the pacman-mirrorlist package, which owns the file.
+
+    Returns:
+    - List of ranked MirrorResult.
+    """
+    ranked = rank_mirrors()
+    if not ranked:
+        logging.error("No mirror answered the benchmark; keeping the existing mirrorlist")
+        return ranked
+    for path in targets:
+        write_mirrorlist(ranked, path, count)
+    logging.info(f"Ranked {len(ranked)} mirrors, fastest: {ranked[0].url}")
+    return ranked
+
+
+def rank_mirrors_menu(stdscr):
+    """Menu entry that ranks mirrors and shows the fastest ones."""
+    stdscr.clear()
+    h, w = stdscr.getmaxyx()
+    stdscr.addstr(0, 0, "Benchmarking mirrors...")
+    stdscr.refresh()
+    ranked = rank_and_write_mirrorlists()
+    stdscr.clear()
+    if not ranked:
+        stdscr.addstr(0, 0, "No mirror answered the benchmark; the mirrorlist was left unchanged.")
+    for idx, result in enumerate(ranked[:min(DEFAULT_MIRROR_COUNT, h - 2)]):
+        line = f"{result.throughput / 1024:8.0f} KiB/s {result.latency * 1000:6.0f} ms  {result.url}"
+        stdscr.addstr(idx, 0, line[:w - 1])
+    stdscr.refresh()
+    stdscr.getch()
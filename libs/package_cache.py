@@ -0,0 +1,213 @@
+# Standard library imports
+import curses
+import errno
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.packages import transaction
+from libs.sync_db import index
+
+HOST_CACHE = "/var/cache/pacman/pkg"
+SYNC_DB_DIR = "/var/lib/pacman/sync"
+PACKAGE_SUFFIXES = (".pkg.tar.zst", ".pkg.tar.xz")
+
+FICLONE = 0x40049409  # ioctl request that shares extents between two files (reflink)
+# FICLONE errors meaning "not possible here": other file system, no reflink support, old kernel
+CLONE_UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.ENOSYS)
+
+
+def package_name(filename):
+    """Extracts the package name from a name-version-release-arch.pkg.tar.* file name."""
+    parts = os.path.basename(filename).rsplit("-", 3)
+    return parts[0] if len(parts) == 4 else filename
+
+
+def find_packages(source_dirs):
+    """
+    Collects package files from one or more cache directories.
+
+    Returns:
+    - Dictionary mapping package file names to the first path found for them.
+    """
+    found = {}
+    for source in source_dirs:
+        if not os.path.isdir(source):
+            logging.error(f"Package cache {source} does not exist")
+            continue
+        for entry in os.scandir(source):
+            if entry.is_file() and entry.name.endswith(PACKAGE_SUFFIXES) and entry.name not in found:
+                found[entry.name] = entry.path
+    return found
+
+
+def sha256sum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def verify_package(path, checksums):
+    """
+    Verifies a cached package by its detached signature, or by the sync database checksum.
+
+    Returns:
+    - True if the package can be trusted.
+    """
+    signature = path + ".sig"
+    if os.path.exists(signature):
+        result = subprocess.run(["pacman-key", "--verify", signature, path], capture_output=True)
+        return result.returncode == 0
+    expected = checksums.get(os.path.basename(path))
+    return expected is not None and sha256sum(path) == expected
+
+
+def clone_file(source, destination):
+    """
+    Places source at destination as cheaply as the filesystems allow.
+
+    Returns:
+    - The method used: "reflink", "hardlink" or "copy".
+    """
+    # st_dev is no guide: btrfs subvolumes report different devices yet can share extents
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, destination)
+        return "reflink"
+    except OSError as e:
+        if os.path.exists(destination):
+            os.unlink(destination)
+        if e.errno not in CLONE_UNSUPPORTED:
+            raise
+    try:
+        os.link(source, destination)
+        return "hardlink"
+    except OSError:
+        pass
+    shutil.copy2(source, destination)
+    return "copy"
+
+
+class SeedResult:
+    """Statistics of one cache seeding run."""
+    def __init__(self):
+        self.seeded = {}     # file name -> size in bytes
+        self.methods = {}    # method -> number of files
+        self.rejected = []   # file names that failed verification
+        self.skipped = 0     # files already present in the target cache
+        self.sync_dbs = 0
+        self.requested = []  # package names the queued transaction downloads, dependencies included
+
+    def hit_rate(self):
+        if not self.requested:
+            return None
+        cached = {package_name(filename) for filename in self.seeded}
+        return sum(1 for name in self.requested if name in cached) / len(self.requested)
+
+    def bytes_saved(self):
+        if not self.requested:
+            return sum(self.seeded.values())
+        requested = set(self.requested)
+        return sum(size for filename, size in self.seeded.items() if package_name(filename) in requested)
+
+    def report(self):
+        methods = ", ".join(f"{count} {method}" for method, count in sorted(self.methods.items())) or "none"
+        hit_rate = self.hit_rate()
+        hit_text = f"{hit_rate:.0%} cache hit rate" if hit_rate is not None else "no packages queued"
+        return (f"Seeded {len(self.seeded)} packages ({methods}), rejected {len(self.rejected)}, "
+                f"copied {self.sync_dbs} sync databases; {hit_text}, "
+                f"{self.bytes_saved() / 1048576:.1f} MiB of downloads saved")
+
+
+def copy_sync_databases(root="/mnt", sync_dir=SYNC_DB_DIR):
+    """Copies the already-synced repository databases so the target does not fetch them again."""
+    target = os.path.join(root, sync_dir.lstrip("/"))
+    os.makedirs(target, exist_ok=True)
+    copied = 0
+    for db_path in glob.glob(os.path.join(sync_dir, "*")):
+        if os.path.isfile(db_path):
+            shutil.copy2(db_path, target)
+            copied += 1
+    return copied
+
+
+def requested_packages(queued):
+    """
+    Returns the packages pacstrap downloads for the queued names: their whole dependency
+    closure from the sync databases, or the names themselves when no database is synced.
+    """
+    resolved, missing = index.closure(queued)
+    return sorted(resolved) + missing if resolved else list(queued)
+
+
+def seed_package_cache(source_dirs=(HOST_CACHE,), root="/mnt", workers=None):
+    """
+    Verifies packages from local caches in parallel and seeds the target's package cache.
+
+    Parameters:
+    - source_dirs: Cache directories to take packages from.
+    - root: Mount point of the target system.
+    - workers: Number of parallel verification workers (defaults to the CPU count).
+
+    Returns:
+    - SeedResult with the seeding statistics.
+    """
+    result = SeedResult()
+    result.requested = requested_packages(transaction.pending())
+    target = os.path.join(root, HOST_CACHE.lstrip("/"))
+    os.makedirs(target, exist_ok=True)
+
+    candidates = {}
+    for filename, path in find_packages(source_dirs).items():
+        destination = os.path.join(target, filename)
+        if os.path.exists(destination) and os.path.getsize(destination) == os.path.getsize(path):
+            result.skipped += 1
+        elif os.path.realpath(path) != os.path.realpath(destination):
+            candidates[filename] = path
+
+    checksums = index.checksums() if candidates else {}
+
+    def seed(item):
+        filename, path = item
+        if not verify_package(path, checksums):
+            return filename, None
+        method = clone_file(path, os.path.join(target, filename))
+        if os.path.exists(path + ".sig"):
+            shutil.copy2(path + ".sig", target)
+        return filename, method
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4) as pool:
+        for filename, method in pool.map(seed, candidates.items()):
+            if method is None:
+                result.rejected.append(filename)
+                continue
+            result.seeded[filename] = os.path.getsize(candidates[filename])
+            result.methods[method] = result.methods.get(method, 0) + 1
+
+    result.sync_dbs = copy_sync_databases(root)
+    logging.info(result.report())
+    return result
+
+
+def seed_package_cache_menu(stdscr):
+    """Menu entry that asks for extra cache directories and seeds the target's package cache."""
+    stdscr.clear()
+    h, w = stdscr.getmaxyx()
+    stdscr.addstr(0, 0, f"Extra package cache directories (space-separated, {HOST_CACHE} is always used):")
+    curses.echo()
+    extra = stdscr.getstr(1, 0).decode('utf-8').split()
+    curses.noecho()
+    stdscr.addstr(3, 0, "Verifying and seeding packages...")
+    stdscr.refresh()
+    result = seed_package_cache([HOST_CACHE] + extra)
+    stdscr.addstr(5, 0, result.report()[:w - 1])
+    stdscr.refresh()
+    stdscr.getch()
@@ -0,0 +1,159 @@
+# Standard library imports
+import logging
+import threading
+
+from libs import chroot
+from libs import sync_db
+from libs import utils
+
+# Packages whose installation makes pacman's mkinitcpio hook rebuild every initramfs
+INITRAMFS_TRIGGERS = ("linux", "linux-lts", "linux-zen", "linux-hardened", "linux-firmware",
+                      "intel-ucode", "amd-ucode", "mkinitcpio")
+
+
+def triggers_initramfs(package):
+    """Checks if installing a package runs the mkinitcpio pacman hook."""
+    return package in INITRAMFS_TRIGGERS or package.startswith("linux-firmware-")
+
+
+def estimate_hook_runs(batches):
+    """
+    Estimates how many expensive pacman hook runs a sequence of transactions causes.
+
+    Parameters:
+    - batches: List of package lists, one per pacman transaction, in execution order.
+
+    Returns:
+    - Dictionary with the number of mkinitcpio runs and snap-pac snapshots.
+    """
+    mkinitcpio_runs = 0
+    snapshots = 0
+    snap_pac_installed = False
+    for batch in batches:
+        if any(triggers_initramfs(package) for package in batch):
+            mkinitcpio_runs += 1
+        # snap-pac only fires for transactions that start after it is installed
+        if snap_pac_installed:
+            snapshots += 2
+        if "snap-pac" in batch:
+            snap_pac_installed = True
+    return {"mkinitcpio": mkinitcpio_runs, "snapshots": snapshots}
+
+
+class PackageTransaction:
+    """Collects the packages every installer step needs and installs them in one transaction."""
+    def __init__(self, root="/mnt"):
+        """
+        Parameters:
+        - root: Mount point of the target system used when the transaction bootstraps it with pacstrap.
+        """
+        self.root = root
+        self.packages = []
+        self.requests = []
+        self.committed_requests = []
+        self.committed_batches = []
+        self.before_commit = []  # Callables run before every transaction, e.g. to mask pacman hooks
+        self.after_commit = []   # Callables run after every transaction, even a failed one
+        self.lock = threading.Lock()
+
+    def add(self, packages, step=None):
+        """
+        Queues packages for the next commit.
+
+        Parameters:
+        - packages: Iterable of package names (or a space-separated string).
+        - step: Name of the installer step asking for them, used in reports.
+        """
+        if isinstance(packages, str):
+            packages = packages.split()
+        packages = [package for package in packages if package]
+        if not packages:
+            return
+        with self.lock:
+            self.requests.append((step, packages))
+            for package in packages:
+                if package not in self.packages:
+                    self.packages.append(package)
+        logging.info(f"Queued packages for {step or 'install'}: {' '.join(packages)}")
+
+    def discard(self, step):
+        """Drops the pending request of a step, e.g. before the step queues a different choice."""
+        with self.lock:
+            self.requests = [request for request in self.requests if request[0] != step]
+            wanted = {package for _, packages in self.requests for package in packages}
+            self.packages = [package for package in self.packages if package in wanted]
+
+    def pending(self):
+        """Returns the packages queued since the last commit."""
+        with self.lock:
+            return list(self.packages)
+
+    def command(self, packages):
+        """Builds the single install command for a set of packages; it always installs into the target."""
+        return f"pacstrap {self.root} " + " ".join(packages)
+
+    def commit(self):
+        """
+        Installs every queued package in one transaction in the target.
+
+        The first transaction bootstraps the target with pacstrap. Once a chroot session
+        runs, pacman inside the target installs the rest so the target's own repositories
+        and pacman.conf apply. The live installer environment is never changed.
+
+        Returns:
+        - The command result, or None when nothing was queued.
+        """
+        with self.lock:
+            packages = list(self.packages)
+            requests = list(self.requests)
+            self.packages.clear()
+            self.requests.clear()
+        if not packages:
+            return None
+
+        for callback in list(self.before_commit):
+            callback()
+        logging.info(f"Installing {len(packages)} packages: {sync_db.index.estimate(packages).summary()}")
+        try:
+            if chroot.active_session() is not None and "base" not in packages:
+                result = chroot.run_in_target("pacman -S --needed --noconfirm " + " ".join(packages))
+            else:
+                result = utils.run_command(self.command(packages))
+        finally:
+            for callback in list(self.after_commit):
+                callback()
+        with self.lock:
+            self.committed_requests.extend(requests)
+            self.committed_batches.append(packages)
+        return result
+
+    def savings(self):
+        """
+        Compares the committed transactions with one transaction per step request.
+
+        Returns:
+        - Dictionary with the transactions and hook runs avoided.
+        """
+        with self.lock:
+            per_request = [packages for _, packages in self.committed_requests]
+            batches = list(self.committed_batches)
+        would_run = estimate_hook_runs(per_request)
+        did_run = estimate_hook_runs(batches)
+        return {
+            "requests": len(per_request),
+            "transactions": len(batches),
+            "transactions_saved": len(per_request) - len(batches),
+            "mkinitcpio_saved": would_run["mkinitcpio"] - did_run["mkinitcpio"],
+            "snapshots_saved": would_run["snapshots"] - did_run["snapshots"],
+        }
+
+    def report(self):
+        """Returns a one-line summary of what merging the transactions saved."""
+        stats = self.savings()
+        return (f"{stats['requests']} package requests installed in {stats['transactions']} transaction(s): "
+                f"saved {stats['transactions_saved']} transactions, {stats['mkinitcpio_saved']} initramfs rebuilds "
+                f"and {stats['snapshots_saved']} snapper snapshots")
+
+
+# Shared accumulator used by every installer step
+transaction = PackageTransaction()
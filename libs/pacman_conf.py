@@ -0,0 +1,253 @@
+# Standard library imports
+import contextlib
+import difflib
+import logging
+import os
+import re
+import tempfile
+
+PACMAN_CONF = "/etc/pacman.conf"
+
+_HEADER = re.compile(r"^\s*(#?)\s*\[([^\]]+)\]\s*$")
+_DIRECTIVE = re.compile(r"^(\s*)(#?)\s*([A-Za-z][A-Za-z0-9]*)\s*(?:=\s*(.*?))?\s*$")
+_REPO_DIRECTIVES = ("Include", "Server", "SigLevel", "Usage", "CacheServer")
+
+
+def atomic_write(path, text):
+    """Replaces a file in one step: temporary file, fsync, rename, directory fsync."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class Section:
+    """One [name] block: its header line and every raw line up to the next header."""
+    def __init__(self, name, enabled=True, header=None, lines=None):
+        self.name = name
+        self.enabled = enabled
+        self.header = header if header is not None else f"[{name}]\n"
+        self.lines = lines if lines is not None else []
+
+    def directives(self, include_commented=False):
+        """Yields (index, key, value, commented) for every option line of the section."""
+        for idx, line in enumerate(self.lines):
+            match = _DIRECTIVE.match(line)
+            if not match or not line.strip():
+                continue
+            commented = match.group(2) == "#"
+            if commented and not include_commented:
+                continue
+            yield idx, match.group(3), match.group(4), commented
+
+    def get(self, key):
+        """Returns the value of an active directive, "" for a bare flag, or None."""
+        for _, name, value, _ in self.directives():
+            if name == key:
+                return value if value is not None else ""
+        return None
+
+    def render(self):
+        return self.header + "".join(self.lines)
+
+
+class PacmanConf:
+    """
+    Order-preserving model of a pacman.conf.
+
+    Lines that are not touched by an edit are kept byte for byte, including
+    comments and commented-out repositories, so rendering an unmodified model
+    reproduces the file exactly.
+    """
+    def __init__(self, text=""):
+        self.original = text
+        self.preamble = []
+        self.sections = []
+        current = None
+        for line in text.splitlines(keepends=True):
+            header = _HEADER.match(line)
+            if header:
+                current = Section(header.group(2).strip(), header.group(1) != "#", line)
+                self.sections.append(current)
+            elif current is None:
+                self.preamble.append(line)
+            else:
+                current.lines.append(line)
+
+    @classmethod
+    def load(cls, path=PACMAN_CONF):
+        with open(path, "r") as f:
+            return cls(f.read())
+
+    def render(self):
+        return "".join(self.preamble) + "".join(section.render() for section in self.sections)
+
+    @property
+    def changed(self):
+        return self.render() != self.original
+
+    def diff(self, path=PACMAN_CONF):
+        """Returns a unified diff between the loaded file and the edited model."""
+        return "".join(difflib.unified_diff(self.original.splitlines(keepends=True),
+                                            self.render().splitlines(keepends=True),
+                                            fromfile=path, tofile=path + " (new)"))
+
+    def section(self, name, enabled_only=False):
+        for section in self.sections:
+            if section.name == name and (section.enabled or not enabled_only):
+                return section
+        return None
+
+    def repos(self):
+        """Returns the enabled repository names in priority order."""
+        return [section.name for section in self.sections if section.enabled and section.name != "options"]
+
+    def set_option(self, key, value=None, section_name="options"):
+        """
+        Sets a directive, reusing its active or commented-out line when there is one.
+
+        Parameters:
+        - key: Directive name, e.g. "ParallelDownloads".
+        - value: Directive value, or None for a bare flag such as "Color".
+        - section_name: Section holding the directive.
+        """
+        section = self.section(section_name, enabled_only=True)
+        if section is None:
+            section = Section(section_name)
+            self.sections.insert(0, section)
+        new_line = f"{key} = {value}\n" if value is not None else f"{key}\n"
+
+        directives = list(section.directives(include_commented=True))
+        for idx, name, _, commented in directives:
+            if name == key and not commented:
+                section.lines[idx] = new_line
+                return
+        for idx, name, _, commented in directives:
+            if name == key:
+                section.lines[idx] = new_line
+                return
+        active = [idx for idx, _, _, commented in directives if not commented]
+        section.lines.insert(active[-1] + 1 if active else 0, new_line)
+
+    def enable_repo(self, name):
+        """
+        Uncomments a disabled repository such as #[multilib] together with its directives.
+
+        Returns:
+        - True if the repository is enabled afterwards (it may have been already).
+        """
+        if self.section(name, enabled_only=True) is not None:
+            return True
+        section = self.section(name)
+        if section is None:
+            return False
+        section.enabled = True
+        section.header = section.header.replace("#", "", 1).lstrip()
+        for idx, key, _, commented in list(section.directives(include_commented=True)):
+            if commented and key in _REPO_DIRECTIVES:
+                section.lines[idx] = section.lines[idx].replace("#", "", 1).lstrip()
+        return True
+
+    def add_repo(self, name, include=None, servers=(), sig_level=None, before=None):
+        """
+        Adds a repository, or updates it in place if it already exists.
+
+        Parameters:
+        - name: Repository name.
+        - include: Mirrorlist file for an Include line.
+        - servers: Server URLs.
+        - sig_level: Optional SigLevel.
+        - before: Insert the new section before this repository (higher priority); appended otherwise.
+        """
+        directives = []
+        if sig_level:
+            directives.append(("SigLevel", sig_level))
+        if include:
+            directives.append(("Include", include))
+        directives.extend(("Server", server) for server in servers)
+
+        section = self.section(name, enabled_only=True) or self.section(name)
+        if section is not None:
+            self.enable_repo(name)
+            current = [(key, value) for _, key, value, _ in section.directives() if key in _REPO_DIRECTIVES]
+            if current == directives:
+                return
+            # Replace the repository directives, keeping comments and other lines
+            replaced = {idx for idx, key, _, _ in section.directives() if key in _REPO_DIRECTIVES}
+            position = min(replaced) if replaced else 0
+            lines = [line for idx, line in enumerate(section.lines) if idx not in replaced]
+            lines[position:position] = [f"{key} = {value}\n" for key, value in directives]
+            section.lines = lines
+            return
+
+        section = Section(name, lines=[f"{key} = {value}\n" for key, value in directives])
+        target = self.section(before, enabled_only=True) if before else None
+        if target is not None:
+            section.lines.append("\n")
+            self.sections.insert(self.sections.index(target), section)
+            return
+        previous = self.sections[-1].lines if self.sections else self.preamble
+        if previous and not previous[-1].endswith("\n"):
+            previous[-1] += "\n"
+        if previous and previous[-1].strip():
+            previous.append("\n")
+        self.sections.append(section)
+
+    def prepend_include(self, path):
+        """
+        Makes an Include line the first server source of every enabled repository, so its
+        servers are tried before the others. Repositories that already include it are left alone.
+        """
+        line = f"Include = {path}\n"
+        for section in self.sections:
+            if not section.enabled or section.name == "options":
+                continue
+            directives = [(idx, key, value) for idx, key, value, _ in section.directives() if key in _REPO_DIRECTIVES]
+            if any(key == "Include" and value == path for _, key, value in directives):
+                continue
+            servers = [idx for idx, key, _ in directives if key in ("Include", "Server")]
+            section.lines.insert(servers[0] if servers else len(section.lines), line)
+
+    def remove_repo(self, name):
+        self.sections = [section for section in self.sections if section.name != name or not section.enabled]
+
+    def write(self, path=PACMAN_CONF):
+        """Writes the model atomically."""
+        atomic_write(path, self.render())
+        self.original = self.render()
+
+
+@contextlib.contextmanager
+def edit(path=PACMAN_CONF, preview=None):
+    """
+    Loads a pacman.conf for editing and writes it once when the block ends.
+
+    Nothing is written if the edits left the file unchanged, so repeated runs are
+    harmless. The diff is logged, and handed to preview(diff) when given.
+    """
+    conf = PacmanConf.load(path)
+    yield conf
+    if not conf.changed:
+        return
+    diff = conf.diff(path)
+    logging.info(f"Updating {path}:\n{diff}")
+    if preview is not None:
+        preview(diff)
+    conf.write(path)
@@ -0,0 +1,251 @@
+# Standard library imports
+import curses
+import glob
+import logging
+import os
+
+from libs import hardware
+from libs.boot_options import boot_options
+from libs.chroot import run_in_target, target_session, write_target_file
+from libs.packages import transaction
+
+PROFILES = ("latency", "balanced", "efficiency")
+POWER_TMPFILES = "/etc/tmpfiles.d/cpu-power.conf"
+TUNED_PROFILE = "latency-performance"
+STEP = "CPU power profile"
+
+# Drivers whose performance/powersave governors only bound the hardware, which picks frequencies from the EPP
+EPP_DRIVERS = ("amd-pstate-epp", "intel_pstate")
+
+# Governor and energy-performance preference per profile, in order of preference
+PROFILE_GOVERNORS = {
+    "latency": ("performance",),
+    "balanced": ("schedutil", "ondemand", "powersave"),
+    "efficiency": ("powersave", "schedutil", "conservative"),
+}
+PROFILE_EPP = {
+    "latency": "performance",
+    "balanced": "balance_performance",
+    "efficiency": "power",
+}
+# On EPP drivers "powersave" is the normal governor; "performance" pins the EPP to performance
+EPP_DRIVER_GOVERNORS = {"latency": "performance", "balanced": "powersave", "efficiency": "powersave"}
+
+
+class CpuFreqInfo:
+    """CPU scaling state read from sysfs."""
+    def __init__(self, cpu_vendor="", cpu_model="", driver="", governors=(), governor="",
+                 epp="", epp_choices=(), pstate_status=""):
+        self.cpu_vendor = cpu_vendor
+        self.cpu_model = cpu_model
+        self.driver = driver
+        self.governors = list(governors)
+        self.governor = governor
+        self.epp = epp
+        self.epp_choices = list(epp_choices)
+        self.pstate_status = pstate_status  # "active", "passive" or "guided" for amd/intel_pstate
+
+    @property
+    def has_epp(self):
+        return self.driver in EPP_DRIVERS and bool(self.epp_choices)
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def read_cpufreq(root="/", machine=None):
+    """
+    Reads the cpufreq driver, governors and EPP of the first CPU policy.
+
+    Parameters:
+    - root: Directory holding sys/; a fake sysfs tree can be used in tests.
+    - machine: HardwareProfile for the CPU vendor and model (defaults to this machine).
+
+    Returns:
+    - CpuFreqInfo.
+    """
+    machine = machine or hardware.profile()
+    cpu_dir = os.path.join(root, "sys", "devices", "system", "cpu")
+    policies = sorted(glob.glob(os.path.join(cpu_dir, "cpufreq", "policy*")))
+    policy = policies[0] if policies else os.path.join(cpu_dir, "cpu0", "cpufreq")
+
+    pstate_status = ""
+    for pstate in ("amd_pstate", "intel_pstate"):
+        pstate_status = pstate_status or _read(os.path.join(cpu_dir, pstate, "status"))
+
+    return CpuFreqInfo(
+        cpu_vendor=machine.cpu_vendor,
+        cpu_model=machine.cpu_model,
+        driver=_read(os.path.join(policy, "scaling_driver")),
+        governors=_read(os.path.join(policy, "scaling_available_governors")).split(),
+        governor=_read(os.path.join(policy, "scaling_governor")),
+        epp=_read(os.path.join(policy, "energy_performance_preference")),
+        epp_choices=_read(os.path.join(policy, "energy_performance_available_preferences")).split(),
+        pstate_status=pstate_status,
+    )
+
+
+class PowerPlan:
+    """Kernel parameters, sysfs settings and daemon chosen for a power profile."""
+    def __init__(self, profile):
+        self.profile = profile
+        self.kernel_params = []
+        self.governor = None
+        self.epp = None
+        self.daemon = None
+        self.packages = []
+        self.services = []
+
+    def tmpfiles(self):
+        """Returns the systemd-tmpfiles rules that set the governor and EPP at every boot."""
+        lines = []
+        if self.governor:
+            lines.append(f"w /sys/devices/system/cpu/cpu*/cpufreq/scaling_governor - - - - {self.governor}")
+        if self.epp:
+            # Written after the governor: under "performance" intel_pstate only accepts EPP "performance"
+            lines.append(f"w /sys/devices/system/cpu/cpu*/cpufreq/energy_performance_preference - - - - {self.epp}")
+        return "".join(line + "\n" for line in lines)
+
+    def report(self):
+        parts = [f"{self.profile} profile"]
+        if self.kernel_params:
+            parts.append(f"kernel parameters: {' '.join(self.kernel_params)}")
+        if self.governor:
+            parts.append(f"governor {self.governor}")
+        if self.epp:
+            parts.append(f"EPP {self.epp}")
+        parts.append(f"daemon: {self.daemon or 'none'}")
+        return ", ".join(parts)
+
+
+def plan_power(info, profile="balanced"):
+    """
+    Chooses the scaling driver mode, governor, EPP and daemon for a profile.
+
+    Parameters:
+    - info: CpuFreqInfo of the machine.
+    - profile: "latency", "balanced" or "efficiency".
+
+    Returns:
+    - PowerPlan.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown power profile: {profile}")
+    plan = PowerPlan(profile)
+
+    # amd_pstate needs CPPC, which the kernel checks itself; without it acpi-cpufreq stays in use
+    if "AMD" in info.cpu_vendor and info.pstate_status != "active":
+        plan.kernel_params.append("amd_pstate=active")
+    elif "Intel" in info.cpu_vendor and info.pstate_status == "passive":
+        plan.kernel_params.append("intel_pstate=active")  # Passive mode was forced, e.g. by the firmware
+    epp_driver = info.has_epp or bool(plan.kernel_params)
+
+    if profile == "balanced":
+        # power-profiles-daemon owns the governor and EPP and switches them at runtime
+        plan.daemon = "power-profiles-daemon"
+        plan.packages.append("power-profiles-daemon")
+        plan.services.append("power-profiles-daemon.service")
+        return plan
+
+    if epp_driver:
+        plan.governor = EPP_DRIVER_GOVERNORS[profile]
+        if not info.epp_choices or PROFILE_EPP[profile] in info.epp_choices:
+            plan.epp = PROFILE_EPP[profile]
+    else:
+        available = info.governors or list(PROFILE_GOVERNORS[profile])
+        plan.governor = next((governor for governor in PROFILE_GOVERNORS[profile] if governor in available), None)
+
+    if profile == "latency":
+        # tuned also holds a low CPU DMA latency (PM QoS), which sysfs settings cannot do
+        plan.daemon = "tuned"
+        plan.packages.append("tuned")
+        plan.services.append("tuned.service")
+    return plan
+
+
+# Plan queued by queue_power_profile() and configured once the target exists
+selected_plan = None
+
+
+def queue_power_profile(profile=None, info=None):
+    """
+    Plans a power profile, queues its packages and registers its kernel parameters.
+
+    Without a profile the one chosen earlier (e.g. in the menu) is planned again,
+    defaulting to balanced. A new choice replaces the packages and kernel parameters
+    queued for the previous one.
+    """
+    global selected_plan
+    if profile is None:
+        profile = selected_plan.profile if selected_plan else "balanced"
+    info = info or read_cpufreq()
+    plan = plan_power(info, profile)
+    if selected_plan is not None:
+        transaction.discard(STEP)
+        if selected_plan.kernel_params:
+            boot_options.remove_params(selected_plan.kernel_params, STEP)
+    transaction.add(plan.packages, STEP)
+    if plan.kernel_params:
+        boot_options.add_params(plan.kernel_params, STEP)
+    logging.info(f"CPU power ({info.driver or 'no cpufreq driver'}, {info.cpu_model}): {plan.report()}")
+    selected_plan = plan
+    return plan
+
+
+def configure_power_profile(plan=None):
+    """Writes the tmpfiles rule and enables the daemon of the queued plan in the target."""
+    plan = plan or selected_plan
+    if plan is None:
+        return None
+    # From the menu there is no session yet; the live system must not be changed
+    with target_session():
+        rules = plan.tmpfiles()
+        if rules:
+            write_target_file(POWER_TMPFILES, rules)
+        for service in plan.services:
+            run_in_target(f"systemctl enable {service}")
+        if plan.daemon == "tuned":
+            # tuned-adm needs the running daemon; tuned reads this file when it starts instead
+            write_target_file("/etc/tuned/active_profile", TUNED_PROFILE + "\n")
+    return plan
+
+
+def power_profile_menu(stdscr):
+    """Menu entry that queues a CPU power profile for the target."""
+    current_row = PROFILES.index("balanced")
+    stdscr.timeout(-1)
+    while True:
+        stdscr.clear()
+        h, w = stdscr.getmaxyx()
+        title = "CPU Power Profile"
+        stdscr.addstr(1, (w - len(title)) // 2, title)
+        for idx, profile in enumerate(PROFILES):
+            if idx == current_row:
+                stdscr.attron(curses.A_REVERSE)
+                stdscr.addstr(h // 4 + idx, w // 4, profile)
+                stdscr.attroff(curses.A_REVERSE)
+            else:
+                stdscr.addstr(h // 4 + idx, w // 4, profile)
+        key = stdscr.getch()
+        if key == curses.KEY_UP and current_row > 0:
+            current_row -= 1
+        elif key == curses.KEY_DOWN and current_row < len(PROFILES) - 1:
+            current_row += 1
+        elif key == curses.KEY_ENTER or key in [10, 13]:
+            break
+        elif key == 27:  # Escape
+            stdscr.timeout(100)
+            return
+
+    # Only queued: the daemon is enabled by "Install queued packages" once the target transaction ran
+    plan = queue_power_profile(PROFILES[current_row])
+    stdscr.addstr(h - 3, 0, plan.report()[:w - 1])
+    stdscr.addstr(h - 2, 0, "Queued; applied by Install queued packages."[:w - 1])
+    stdscr.refresh()
+    stdscr.getch()
+    stdscr.timeout(100)
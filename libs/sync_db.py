@@ -0,0 +1,254 @@
+# Standard library imports
+import glob
+import json
+import logging
+import os
+import re
+import tarfile
+import threading
+
+from libs import download_tuner
+from libs import mirrors
+from libs.cache_dir import CACHE_ROOT, private_dir
+from libs.pacman_conf import PACMAN_CONF, PacmanConf
+
+SYNC_DB_DIR = "/var/lib/pacman/sync"
+INDEX_CACHE_DIR = os.path.join(CACHE_ROOT, "syncdb")
+INDEX_FORMAT = 2  # Bumped whenever the cached index layout changes
+
+# Fields kept from each package's desc entry
+_FIELDS = {
+    "%NAME%": "name",
+    "%VERSION%": "version",
+    "%FILENAME%": "filename",
+    "%CSIZE%": "csize",
+    "%ISIZE%": "isize",
+    "%SHA256SUM%": "sha256",
+    "%DEPENDS%": "depends",
+    "%PROVIDES%": "provides",
+    "%GROUPS%": "groups",
+}
+_LIST_FIELDS = ("depends", "provides", "groups")
+_VERSION_CONSTRAINT = re.compile(r"[<>=].*$")
+
+
+def strip_version(dependency):
+    """Turns a dependency such as 'glibc>=2.38' or 'sh: for scripts' into the bare name."""
+    return _VERSION_CONSTRAINT.sub("", dependency.split(":", 1)[0]).strip()
+
+
+def parse_desc(text):
+    """Parses one desc entry of a sync database into a dictionary."""
+    entry = {}
+    for block in text.split("\n\n"):
+        lines = block.strip().split("\n")
+        key = _FIELDS.get(lines[0])
+        if key is None or len(lines) < 2:
+            continue
+        if key in _LIST_FIELDS:
+            entry[key] = lines[1:]
+        elif key in ("csize", "isize"):
+            entry[key] = int(lines[1])
+        else:
+            entry[key] = lines[1]
+    return entry
+
+
+def parse_database(path):
+    """Reads every package entry of a .db file."""
+    packages = {}
+    with tarfile.open(path) as db:
+        for member in db:
+            if member.name.endswith("/desc"):
+                entry = parse_desc(db.extractfile(member).read().decode("utf-8", "replace"))
+                if "name" in entry:
+                    packages[entry["name"]] = entry
+    return packages
+
+
+def configured_repos(pacman_conf=PACMAN_CONF):
+    """Returns the repository names enabled in pacman.conf, in priority order."""
+    try:
+        return PacmanConf.load(pacman_conf).repos()
+    except OSError:
+        return []
+
+
+class Estimate:
+    """Download and installed size of a package selection including all dependencies."""
+    def __init__(self, packages, download_size, installed_size, missing, throughput=None):
+        self.packages = packages
+        self.download_size = download_size
+        self.installed_size = installed_size
+        self.missing = missing
+        self.throughput = throughput  # Bytes per second measured against the mirrors
+
+    @property
+    def seconds(self):
+        if not self.throughput:
+            return None
+        return self.download_size / self.throughput
+
+    def summary(self):
+        text = (f"{len(self.packages)} pkgs, download {format_size(self.download_size)}, "
+                f"installed {format_size(self.installed_size)}")
+        if self.seconds is not None:
+            text += f", ~{format_duration(self.seconds)}"
+        if self.missing:
+            text += f", {len(self.missing)} unknown"
+        return text
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    return f"{int(seconds // 60)}m{int(seconds % 60):02d}s"
+
+
+def measured_throughput():
+    """Returns the best measured download rate in bytes per second, without touching the network."""
+    tuning = download_tuner.load_tuning()
+    if tuning and tuning.aggregate:
+        return tuning.aggregate
+    return mirrors.cached_best_throughput()
+
+
+class SyncIndex:
+    """Lazily loaded, disk-cached index over all sync databases."""
+    def __init__(self, sync_dir=SYNC_DB_DIR, cache_dir=INDEX_CACHE_DIR, pacman_conf=PACMAN_CONF):
+        self.sync_dir = sync_dir
+        self.cache_dir = cache_dir
+        self.pacman_conf = pacman_conf
+        self._packages = None
+        self._providers = None
+        self._groups = None
+        self._closures = {}
+        # Steps on the install plan's pool threads look packages up at the same time
+        self._lock = threading.Lock()
+
+    def _private_cache_dir(self):
+        # The cached checksums decide which packages are trusted
+        return private_dir(self.cache_dir)
+
+    def _load_repo(self, db_path):
+        """Loads one repository, reusing the cached parse while the .db file is unchanged."""
+        info = os.stat(db_path)
+        key = [INDEX_FORMAT, info.st_mtime_ns, info.st_size]
+        if not self._private_cache_dir():
+            return parse_database(db_path)
+        cache_path = os.path.join(self.cache_dir, os.path.basename(db_path) + ".json")
+        try:
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+            if cached["key"] == key:
+                return cached["packages"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        packages = parse_database(db_path)
+        try:
+            with open(cache_path + ".tmp", "w") as f:
+                json.dump({"key": key, "packages": packages}, f)
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as e:
+            logging.error(f"Error caching sync database index: {str(e)}")
+        return packages
+
+    def _load(self):
+        if self._packages is not None:
+            return
+        with self._lock:
+            if self._packages is None:
+                self._load_locked()
+
+    def _load_locked(self):
+        db_paths = {os.path.basename(path)[:-3]: path for path in glob.glob(os.path.join(self.sync_dir, "*.db"))}
+        order = [repo for repo in configured_repos(self.pacman_conf) if repo in db_paths]
+        order += sorted(repo for repo in db_paths if repo not in order)
+
+        packages, providers, groups = {}, {}, {}
+        for repo in order:
+            try:
+                repo_packages = self._load_repo(db_paths[repo])
+            except (OSError, tarfile.TarError) as e:
+                logging.error(f"Error reading sync database {db_paths[repo]}: {str(e)}")
+                continue
+            for name, entry in repo_packages.items():
+                if name in packages:
+                    continue  # Earlier repositories take precedence, as in pacman
+                packages[name] = entry
+                for provided in entry.get("provides", ()):
+                    providers.setdefault(strip_version(provided), []).append(name)
+                for group in entry.get("groups", ()):
+                    groups.setdefault(group, []).append(name)
+        # _packages goes last: other threads take it being set as the sign that loading finished
+        self._providers, self._groups = providers, groups
+        self._packages = packages
+
+    @property
+    def packages(self):
+        self._load()
+        return self._packages
+
+    def get(self, name):
+        return self.packages.get(name)
+
+    def find(self, name):
+        """Resolves a package, provision or group name to package names."""
+        self._load()
+        if name in self._packages:
+            return [name]
+        if name in self._providers:
+            return self._providers[name][:1]
+        return list(self._groups.get(name, []))
+
+    def closure(self, names):
+        """
+        Resolves the full dependency closure of the given names.
+
+        Returns:
+        - Tuple of (set of package names, list of names that could not be resolved).
+        """
+        key = frozenset(names)
+        if key in self._closures:
+            return self._closures[key]
+        resolved, missing = set(), []
+        queue = list(names)
+        while queue:
+            name = strip_version(queue.pop())
+            if name in resolved:
+                continue
+            found = self.find(name)
+            if not found:
+                missing.append(name)
+                continue
+            for package in found:
+                if package not in resolved:
+                    resolved.add(package)
+                    queue.extend(self._packages[package].get("depends", ()))
+        self._closures[key] = (resolved, missing)
+        return resolved, missing
+
+    def estimate(self, names, throughput=None):
+        """Returns an Estimate for installing the given names with all their dependencies."""
+        resolved, missing = self.closure(names)
+        download = sum(self._packages[name].get("csize", 0) for name in resolved)
+        installed = sum(self._packages[name].get("isize", 0) for name in resolved)
+        return Estimate(sorted(resolved), download, installed, missing,
+                        throughput if throughput is not None else measured_throughput())
+
+    def checksums(self):
+        """Maps package file names to their SHA-256 sums."""
+        return {entry["filename"]: entry["sha256"] for entry in self.packages.values()
+                if "filename" in entry and "sha256" in entry}
+
+
+# Shared index; nothing is read until the first lookup
+index = SyncIndex()
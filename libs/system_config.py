@@ -7,7 +7,13 @@ import curses
 import logging
 from pathlib import Path
 
-from libs.utils import get_wifi_interface, is_strong_password, run_command, scan_wifi
+from libs import pacman_conf
+from libs import hardware
+from libs import power_tuner
+from libs.chroot import active_session, run_in_target, target_path, write_target_file
+from libs.packages import transaction
+from libs.sync_db import index
+from libs.utils import get_wifi_interface, is_inside_chroot, is_strong_password, probes, run_command, scan_wifi
 
 
 def kernel_selector(stdscr):
@@ -48,17 +54,17 @@ def kernel_selector(stdscr):
             current_row += 1
         elif key == curses.KEY_ENTER or key in [10, 13]:  # Enter key
             if current_row == 0:
-                run_command("pacman -S linux linux-headers")
-                stdscr.addstr(h - 2, (w - len("Standard Arch Kernel installed.")) // 2, "Standard Arch Kernel installed.")
+                transaction.add(["linux", "linux-headers"], "Kernel Selector")
+                stdscr.addstr(h - 2, (w - len("Standard Arch Kernel queued.")) // 2, "Standard Arch Kernel queued.")
             elif current_row == 1:
-                run_command("pacman -S linux-lts linux-lts-headers")
-                stdscr.addstr(h - 2, (w - len("Long Term Support Kernel installed.")) // 2, "Long Term Support Kernel installed.")
+                transaction.add(["linux-lts", "linux-lts-headers"], "Kernel Selector")
+                stdscr.addstr(h - 2, (w - len("Long Term Support Kernel queued.")) // 2, "Long Term Support Kernel queued.")
             elif current_row == 2:
-                run_command("pacman -S linux-zen linux-zen-headers")
-                stdscr.addstr(h - 2, (w - len("Zen Kernel installed.")) // 2, "Zen Kernel installed.")
+                transaction.add(["linux-zen", "linux-zen-headers"], "Kernel Selector")
+                stdscr.addstr(h - 2, (w - len("Zen Kernel queued.")) // 2, "Zen Kernel queued.")
             elif current_row == 3:
-                run_command("pacman -S linux-hardened linux-hardened-headers")
-                stdscr.addstr(h - 2, (w - len("Hardened Kernel installed.")) // 2, "Hardened Kernel installed.")
+                transaction.add(["linux-hardened", "linux-hardened-headers"], "Kernel Selector")
+                stdscr.addstr(h - 2, (w - len("Hardened Kernel queued.")) // 2, "Hardened Kernel queued.")
             elif current_row == 4:
                 return
             stdscr.refresh()
@@ -71,7 +77,7 @@ def create_user():
         username = input("Enter the desired username: ")
 
         # Check if the username already exists
-        result = run_command(f"id {username}")
+        result = run_in_target(f"id {username}")
         if result.returncode == 0:
             print(f"The username {username} already exists. Please choose a different username.")
             continue
@@ -91,8 +97,8 @@ def create_user():
                 continue
 
             # Create the user and set the password
-            run_command(f"useradd -m {username}")
-            result = run_command(f'echo "{username}:{password}" | chpasswd')
+            run_in_target(f"useradd -m {username}")
+            result = run_in_target("chpasswd", check=False, input=f"{username}:{password}\n")
             if result.returncode == 0:
                 print(f"User {username} created successfully!")
                 break
@@ -113,12 +119,12 @@ def set_hostname():
             continue
 
         # Set the hostname
-        result = run_command(f'echo "{hostname}" > /etc/hostname')
-        if result.returncode == 0:
+        try:
+            write_target_file("/etc/hostname", f"{hostname}\n")
             print(f"Hostname set to {hostname} successfully!")
             break
-        else:
-            print(f"Error setting hostname to {hostname}. Please try again.")
+        except Exception as e:
+            print(f"Error setting hostname to {hostname}: {str(e)}. Please try again.")
             continue
 
 def is_valid_hostname(hostname):
@@ -145,7 +151,7 @@ def set_root_password():
             continue
 
         # Set the root password
-        result = run_command(f'echo "root:{password}" | chpasswd')
+        result = run_in_target("chpasswd", check=False, input=f"root:{password}\n")
         if result.returncode == 0:
             print("Root password set successfully!")
             break
@@ -155,19 +161,26 @@ def set_root_password():
 
 def install_microcode():
     # Detect the CPU vendor
-    cpu_vendor = run_command("grep -m 1 'vendor_id' /proc/cpuinfo").stdout
+    cpu_vendor = hardware.profile().cpu_vendor
 
     if "Intel" in cpu_vendor:
-        print("Intel CPU detected. Installing intel-ucode...")
-        run_command("pacman -S intel-ucode")
+        print("Intel CPU detected. Queueing intel-ucode...")
+        transaction.add(["intel-ucode"], "Microcode")
     elif "AMD" in cpu_vendor:
-        print("AMD CPU detected. Installing amd-ucode...")
-        run_command("pacman -S amd-ucode")
+        print("AMD CPU detected. Queueing amd-ucode...")
+        transaction.add(["amd-ucode"], "Microcode")
     else:
         print("Unknown CPU vendor. Skipping microcode installation.")
 
 
+KDE_PLASMA_PACKAGES = ["plasma-meta", "plasma-wayland-session", "kde-utilities", "kde-system", "dolphin-plugins",
+                       "sddm", "sddm-kcm", "kde-graphics", "ksysguard"]
+GNOME_PACKAGES = ["gnome", "gnome-extra", "gdm"]
+
+
 def install_desktop_environment(stdscr):
+    # Download/installed size of each choice, including dependencies
+    estimates = [index.estimate(KDE_PLASMA_PACKAGES).summary(), index.estimate(GNOME_PACKAGES).summary(), ""]
     environments = [
         "Install KDE Plasma",
         "Install GNOME",
@@ -193,6 +206,8 @@ def install_desktop_environment(stdscr):
                 stdscr.attroff(curses.A_REVERSE)
             else:
                 stdscr.addstr(y, x, item)
+            if estimates[idx]:
+                stdscr.addstr(y, x + len(item) + 2, f"({estimates[idx]})"[:max(0, w - x - len(item) - 3)])
 
         key = stdscr.getch()
 
@@ -213,10 +228,10 @@ def install_desktop_environment(stdscr):
         stdscr.refresh()
 
 def install_kde_plasma():
-    run_command("pacman -S plasma-meta plasma-wayland-session kde-utilities kde-system dolphin-plugins sddm sddm-kcm kde-graphics ksysguard")
+    transaction.add(KDE_PLASMA_PACKAGES, "KDE Plasma")
 
 def install_gnome():
-    run_command("pacman -S gnome gnome-extra gdm")
+    transaction.add(GNOME_PACKAGES, "GNOME")
 
 def install_xorg_option(stdscr):
     h, w = stdscr.getmaxyx()
@@ -226,56 +241,79 @@ def install_xorg_option(stdscr):
     stdscr.refresh()
     choice = stdscr.getch()
     if choice == ord('y'):
-        run_command("pacman -S xorg-server xorg-apps")
+        transaction.add(["xorg-server", "xorg-apps"], "Xorg")
 
 
 def setup_chaotic_aur():
     print("Setting up Chaotic-AUR inside chroot environment...")
-    if not is_inside_chroot():
+    if not is_inside_chroot() and active_session() is None:
         print("You are not inside the chroot environment. Please chroot into the system first.")
         return
-    run_command(
+    run_in_target(
         "pacman-key --recv-key 3056513887B78AEB --keyserver keyserver.ubuntu.com")
-    run_command("pacman-key --lsign-key 3056513887B78AEB")
-    run_command("pacman -U 'https://cdn-mirror.chaotic.cx/chaotic-aur/chaotic-keyring.pkg.tar.zst' 'https://cdn-mirror.chaotic.cx/chaotic-aur/chaotic-mirrorlist.pkg.tar.zst'")
-    run_command(
-        'echo -e "\n[chaotic-aur]\nInclude = /etc/pacman.d/chaotic-mirrorlist" >> /etc/pacman.conf')
+    run_in_target("pacman-key --lsign-key 3056513887B78AEB")
+    run_in_target("pacman -U --noconfirm 'https://cdn-mirror.chaotic.cx/chaotic-aur/chaotic-keyring.pkg.tar.zst' 'https://cdn-mirror.chaotic.cx/chaotic-aur/chaotic-mirrorlist.pkg.tar.zst'")
+    with pacman_conf.edit(target_path(pacman_conf.PACMAN_CONF)) as conf:
+        conf.add_repo("chaotic-aur", include="/etc/pacman.d/chaotic-mirrorlist")
     print("Chaotic-AUR setup complete!")
 
 
+# Optimized CachyOS repositories by the x86-64 level they are built for, as (name, mirrorlist)
+CACHYOS_OPTIMIZED_REPOS = {
+    4: [("cachyos-v4", "/etc/pacman.d/cachyos-v4-mirrorlist"),
+        ("cachyos-core-v4", "/etc/pacman.d/cachyos-v4-mirrorlist"),
+        ("cachyos-extra-v4", "/etc/pacman.d/cachyos-v4-mirrorlist")],
+    3: [("cachyos-v3", "/etc/pacman.d/cachyos-v3-mirrorlist"),
+        ("cachyos-core-v3", "/etc/pacman.d/cachyos-v3-mirrorlist"),
+        ("cachyos-extra-v3", "/etc/pacman.d/cachyos-v3-mirrorlist")],
+}
+
+
+def select_optimized_repos(level, repos=CACHYOS_OPTIMIZED_REPOS):
+    """
+    Picks the fastest optimized repositories a CPU of the given x86-64 level can use.
+
+    Returns:
+    - List of (name, mirrorlist) for the highest supported level; empty below the lowest one.
+    """
+    for repo_level in sorted(repos, reverse=True):
+        if level >= repo_level:
+            return list(repos[repo_level])
+    return []
+
+
 def setup_cachyos_repo():
     print("Setting up CachyOS repository inside chroot environment...")
-    if not is_inside_chroot():
+    if not is_inside_chroot() and active_session() is None:
         print("You are not inside the chroot environment. Please chroot into the system first.")
         return
-    run_command(
+    run_in_target(
         "pacman-key --recv-keys F3B607488DB35A47 --keyserver keyserver.ubuntu.com")
-    run_command("pacman-key --lsign-key F3B607488DB35A47")
-    run_command("pacman -U 'https://mirror.cachyos.org/repo/x86_64/cachyos/cachyos-keyring-3-1-any.pkg.tar.zst' 'https://mirror.cachyos.org/repo/x86_64/cachyos/cachyos-mirrorlist-17-1-any.pkg.tar.zst' 'https://mirror.cachyos.org/repo/x86_64/cachyos/cachyos-v3-mirrorlist-17-1-any.pkg.tar.zst' 'https://mirror.cachyos.org/repo/x86_64/cachyos/cachyos-v4-mirrorlist-5-1-any.pkg.tar.zst' 'https://mirror.cachyos.org/repo/x86_64/cachyos/pacman-6.0.2-13-x86_64.pkg.tar.zst'")
-
-    cpu_compatibility = run_command(
-        "/lib/ld-linux-x86-64.so.2 --help | grep supported | grep x86-64-v4")
-    if "supported, searched" in cpu_compatibility.stdout:
-        run_command(
-            'echo -e "\n[cachyos-v4]\nInclude = /etc/pacman.d/cachyos-v4-mirrorlist" >> /etc/pacman.conf')
-
-    cpu_compatibility_v3 = run_command(
-        "/lib/ld-linux-x86-64.so.2 --help | grep supported | grep x86-64-v3")
-    if "supported, searched" in cpu_compatibility_v3.stdout:
-        run_command(
-            'echo -e "\n[cachyos-v3]\nInclude = /etc/pacman.d/cachyos-v3-mirrorlist" >> /etc/pacman.conf')
-        run_command(
-            'echo -e "\n[cachyos-core-v3]\nInclude = /etc/pacman.d/cachyos-v3-mirrorlist" >> /etc/pacman.conf')
-        run_command(
-            'echo -e "\n[cachyos-extra-v3]\nInclude = /etc/pacman.d/cachyos-v3-mirrorlist" >> /etc/pacman.conf')
-
-    run_command(
-        'echo -e "\n[cachyos]\nInclude = /etc/pacman.d/cachyos-mirrorlist" >> /etc/pacman.conf')
+    run_in_target("pacman-key --lsign-key F3B607488DB35A47")
+    run_in_target("pacman -U --noconfirm 'https://mirror.cachyos.org/repo/x86_64/cachyos/cachyos-keyring-3-1-any.pkg.tar.zst' 'https://mirror.cachyos.org/repo/x86_64/cachyos/cachyos-mirrorlist-17-1-any.pkg.tar.zst' 'https://mirror.cachyos.org/repo/x86_64/cachyos/cachyos-v3-mirrorlist-17-1-any.pkg.tar.zst' 'https://mirror.cachyos.org/repo/x86_64/cachyos/cachyos-v4-mirrorlist-5-1-any.pkg.tar.zst' 'https://mirror.cachyos.org/repo/x86_64/cachyos/pacman-6.0.2-13-x86_64.pkg.tar.zst'")
+
+    level = hardware.profile().isa_level
+    repos = select_optimized_repos(level) + [("cachyos", "/etc/pacman.d/cachyos-mirrorlist")]
+    logging.info(f"CPU supports x86-64-v{level}; enabling {', '.join(name for name, _ in repos)}")
+
+    # All repositories go in with one write; the optimized ones take precedence over [core]
+    with pacman_conf.edit(target_path(pacman_conf.PACMAN_CONF)) as conf:
+        for name, include in repos:
+            conf.add_repo(name, include=include, before="core")
     print("CachyOS repository setup complete!")
 
 
-def install_essential_packages():
-    run_command("pacstrap /mnt base linux linux-firmware")
+def install_essential_packages(stdscr=None):
+    """
+    Queues the base system so it is bootstrapped by the same pacstrap call as every other package.
+
+    Parameters:
+    - stdscr: The curses window object when run from the menu. The menu entry installs
+      right away, so the steps after it (fstab, chroot) find a bootstrapped target.
+    """
+    transaction.add(["base", "linux", "linux-firmware"], "Essential packages")
+    if stdscr is not None:
+        install_queued_packages(stdscr)
 
 
 def install_additional_packages(stdscr):
@@ -292,6 +330,8 @@ def install_additional_packages(stdscr):
     stdscr.timeout(100)
     curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_WHITE)
     current_row = 0
+    summary_for = None
+    summary = ""
 
     while True:
         stdscr.clear()
@@ -312,6 +352,12 @@ def install_additional_packages(stdscr):
             else:
                 stdscr.addstr(y, x - 3, "[ ]")
 
+        # Size and time of the whole selection, including dependencies
+        if summary_for != selected_packages:
+            summary_for = list(selected_packages)
+            summary = "Selection: " + index.estimate(selected_packages).summary()
+        stdscr.addstr(h - 2, max(0, (w - len(summary)) // 2), summary[:w - 1])
+
         key = stdscr.getch()
 
         if key == curses.KEY_UP and current_row > 0:
@@ -326,16 +372,37 @@ def install_additional_packages(stdscr):
         elif key == ord('q'):  # Press 'q' to quit and install selected packages
             break
 
-    # Install the selected packages
+    # Queue the selected packages
     if selected_packages:
-        cmd = "pacman -S " + " ".join(selected_packages)
-        run_command(cmd)
+        transaction.add(selected_packages, "Additional packages")
 
 
 def install_custom_packages():
     packages = input(
         "Enter a space-separated list of additional packages you want to install: ")
-    run_command(f"pacman -S {packages}")
+    transaction.add(packages, "Custom packages")
+
+
+def install_queued_packages(stdscr):
+    """Installs everything queued by the other steps in a single transaction."""
+    h, w = stdscr.getmaxyx()
+    stdscr.clear()
+    queued = transaction.pending()
+    if not queued:
+        stdscr.addstr(h // 2, 0, "No packages queued.")
+        stdscr.refresh()
+        stdscr.getch()
+        return
+    stdscr.addstr(0, 0, f"Installing {len(queued)} packages in one transaction...")
+    stdscr.addstr(1, 0, index.estimate(queued).summary()[:w - 1])
+    stdscr.refresh()
+    transaction.commit()
+    # Settings that need their packages installed, such as the power profile daemon
+    power_tuner.configure_power_profile()
+    report = transaction.report()
+    stdscr.addstr(2, 0, report[:w - 1])
+    stdscr.refresh()
+    stdscr.getch()
 
 
 def configure_pacman_repos():
@@ -345,31 +412,29 @@ def configure_pacman_repos():
     print("3) testing")
     choices = input(
         "Use space to select multiple repositories. Enter your choice (e.g. 1 3): ").split()
-    for choice in choices:
-        if choice == "1":
-            run_command(
-                "sed -i '/\[multilib\]/,/Include/s/^#//' /etc/pacman.conf")
-        elif choice == "2":
-            run_command(
-                "sed -i '/\[multilib-testing\]/,/Include/s/^#//' /etc/pacman.conf")
-        elif choice == "3":
-            run_command(
-                "sed -i '/\[testing\]/,/Include/s/^#//' /etc/pacman.conf")
+    repos = {"1": "multilib", "2": "multilib-testing", "3": "testing"}
+    with pacman_conf.edit(preview=print) as conf:
+        for choice in choices:
+            if choice in repos and not conf.enable_repo(repos[choice]):
+                print(f"Repository {repos[choice]} is not listed in {pacman_conf.PACMAN_CONF}")
 
 
 def set_time_zone():
     # Get the current time zone
-    current_timezone = run_command("timedatectl show --property=Timezone --value").stdout.strip()
+    current_timezone = probes.get("timezone").stdout.strip()
+    if not current_timezone:
+        logging.error("Could not read the live system's time zone; using UTC")
+        current_timezone = "UTC"
     
     # Set the time zone based on the current setting
-    run_command(f"ln -sf /usr/share/zoneinfo/{current_timezone} /etc/localtime")
-    run_command("hwclock --systohc")
+    run_in_target(f"ln -sf /usr/share/zoneinfo/{current_timezone} /etc/localtime")
+    run_in_target("hwclock --systohc")
 
 
 def localization():
-    run_command('echo "en_US.UTF-8 UTF-8" >> /etc/locale.gen')
-    run_command("locale-gen")
-    run_command('echo "LANG=en_US.UTF-8" > /etc/locale.conf')
+    write_target_file("/etc/locale.gen", "en_US.UTF-8 UTF-8\n", append=True)
+    run_in_target("locale-gen")
+    write_target_file("/etc/locale.conf", "LANG=en_US.UTF-8\n")
 
 
 def wifi_menu(stdscr):
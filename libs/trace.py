@@ -0,0 +1,232 @@
+# Standard library imports
+import contextlib
+import json
+import logging
+import os
+import re
+import resource
+import subprocess
+import threading
+import time
+
+TRACE_FILE = "install_trace.json"
+SUMMARY_FILE = "install_trace.txt"
+DEFAULT_TOP_N = 15
+
+# Secrets that may appear in a command line, e.g. "iwctl ... --passphrase X" or "echo 'user:pw' | chpasswd"
+_SECRETS = [
+    (re.compile(r"(--(?:passphrase|password)[= ]+)(\"[^\"]*\"|'[^']*'|\S+)"), r"\1***"),
+    (re.compile(r"(echo\s+(?:-n\s+)?)(\"[^\"]*\"|'[^']*'|\S+)(\s*\|\s*(?:chpasswd|cryptsetup)\b)"), r"\1***\3"),
+]
+
+
+def redact(command):
+    """Masks passwords and passphrases in a command line before it is recorded anywhere."""
+    for pattern, replacement in _SECRETS:
+        command = pattern.sub(replacement, command)
+    return command
+
+
+class Span:
+    """One timed operation: a menu/plan step or an external command."""
+    def __init__(self, span_id, name, kind, parent, thread_id):
+        self.id = span_id
+        self.name = name
+        self.kind = kind  # "step" or "command"
+        self.parent = parent
+        self.thread_id = thread_id
+        self.start = time.monotonic()
+        self.end = None
+        self.cpu_user = 0.0
+        self.cpu_system = 0.0
+        self.max_rss_kib = 0
+        self.output_bytes = 0
+        self.exit_status = None
+        self.usage_reported = False  # Set when the CPU and RSS figures came from the process that waited
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+
+class Tracer:
+    """
+    Records the timing of every installer step and external command.
+
+    Child CPU time and peak RSS come from getrusage(RUSAGE_CHILDREN), which covers
+    all children the process has waited for. Commands running at the same time
+    therefore share their CPU deltas, and the peak RSS is the largest child seen so far.
+    Commands in a chroot session are children of the worker, not of the installer;
+    the worker measures them the same way and reports the figures with the exit code.
+    Probes run on an event loop and are recorded after the fact with wall time only.
+    """
+    def __init__(self):
+        self.epoch = time.monotonic()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self):
+        """Returns the innermost open span of the calling thread, or None."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def step_of(self, span):
+        """Returns the name of the closest step enclosing (or being) the span."""
+        while span is not None and span.kind != "step":
+            span = self.spans[span.parent] if span.parent is not None else None
+        return span.name if span is not None else None
+
+    def current_step(self):
+        return self.step_of(self.current())
+
+    def _new_span(self, name, kind, parent):
+        with self.lock:
+            span = Span(len(self.spans), name, kind, parent.id if parent else None, threading.get_ident())
+            self.spans.append(span)
+        return span
+
+    @contextlib.contextmanager
+    def span(self, name, kind, parent=None):
+        """
+        Times the enclosed block.
+
+        Parameters:
+        - name: Step name or command line.
+        - kind: "step" or "command".
+        - parent: Parent span for work handed to another thread; defaults to the caller's open span.
+        """
+        stack = self._stack()
+        if parent is None and stack:
+            parent = stack[-1]
+        span = self._new_span(name, kind, parent)
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            if not span.usage_reported:
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                span.cpu_user = after.ru_utime - before.ru_utime
+                span.cpu_system = after.ru_stime - before.ru_stime
+                span.max_rss_kib = after.ru_maxrss
+            span.end = time.monotonic()
+            self._log(span)
+
+    def _log(self, span):
+        step = self.step_of(span)
+        level = logging.WARNING if span.exit_status else logging.INFO
+        logging.getLogger("trace").log(level, f"{span.kind} finished: {span.name}", extra={
+            "event": span.kind,
+            "step": step,
+            "command": span.name if span.kind == "command" else None,
+            "duration": round(span.duration, 3),
+            "exit_code": span.exit_status,
+            "output_bytes": span.output_bytes if span.kind == "command" else None,
+            "cpu": round(span.cpu_user + span.cpu_system, 3),
+            "max_rss_kib": span.max_rss_kib,
+        })
+
+    def step(self, name, parent=None):
+        return self.span(name, "step", parent)
+
+    def command(self, command, parent=None):
+        # Span names end up in the trace files and the event log, so secrets are masked here
+        if not isinstance(command, str):
+            command = " ".join(str(arg) for arg in command)
+        return self.span(redact(command), "command", parent)
+
+    def record_command(self, command, start, exit_status, output_bytes=0, parent=None):
+        """
+        Records a command that already finished, for callers that cannot hold a span open.
+
+        The asyncio probes share one thread, so the per-thread span stack would mix them up.
+        """
+        span = self._new_span(redact(command), "command", parent)
+        span.start = start
+        span.end = time.monotonic()
+        span.exit_status = exit_status
+        span.output_bytes = output_bytes
+        self._log(span)
+        return span
+
+    def run(self, args, **kwargs):
+        """Traced drop-in replacement for subprocess.run."""
+        with self.command(args) as span:
+            result = subprocess.run(args, **kwargs)
+            span.exit_status = result.returncode
+            for output in (result.stdout, result.stderr):
+                if output:
+                    span.output_bytes += len(output)
+            return result
+
+    def system(self, command):
+        """Traced drop-in replacement for os.system."""
+        with self.command(command) as span:
+            status = os.system(command)
+            span.exit_status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+            return status
+
+    def chrome_trace(self):
+        """Returns the recorded spans as a Chrome trace-event document."""
+        pid = os.getpid()
+        events = []
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            events.append({
+                "name": span.name,
+                "cat": span.kind,
+                "ph": "X",
+                "ts": int((span.start - self.epoch) * 1e6),
+                "dur": int(span.duration * 1e6),
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {
+                    "id": span.id,
+                    "parent": span.parent,
+                    "cpu_user_s": round(span.cpu_user, 3),
+                    "cpu_system_s": round(span.cpu_system, 3),
+                    "max_rss_kib": span.max_rss_kib,
+                    "output_bytes": span.output_bytes,
+                    "exit_status": span.exit_status,
+                },
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path=TRACE_FILE):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self, top_n=DEFAULT_TOP_N):
+        """Returns a plain-text table of the slowest operations."""
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.duration, reverse=True)[:top_n]
+            names = {span.id: span.name for span in self.spans}
+        lines = [f"Top {len(spans)} slowest operations:",
+                 f"{'wall s':>8} {'cpu s':>7} {'rss MiB':>8} {'out KiB':>8} {'exit':>4}  operation"]
+        for span in spans:
+            exit_status = "" if span.exit_status is None else str(span.exit_status)
+            parent = f"  [in {names[span.parent]}]" if span.parent is not None else ""
+            lines.append(f"{span.duration:8.2f} {span.cpu_user + span.cpu_system:7.2f} "
+                         f"{span.max_rss_kib / 1024:8.1f} {span.output_bytes / 1024:8.1f} {exit_status:>4}  "
+                         f"{span.name[:80]}{parent}")
+        return "\n".join(lines)
+
+    def export(self, trace_path=TRACE_FILE, summary_path=SUMMARY_FILE, top_n=DEFAULT_TOP_N):
+        """Writes the Chrome trace and the summary; returns the summary text."""
+        summary = self.summary(top_n)
+        self.export_chrome_trace(trace_path)
+        with open(summary_path, "w") as f:
+            f.write(summary + "\n")
+        return summary
+
+
+# Process-wide tracer used by every module
+tracer = Tracer()
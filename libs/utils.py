@@ -1,4 +1,7 @@
 # Standard library imports
+import asyncio
+import atexit
+import collections
 import os
 import shutil
 import subprocess
@@ -6,30 +9,133 @@ import re
 import sys
 import curses
 import logging
+import threading
+import time
 from pathlib import Path
 
+from libs import hardware
+from libs import packages
+from libs.trace import tracer
 
-# Initialize logging
-logging.basicConfig(level=logging.INFO)
 
-def run_command(command, log_file="install_log.txt"):
+# Number of output lines kept per stream for the returned result and error reports
+OUTPUT_TAIL_LINES = 500
+
+# Log files stay open for the whole run instead of being reopened for every command
+_log_handles = {}
+_log_lock = threading.Lock()
+
+
+def get_log_handle(log_file):
+    """Returns the shared, line-buffered append handle for a log file."""
+    with _log_lock:
+        handle = _log_handles.get(log_file)
+        if handle is None or handle.closed:
+            handle = open(log_file, "a", buffering=1)
+            _log_handles[log_file] = handle
+        return handle
+
+
+def close_log_handles():
+    """Flushes and closes every log handle opened by the command executor."""
+    with _log_lock:
+        for handle in _log_handles.values():
+            if not handle.closed:
+                handle.close()
+        _log_handles.clear()
+
+
+atexit.register(close_log_handles)
+
+
+def feed_stdin(process, text):
+    """Writes text to a process's stdin from a helper thread, so a full pipe never blocks the output readers."""
+    def write():
+        try:
+            process.stdin.write(text)
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass  # The command exited without reading all of it
+
+    threading.Thread(target=write, daemon=True).start()
+
+
+def stream_command(command, log_file="install_log.txt", callbacks=None, tail_lines=OUTPUT_TAIL_LINES, input=None):
+    """
+    Executes a shell command and streams its output line by line.
+
+    Each line is written to the log file as soon as it is read and handed to every
+    callback, so long-running commands such as pacstrap show progress immediately
+    and their output is never held in memory as a whole.
+
+    Parameters:
+    - command: The shell command to execute.
+    - log_file: The file to which the command's output will be logged.
+    - callbacks: Optional list of callables invoked as callback(stream, line) where
+      stream is "stdout" or "stderr".
+    - tail_lines: Number of trailing lines per stream kept for the result.
+    - input: Text written to the command's stdin; secrets go here, never into the command line.
+
+    Returns:
+    - result: A subprocess.CompletedProcess whose stdout and stderr hold the last
+      tail_lines lines of each stream.
+    """
+    callbacks = callbacks or []
+    log = get_log_handle(log_file)
+    dispatch_lock = threading.Lock()
+    tails = {
+        "stdout": collections.deque(maxlen=tail_lines),
+        "stderr": collections.deque(maxlen=tail_lines),
+    }
+
+    output_bytes = {"stdout": 0, "stderr": 0}
+
+    def pump(stream_name, pipe):
+        for line in pipe:
+            tails[stream_name].append(line)
+            output_bytes[stream_name] += len(line)
+            with dispatch_lock:
+                log.write(line)
+                for callback in callbacks:
+                    try:
+                        callback(stream_name, line)
+                    except Exception as e:
+                        logging.error(f"Output callback failed: {str(e)}")
+        pipe.close()
+
+    with tracer.command(command) as span:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True,
+                                   stdin=subprocess.PIPE if input is not None else None,
+                                   text=True, errors="replace", bufsize=1)
+        if input is not None:
+            feed_stdin(process, input)
+        # stderr gets its own reader so a chatty stream can never stall the other one
+        stderr_reader = threading.Thread(target=pump, args=("stderr", process.stderr), daemon=True)
+        stderr_reader.start()
+        pump("stdout", process.stdout)
+        stderr_reader.join()
+        returncode = process.wait()
+        span.output_bytes = output_bytes["stdout"] + output_bytes["stderr"]
+        span.exit_status = returncode
+    log.flush()
+
+    return subprocess.CompletedProcess(command, returncode, "".join(tails["stdout"]), "".join(tails["stderr"]))
+
+
+def run_command(command, log_file="install_log.txt", callbacks=None):
     """
     Executes a shell command and logs its output to a specified log file.
     
     Parameters:
     - command: The shell command to execute.
     - log_file: The file to which the command's output will be logged.
+    - callbacks: Optional list of callables receiving (stream, line) for every output line.
     
     Returns:
     - result: The result object containing stdout, stderr, and returncode.
     """
     try:
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
-        
-        # Log the command's output to the specified file
-        with open(log_file, "a") as f:
-            f.write(result.stdout)
-            f.write(result.stderr)
+        result = stream_command(command, log_file=log_file, callbacks=callbacks)
         
         # If there's an error in the command execution, raise an exception
         if result.returncode != 0:
@@ -41,6 +147,111 @@ def run_command(command, log_file="install_log.txt"):
         exit(1)
 
 
+# Environment probes the menus need, started together at startup and cached until invalidated
+PROBES = {
+    "drives": "lsblk -dpno NAME,SIZE,MODEL",
+    "wifi": "iw dev",
+    "services": "systemctl list-unit-files --type=service",
+    "timezone": "timedatectl show --property=Timezone --value",
+}
+PROBE_TIMEOUT = 15
+
+
+class ProbeEngine:
+    """
+    Runs read-only environment probes concurrently on an asyncio loop in a background thread.
+
+    All probes start at the same moment, so the total latency is that of the slowest
+    one. Results stay cached until invalidate() is called, and get() only waits if
+    the probe has not finished yet.
+    """
+    def __init__(self, probes=None, timeout=PROBE_TIMEOUT):
+        self.probes = dict(PROBES if probes is None else probes)
+        self.timeout = timeout
+        self.results = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    async def _probe(self, name, command, done):
+        start = time.monotonic()
+        result = None
+        try:
+            try:
+                process = await asyncio.create_subprocess_shell(
+                    command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+                try:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+                    returncode = process.returncode
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    stdout, stderr, returncode = b"", f"Timed out after {self.timeout}s".encode(), -1
+            except OSError as e:
+                stdout, stderr, returncode = b"", str(e).encode(), -1
+            result = subprocess.CompletedProcess(command, returncode, stdout.decode(errors="replace"),
+                                                 stderr.decode(errors="replace"))
+        finally:
+            # Waiters in get() must always be released, even if the probe itself blew up
+            if result is None:
+                result = subprocess.CompletedProcess(command, -1, "", "Probe failed")
+            tracer.record_command(command, start, result.returncode,
+                                  len(result.stdout) + len(result.stderr))
+            with self.lock:
+                # A probe invalidated while running is not stored; its replacement will be
+                if self.pending.get(name) is done:
+                    self.results[name] = result
+                    del self.pending[name]
+            done.set()
+
+    async def _run(self, jobs):
+        await asyncio.gather(*(self._probe(name, self.probes[name], done) for name, done in jobs))
+
+    def _check(self, names):
+        # An unknown name would only fail on the probe thread, leaving get() waiting forever
+        unknown = [name for name in names if name not in self.probes]
+        if unknown:
+            raise KeyError(f"Unknown probe: {', '.join(unknown)}")
+
+    def start(self, names=None):
+        """Starts the given probes (all by default) that are neither cached nor running."""
+        self._check(names or [])
+        jobs = []
+        with self.lock:
+            for name in names or self.probes:
+                if name not in self.results and name not in self.pending:
+                    self.pending[name] = threading.Event()
+                    jobs.append((name, self.pending[name]))
+        if jobs:
+            threading.Thread(target=asyncio.run, args=(self._run(jobs),), daemon=True).start()
+
+    def get(self, name):
+        """Returns the probe's CompletedProcess, running or waiting for it only if needed."""
+        self._check([name])
+        while True:
+            with self.lock:
+                if name in self.results:
+                    return self.results[name]
+                done = self.pending.get(name)
+            if done is None:
+                self.start([name])
+            else:
+                done.wait()
+
+    def invalidate(self, name=None):
+        """Drops one cached result, or all of them, so the next get() probes again."""
+        with self.lock:
+            for key in [name] if name else list(self.results):
+                self.results.pop(key, None)
+            if name is None:
+                self.pending.clear()
+            else:
+                self.pending.pop(name, None)
+
+
+# Shared engine; arch-install.py starts every probe as soon as the program starts
+probes = ProbeEngine()
+
+
 def clear():
     """Clears the terminal screen."""
     try:
@@ -106,13 +317,12 @@ def virt_check():
     Detects the virtualization platform and sets up the appropriate guest tools.
     """
     try:
-        result = subprocess.run(['systemd-detect-virt'], text=True, capture_output=True)
-        virtualization_type = result.stdout.strip()
-        
+        virtualization_type = hardware.profile().virtualization
+
         if virtualization_type == "vmware":
-            subprocess.run(['pacman', '-S', 'open-vm-tools', '--noconfirm'])
-        elif virtualization_type == "virtualbox":
-            subprocess.run(['pacman', '-S', 'virtualbox-guest-utils', '--noconfirm'])
+            packages.transaction.add(["open-vm-tools"], "Guest tools")
+        elif virtualization_type in ("oracle", "virtualbox"):
+            packages.transaction.add(["virtualbox-guest-utils"], "Guest tools")
         # ... [Any other virtualization checks and setups]
     except Exception as e:
         logging.error(f"Error detecting virtualization platform: {str(e)}")
@@ -120,11 +330,10 @@ def virt_check():
 
 def get_wifi_interface():
     # Get the name of the Wi-Fi interface (e.g., wlan0, wlp3s0)
-    result = run_command("iw dev | awk '$1==\"Interface\" {print $2}'")
-    interface = result.stdout.strip()
-    if not interface:
+    interfaces = re.findall(r"^\s*Interface\s+(\S+)", probes.get("wifi").stdout, re.MULTILINE)
+    if not interfaces:
         return "wlan0"  # Default to wlan0 if not found
-    return interface
+    return interfaces[0]
 
 def scan_wifi():
     """
@@ -141,7 +350,7 @@ def scan_wifi():
         if shutil.which("iw") is None:
             raise Exception("'iw' command not found. Please install it to scan for Wi-Fi networks.")
 
-        result = subprocess.run(['iw', 'dev', wifi_interface, 'scan'], text=True, capture_output=True)
+        result = tracer.run(['iw', 'dev', wifi_interface, 'scan'], text=True, capture_output=True)
         networks = re.findall(r"SSID: (.+)", result.stdout)
         return networks
     except Exception as e:
@@ -156,9 +365,9 @@ def enable_services():
     try:
         # Check for installed packages and enable corresponding services
         if Path("/usr/bin/NetworkManager").exists():
-            subprocess.run(['systemctl', 'enable', 'NetworkManager'])
+            tracer.run(['systemctl', 'enable', 'NetworkManager'])
         if Path("/usr/bin/sshd").exists():
-            subprocess.run(['systemctl', 'enable', 'sshd'])
+            tracer.run(['systemctl', 'enable', 'sshd'])
         # ... [Any other service checks and setups]
     except Exception as e:
         logging.error(f"Error enabling services: {str(e)}")
@@ -174,17 +383,18 @@ def chroot_into_system(script_path=None):
     try:
         virt_check()
         # Install appropriate microcode based on CPU vendor
-        cpu_info = subprocess.run(['cat', '/proc/cpuinfo'], text=True, capture_output=True).stdout
-        if "GenuineIntel" in cpu_info:
-            subprocess.run(['pacman', '-S', 'intel-ucode', '--noconfirm'])
-        elif "AuthenticAMD" in cpu_info:
-            subprocess.run(['pacman', '-S', 'amd-ucode', '--noconfirm'])
+        cpu_vendor = hardware.profile().cpu_vendor
+        if "Intel" in cpu_vendor:
+            packages.transaction.add(["intel-ucode"], "Microcode")
+        elif "AMD" in cpu_vendor:
+            packages.transaction.add(["amd-ucode"], "Microcode")
+        packages.transaction.commit()
         
         # Chroot into the system and optionally run a script
         if script_path:
-            subprocess.run(['arch-chroot', '/mnt', 'bash', script_path])
+            tracer.run(['arch-chroot', '/mnt', 'bash', script_path])
         else:
-            subprocess.run(['arch-chroot', '/mnt'])
+            tracer.run(['arch-chroot', '/mnt'])
     except Exception as e:
         logging.error(f"Error during chroot operation: {str(e)}")
 
@@ -198,14 +408,13 @@ def update_systemd_services(to_enable, to_disable):
     - to_disable: List of services to disable.
     """
     for service in to_enable:
-        subprocess.run(["systemctl", "enable", service], check=True)
+        tracer.run(["systemctl", "enable", service], check=True)
     for service in to_disable:
-        subprocess.run(["systemctl", "disable", service], check=True)
+        tracer.run(["systemctl", "disable", service], check=True)
+    probes.invalidate("services")
 
 def get_systemd_services():
-    command = "systemctl list-unit-files --type=service"
-    result = subprocess.run(command, text=True, capture_output=True, shell=True)
-    lines = result.stdout.splitlines()
+    lines = probes.get("services").stdout.splitlines()
     services = []
     for line in lines[1:-1]:  # Skip the header and footer lines
         parts = line.split(None, 1)
@@ -0,0 +1,43 @@
+import io
+import os
+import sys
+import tarfile
+
+import pytest
+
+# The installer is run from a checkout, not installed; make `libs` importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# name -> (dependencies, compressed size)
+SYNC_PACKAGES = {
+    "base": (["filesystem", "glibc", "bash"], 2000),
+    "filesystem": ([], 100),
+    "glibc": (["filesystem", "linux-api-headers>=4.10"], 10000),
+    "linux-api-headers": ([], 1500),
+    "bash": (["glibc", "readline>=7.0"], 1800),
+    "readline": (["glibc"], 400),
+    "nano": (["glibc"], 600),
+}
+
+
+def make_desc(name, depends, csize):
+    lines = ["%FILENAME%", f"{name}-1.0-1-x86_64.pkg.tar.zst", "", "%NAME%", name, "", "%VERSION%", "1.0-1", "",
+             "%CSIZE%", str(csize), "", "%ISIZE%", str(csize * 4), "", "%SHA256SUM%", "0" * 64, ""]
+    if depends:
+        lines += ["%DEPENDS%"] + depends + [""]
+    return "\n".join(lines) + "\n"
+
+
+@pytest.fixture
+def sync_dir(tmp_path):
+    """A sync database directory holding a small core.db."""
+    directory = tmp_path / "sync"
+    directory.mkdir()
+    with tarfile.open(directory / "core.db", "w:gz") as db:
+        for name, (depends, csize) in SYNC_PACKAGES.items():
+            data = make_desc(name, depends, csize).encode()
+            member = tarfile.TarInfo(f"{name}-1.0-1/desc")
+            member.size = len(data)
+            db.addfile(member, io.BytesIO(data))
+    return directory
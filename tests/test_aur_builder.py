@@ -0,0 +1,193 @@
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+import pytest
+
+from libs import aur_builder
+from libs.packages import PackageTransaction
+from libs.pacman_conf import PacmanConf
+
+SRCINFO = """pkgbase = yay
+\tpkgdesc = Yet another yogurt
+\tpkgver = 12.3.5
+\tpkgrel = 1
+\tepoch = 1
+\tmakedepends = go>=1.21
+\tdepends = pacman>6.1
+\tdepends_x86_64 = libfoo
+\tprovides = yay-bin
+
+pkgname = yay
+"""
+
+
+def test_parse_srcinfo():
+    package = aur_builder.parse_srcinfo(SRCINFO, "/aur/yay")
+    assert (package.pkgbase, package.pkgnames, package.version) == ("yay", ["yay"], "1:12.3.5-1")
+    assert package.depends == {"go", "pacman", "libfoo"}
+    assert package.names == {"yay", "yay-bin"}
+
+
+def test_local_dependencies():
+    yay = aur_builder.parse_srcinfo(SRCINFO, "/aur/yay")
+    libfoo = aur_builder.parse_srcinfo("pkgbase = libfoo-git\npkgname = libfoo-git\nprovides = libfoo\n", "/aur/libfoo")
+    assert aur_builder.local_dependencies([yay, libfoo]) == {"yay": {"libfoo-git"}, "libfoo-git": set()}
+
+
+def test_offline_pacman_conf_uses_only_local_files():
+    conf = PacmanConf(aur_builder.offline_pacman_conf(["core", "extra"], "/var/lib/pacman/sync", "/cache"))
+    assert conf.repos() == ["core", "extra"]
+    assert conf.section("options").get("CacheDir") == "/cache"
+    for repo in conf.repos():
+        servers = [value for _, key, value, _ in conf.section(repo).directives() if key in ("Server", "Include")]
+        assert servers == ["file:///var/lib/pacman/sync"]
+
+
+def make_pkgbuild(root, pkgbase, depends=()):
+    path = root / pkgbase
+    path.mkdir(parents=True)
+    (path / "PKGBUILD").write_text("")
+    lines = [f"pkgbase = {pkgbase}", "\tpkgver = 1.0", "\tpkgrel = 1"]
+    lines += [f"\tdepends = {name}" for name in depends]
+    (path / ".SRCINFO").write_text("\n".join(lines + ["", f"pkgname = {pkgbase}", ""]))
+    return path
+
+
+@pytest.fixture
+def builder(tmp_path, monkeypatch):
+    """build_aur_packages with the chroot, ccache and repository steps replaced by recorders."""
+    for name in ("SOURCE_CACHE", "CCACHE_DIR", "REPO_DIR"):
+        monkeypatch.setattr(aur_builder, name, str(tmp_path / name.lower()))
+    monkeypatch.setattr(aur_builder, "ensure_build_tools", lambda: None)
+    monkeypatch.setattr(aur_builder, "ensure_build_user", lambda: "builder")
+    monkeypatch.setattr(aur_builder, "prepare_build_root", lambda build_root, parallel: None)
+    monkeypatch.setattr(aur_builder, "ccache_command", lambda build_root, arguments: None)
+    monkeypatch.setattr(aur_builder, "ccache_hit_rate", lambda build_root: 0.75)
+    monkeypatch.setattr(aur_builder, "publish_repository", lambda packages: None)
+    monkeypatch.setattr(aur_builder, "transaction", PackageTransaction())
+    events = []
+    lock = threading.Lock()
+
+    def fake_build(package, dependencies, build_root, build_user):
+        with lock:
+            events.append(("start", package.pkgbase, sorted(d.pkgbase for d in dependencies)))
+        time.sleep(0.1)
+        if package.pkgbase.startswith("broken"):
+            package.error = "compile error"
+            raise Exception("compile error")
+        package.seconds = 0.1
+        package.files.append(f"/repo/{package.pkgbase}-1.0-1-x86_64.pkg.tar.zst")
+        with lock:
+            events.append(("end", package.pkgbase))
+
+    monkeypatch.setattr(aur_builder, "build_package", fake_build)
+    return events
+
+
+def test_builds_follow_dependencies_and_independent_ones_overlap(tmp_path, builder):
+    aur = tmp_path / "aur"
+    make_pkgbuild(aur, "libfoo-git")
+    make_pkgbuild(aur, "yay", depends=["libfoo-git>=1", "pacman"])
+    make_pkgbuild(aur, "paru")
+    report = aur_builder.build_aur_packages([str(aur)], parallel=2)
+
+    order = [event[:2] for event in builder]
+    assert order.index(("end", "libfoo-git")) < order.index(("start", "yay"))
+    assert ("start", "yay", ["libfoo-git"]) in builder
+    # libfoo-git and paru start together; yay waits for libfoo-git
+    assert {event[1] for event in builder[:2]} == {"libfoo-git", "paru"}
+    assert [package.pkgbase for package in report.built] == ["libfoo-git", "paru", "yay"]
+    assert report.ccache_hit_rate == 0.75
+    assert aur_builder.transaction.pending() == ["libfoo-git", "paru", "yay"]
+
+
+def test_a_failed_build_skips_its_dependents(tmp_path, builder):
+    aur = tmp_path / "aur"
+    make_pkgbuild(aur, "broken-lib")
+    make_pkgbuild(aur, "app", depends=["broken-lib"])
+    report = aur_builder.build_aur_packages([str(aur)], parallel=2)
+    assert ("start", "app", ["broken-lib"]) not in builder
+    assert report.built == [] and len(report.failed) == 2
+    lines = report.lines()
+    assert "  failed  broken-lib" in lines and " skipped  app" in lines
+    assert lines[-1].startswith("Built 0/2 packages in ")
+
+
+def test_build_package_command(tmp_path, monkeypatch):
+    monkeypatch.setattr(aur_builder, "REPO_DIR", str(tmp_path / "repo"))
+    commands = []
+
+    def fake_stream(command, log_file=None):
+        commands.append(command)
+        staging = shlex.split(command.split(" && ")[1])[0].split("=", 1)[1]
+        open(os.path.join(staging, "yay-12-1-x86_64.pkg.tar.zst"), "w").close()
+        open(os.path.join(staging, "yay-12-1-x86_64.log"), "w").close()
+        return subprocess.CompletedProcess(command, 0, "", "")
+
+    monkeypatch.setattr(aur_builder, "stream_command", fake_stream)
+    yay = aur_builder.parse_srcinfo(SRCINFO, "/aur/yay")
+    libfoo = aur_builder.AurPackage("/aur/libfoo", "libfoo")
+    libfoo.files = ["/repo/libfoo-1-1-x86_64.pkg.tar.zst"]
+    aur_builder.build_package(yay, [libfoo], "/chroot", "builder")
+
+    args = shlex.split(commands[0].split(" && ")[1])
+    assert commands[0].startswith("cd /aur/yay && ")
+    assert args[args.index("makechrootpkg"):] == [
+        "makechrootpkg", "-c", "-r", "/chroot", "-l", "aur-yay", "-U", "builder",
+        "-d", f"{aur_builder.CCACHE_DIR}:{aur_builder.CHROOT_CCACHE_DIR}",
+        "-I", "/repo/libfoo-1-1-x86_64.pkg.tar.zst", "--", "--noconfirm"]
+    assert yay.files == [str(tmp_path / "repo" / "yay-12-1-x86_64.pkg.tar.zst")]
+    assert os.listdir(tmp_path / "repo") == ["yay-12-1-x86_64.pkg.tar.zst"]
+
+
+def test_ccache_hit_rate_parsing(monkeypatch):
+    stats = "stats_updated_timestamp\t1700000000\ndirect_cache_hit\t30\npreprocessed_cache_hit\t10\ncache_miss\t60\n"
+    monkeypatch.setattr(aur_builder, "ccache_command",
+                        lambda build_root, arguments: subprocess.CompletedProcess(arguments, 0, stats, ""))
+    assert aur_builder.ccache_hit_rate("/chroot") == 0.4
+    monkeypatch.setattr(aur_builder, "ccache_command",
+                        lambda build_root, arguments: subprocess.CompletedProcess(arguments, 0, "cache_miss\t0\n", ""))
+    assert aur_builder.ccache_hit_rate("/chroot") is None
+    monkeypatch.setattr(aur_builder, "ccache_command",
+                        lambda build_root, arguments: subprocess.CompletedProcess(arguments, 1, "", "no ccache"))
+    assert aur_builder.ccache_hit_rate("/chroot") is None
+
+
+def test_build_user_is_never_root(monkeypatch):
+    monkeypatch.setenv("SUDO_USER", "alice")
+    assert aur_builder.ensure_build_user() == "alice"
+    monkeypatch.setenv("SUDO_USER", "root")
+    created = []
+    monkeypatch.setattr(aur_builder, "run_command", created.append)
+    assert aur_builder.ensure_build_user("no-such-user-here") == "no-such-user-here"
+    assert created == ["useradd --system --no-create-home --shell /usr/bin/nologin no-such-user-here"]
+
+
+def test_local_repository_is_withdrawn_after_the_transaction(tmp_path, monkeypatch):
+    conf = tmp_path / "pacman.conf"
+    conf.write_text("[options]\nArchitecture = auto\n\n[core]\nInclude = /etc/pacman.d/mirrorlist\n")
+    sync_dir = tmp_path / "sync"
+    sync_dir.mkdir()
+    monkeypatch.setattr(aur_builder, "REPO_DIR", str(tmp_path / "repo"))
+    monkeypatch.setattr(aur_builder, "SYNC_DB_DIR", str(sync_dir))
+    edit = aur_builder.pacman_conf.edit
+    monkeypatch.setattr(aur_builder.pacman_conf, "edit", lambda path=str(conf), preview=None: edit(path, preview))
+    os.makedirs(aur_builder.REPO_DIR)
+    monkeypatch.setattr(aur_builder, "run_command", lambda command: open(
+        os.path.join(aur_builder.REPO_DIR, f"{aur_builder.REPO_NAME}.db.tar.zst"), "w").close())
+    transaction = PackageTransaction()
+    monkeypatch.setattr(aur_builder, "transaction", transaction)
+
+    yay = aur_builder.AurPackage("/aur/yay", "yay")
+    yay.files = ["/repo/yay-12-1-x86_64.pkg.tar.zst"]
+    aur_builder.publish_repository([yay])
+    assert PacmanConf.load(str(conf)).repos() == ["core", aur_builder.REPO_NAME]
+    assert transaction.after_commit == [aur_builder.withdraw_repository]
+
+    for callback in list(transaction.after_commit):
+        callback()
+    assert PacmanConf.load(str(conf)).repos() == ["core"]
+    assert os.listdir(sync_dir) == [] and transaction.after_commit == []
@@ -0,0 +1,64 @@
+import logging
+import os
+
+import pytest
+
+from libs import boot_options
+from libs.boot_options import BootOptions, merge_cmdline
+
+
+@pytest.fixture
+def target(tmp_path, monkeypatch):
+    monkeypatch.setattr(boot_options, "target_path", lambda path: os.path.join(str(tmp_path), path.lstrip("/")))
+    return tmp_path
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def make_options():
+    options = BootOptions()
+    options.add_params(["nvidia-drm.modeset=1", "quiet"])
+    options.add_modules(["nvidia"])
+    return options
+
+
+def test_merge_cmdline_replaces_earlier_values():
+    assert merge_cmdline("loglevel=3 quiet", ["loglevel=4", "splash"]) == "loglevel=4 quiet splash"
+
+
+def test_apply_updates_grub_and_mkinitcpio(target):
+    write(target / "etc" / "default" / "grub", 'GRUB_CMDLINE_LINUX_DEFAULT="loglevel=3 quiet"\n')
+    write(target / "etc" / "mkinitcpio.conf", "MODULES=()\nHOOKS=(base udev kms)\n")
+    assert make_options().apply() == [boot_options.GRUB_DEFAULTS, boot_options.MKINITCPIO_CONF]
+    assert (target / "etc" / "default" / "grub").read_text() == \
+        'GRUB_CMDLINE_LINUX_DEFAULT="loglevel=3 quiet nvidia-drm.modeset=1"\n'
+    assert "MODULES=(nvidia)" in (target / "etc" / "mkinitcpio.conf").read_text()
+
+
+def test_apply_updates_refind_linux_conf(target):
+    write(target / "boot" / "refind_linux.conf",
+          '# "Commented"  "root=x"\n"Boot with standard options"  "root=UUID=abc rw"\n'
+          '"Boot to single-user mode"  "root=UUID=abc rw single"\n')
+    assert make_options().apply() == [boot_options.REFIND_LINUX_CONF]
+    assert (target / "boot" / "refind_linux.conf").read_text() == (
+        '# "Commented"  "root=x"\n'
+        '"Boot with standard options"  "root=UUID=abc rw nvidia-drm.modeset=1 quiet"\n'
+        '"Boot to single-user mode"  "root=UUID=abc rw single nvidia-drm.modeset=1 quiet"\n')
+
+
+def test_apply_updates_systemd_boot_entries(target):
+    entries = target / "boot" / "loader" / "entries"
+    write(entries / "arch.conf", "title Arch Linux\nlinux /vmlinuz-linux\noptions root=UUID=abc rw quiet\n")
+    write(entries / "arch-fallback.conf", "title Arch Linux (fallback)\nlinux /vmlinuz-linux\n")
+    assert make_options().apply() == ["/boot/loader/entries/arch-fallback.conf", "/boot/loader/entries/arch.conf"]
+    assert (entries / "arch.conf").read_text().splitlines()[-1] == "options root=UUID=abc rw quiet nvidia-drm.modeset=1"
+    assert (entries / "arch-fallback.conf").read_text().splitlines()[-1] == "options nvidia-drm.modeset=1 quiet"
+
+
+def test_apply_warns_when_no_bootloader_config_exists(target, caplog):
+    with caplog.at_level(logging.WARNING):
+        assert make_options().apply() == []
+    assert "nvidia-drm.modeset=1" in caplog.text
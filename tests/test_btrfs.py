@@ -0,0 +1,145 @@
+import os
+import shutil
+
+import pytest
+
+from libs.disks import btrfs
+from libs.disks.btrfs import BlockDeviceInfo
+
+OLD_PROGS = ({"mixed-bg", "extref", "skinny-metadata", "no-holes"}, {"crc32c"})
+NEW_PROGS = ({"mixed-bg", "extref", "skinny-metadata", "no-holes", "free-space-tree", "block-group-tree"},
+             {"crc32c", "xxhash", "sha256", "blake2"})
+PAGE_SIZE = max(btrfs.DEFAULT_NODESIZE, os.sysconf("SC_PAGE_SIZE"))
+
+
+def test_choose_checksum():
+    assert btrfs.choose_checksum({"sse4_2"}, NEW_PROGS[1])[0] == "crc32c"
+    assert btrfs.choose_checksum(set(), NEW_PROGS[1])[0] == "xxhash"
+    assert btrfs.choose_checksum(set(), OLD_PROGS[1])[0] == "crc32c"
+    fast = {"crc32": 4 * 1024 ** 3, "blake2": 2 * 1024 ** 3}
+    slow = {"crc32": 4 * 1024 ** 3, "blake2": 100 * 1024 ** 2}
+    assert btrfs.choose_checksum({"sse4_2"}, NEW_PROGS[1], strong=True, benchmark=fast)[0] == "blake2"
+    assert btrfs.choose_checksum({"sse4_2"}, NEW_PROGS[1], strong=True, benchmark=slow)[0] == "crc32c"
+
+
+def test_crc32c_plans_leave_out_csum_for_old_btrfs_progs():
+    plan = btrfs.plan_mkfs(cpu_flags=[], supported=OLD_PROGS)
+    assert plan.checksum == "crc32c" and plan.features == []
+    assert plan.command("/dev/sda2") == f"mkfs.btrfs -f --nodesize {PAGE_SIZE} -d single -m dup /dev/sda2"
+
+
+def test_plan_mkfs_with_new_btrfs_progs(monkeypatch):
+    monkeypatch.setattr(btrfs, "kernel_supports", lambda feature: True)
+    plan = btrfs.plan_mkfs(device_count=2, cpu_flags=[], supported=NEW_PROGS)
+    assert plan.checksum == "xxhash"
+    assert plan.features == ["free-space-tree", "no-holes", "block-group-tree"]
+    assert plan.command(["/dev/sda", "/dev/sdb"]) == (
+        f"mkfs.btrfs -f --csum xxhash --nodesize {PAGE_SIZE} -O free-space-tree,no-holes,block-group-tree "
+        "-d raid1 -m raid1 /dev/sda /dev/sdb")
+
+
+def test_block_group_tree_needs_kernel_support(monkeypatch):
+    monkeypatch.setattr(btrfs, "kernel_supports", lambda feature: False)
+    assert btrfs.plan_mkfs(cpu_flags=["sse4_2"], supported=NEW_PROGS).features == ["free-space-tree"]
+
+
+def test_plan_mounts_for_nvme_and_hdd():
+    nvme = btrfs.plan_mounts(BlockDeviceInfo("nvme0n1p2", False, 512, "nvme"))
+    assert [entry.mount_point for entry in nvme][:2] == ["/", "/home"]
+    assert nvme[0].options == ["noatime", "space_cache=v2", "ssd", "discard=async", "compress=zstd:1",
+                               f"commit={btrfs.COMMIT_INTERVAL_FLASH}"]
+    hdd = btrfs.plan_mounts(BlockDeviceInfo("sda2", True, 0, "sata"))
+    assert hdd[0].options == ["noatime", "space_cache=v2", "compress=zstd:3",
+                              f"commit={btrfs.COMMIT_INTERVAL_ROTATIONAL}"]
+    pkg = next(entry for entry in hdd if entry.mount_point == "/var/cache/pacman/pkg")
+    assert not pkg.subvolume.compress
+    assert pkg.fstab_line("abc").endswith("subvol=/@pkg\t0 0")
+
+
+def test_block_device_info_follows_partitions_and_mappings(tmp_path):
+    block = tmp_path / "sys" / "class" / "block"
+    disk = tmp_path / "sys" / "devices" / "nvme0n1"
+    (disk / "queue").mkdir(parents=True)
+    (disk / "queue" / "rotational").write_text("0\n")
+    (disk / "queue" / "discard_granularity").write_text("512\n")
+    (disk / "nvme0n1p2").mkdir()
+    (disk / "nvme0n1p2" / "partition").write_text("2\n")
+    block.mkdir(parents=True)
+    (block / "nvme0n1").symlink_to(disk)
+    (block / "nvme0n1p2").symlink_to(disk / "nvme0n1p2")
+    (block / "dm-0" / "slaves" / "nvme0n1p2").mkdir(parents=True)
+
+    partition = BlockDeviceInfo.read("/dev/nvme0n1p2", str(tmp_path))
+    assert (partition.rotational, partition.discard_granularity, partition.transport) == (False, 512, "nvme")
+    assert BlockDeviceInfo.read("/dev/dm-0", str(tmp_path)).transport == "nvme"
+
+
+GiB = 1024 ** 3
+
+
+def test_raid_profiles_for_device_counts():
+    assert btrfs.raid_profiles_for(1) == []
+    assert btrfs.raid_profiles_for(2) == ["raid0", "raid1"]
+    assert btrfs.raid_profiles_for(4) == ["raid0", "raid1", "raid1c3", "raid1c4", "raid10"]
+
+
+def test_usable_capacity_of_equal_devices():
+    assert btrfs.simulate_usable_capacity([4 * GiB] * 3, "raid1") == (6 * GiB, [0, 0, 0])
+    assert btrfs.simulate_usable_capacity([4 * GiB] * 3, "raid0") == (12 * GiB, [0, 0, 0])
+
+
+def test_usable_capacity_of_mismatched_devices():
+    sizes = [1000 * GiB, 500 * GiB, 250 * GiB, 250 * GiB]
+    # raid1 mirrors the largest device against all the others together
+    assert btrfs.simulate_usable_capacity(sizes, "raid1") == (1000 * GiB, [0, 0, 0, 0])
+    assert btrfs.simulate_usable_capacity(sizes, "raid0") == (2000 * GiB, [0, 0, 0, 0])
+    assert btrfs.simulate_usable_capacity(sizes, "raid1c3") == (500 * GiB, [500 * GiB, 0, 0, 0])
+    assert btrfs.simulate_usable_capacity(sizes, "raid10") == (750 * GiB, [500 * GiB, 0, 0, 0])
+    # Two very different devices: most of the larger one has no mirror partner
+    assert btrfs.simulate_usable_capacity([1000 * GiB, 250 * GiB], "raid1") == (250 * GiB, [750 * GiB, 0])
+
+
+def test_raid_layout_problems_and_warnings():
+    layout = btrfs.RaidLayout(["/dev/sda", "/dev/sdb"], [1000 * GiB, 250 * GiB], "raid1")
+    assert layout.metadata_profile == "raid1"
+    assert layout.problems() == []
+    assert layout.warnings() == ["Device sizes differ: 750 GiB cannot be used with raid1 (most of it on /dev/sda)"]
+    assert layout.report() == "raid1 data / raid1 metadata on 2 devices: 250 GiB usable of 1250 GiB raw"
+
+    even = btrfs.RaidLayout(["/dev/sda", "/dev/sdb"], [500 * GiB, 500 * GiB], "raid0")
+    assert even.warnings() == [] and even.metadata_profile == "raid1"
+
+    too_few = btrfs.RaidLayout(["/dev/sda", "/dev/sdb"], [500 * GiB] * 2, "raid1c3")
+    assert too_few.problems() == ["raid1c3 data needs at least 3 devices", "raid1c3 metadata needs at least 3 devices"]
+
+
+def test_raid_layout_mkfs_command(monkeypatch):
+    monkeypatch.setattr(btrfs, "kernel_supports", lambda feature: True)
+    layout = btrfs.RaidLayout(["/dev/sda", "/dev/sdb", "/dev/sdc", "/dev/sdd"], [500 * GiB] * 4, "raid10")
+    command = layout.mkfs_plan(cpu_flags=["sse4_2"], supported=OLD_PROGS).command(layout.devices)
+    assert command.endswith("-d raid10 -m raid1 /dev/sda /dev/sdb /dev/sdc /dev/sdd")
+
+
+needs_loop_devices = pytest.mark.skipif(os.geteuid() != 0 or shutil.which("mkfs.btrfs") is None,
+                                        reason="loop devices and mkfs.btrfs need root and btrfs-progs")
+
+
+@needs_loop_devices
+def test_mount_times_on_a_loop_image(tmp_path, caplog):
+    plan = btrfs.plan_mkfs()
+    caplog.set_level("INFO")
+    default_time, planned_time = btrfs.compare_mount_times(plan, image=str(tmp_path / "plan.img"), size=8 * 1024 ** 3,
+                                                           block_groups=4, mount_point=str(tmp_path / "mnt"))
+    assert default_time > 0 and planned_time > 0
+    assert "Cold mount:" in caplog.text
+    assert not (tmp_path / "plan.img").exists()
+
+
+@needs_loop_devices
+def test_raid_throughput_on_loop_devices(tmp_path):
+    results = btrfs.compare_raid_throughput(size=2 * 1024 ** 3, image_dir=str(tmp_path),
+                                            mount_point=str(tmp_path / "mnt"), test_size=64 * 1024 ** 2)
+    assert sorted(results) == ["raid0", "raid1", "raid10"]
+    assert all(write > 0 and read > 0 for _, write, read in results.values())
+    assert results["raid0"][0] == 2 * results["raid1"][0]
+    assert not list(tmp_path.glob("*.img"))
@@ -0,0 +1,105 @@
+import functools
+import threading
+import urllib.error
+import urllib.request
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from libs import cache_proxy
+from libs.cache_proxy import PackageStore
+
+PACKAGE = "core/os/x86_64/nano-8.0-1-x86_64.pkg.tar.zst"
+
+
+class CountingHandler(SimpleHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    """A local mirror serving a package and a database."""
+    root = tmp_path / "mirror"
+    (root / "core/os/x86_64").mkdir(parents=True)
+    (root / PACKAGE).write_bytes(b"p" * 4096)
+    (root / "core/os/x86_64/core.db").write_bytes(b"d" * 100)
+    CountingHandler.requests = []
+    server = start(ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(CountingHandler, directory=str(root))))
+    yield f"http://127.0.0.1:{server.server_address[1]}/$repo/os/$arch"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def proxy(tmp_path, upstream):
+    store = PackageStore(str(tmp_path / "cache"), 1024 ** 2, [upstream])
+    server = start(cache_proxy.make_server(store, "127.0.0.1", 0))
+    yield store, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return response.read()
+
+
+def test_package_is_downloaded_from_upstream_once(proxy):
+    store, url = proxy
+    assert fetch(f"{url}/{PACKAGE}") == b"p" * 4096
+    assert fetch(f"{url}/{PACKAGE}") == b"p" * 4096
+    assert CountingHandler.requests == ["/" + PACKAGE]
+    assert (store.hits, store.misses) == (1, 1)
+
+
+def test_concurrent_requests_share_one_download(proxy):
+    store, url = proxy
+    threads = [threading.Thread(target=fetch, args=(f"{url}/{PACKAGE}",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert CountingHandler.requests == ["/" + PACKAGE]
+
+
+def test_missing_file_is_404(proxy):
+    _, url = proxy
+    with pytest.raises(urllib.error.HTTPError) as error:
+        fetch(f"{url}/core/os/x86_64/missing-1-1-x86_64.pkg.tar.zst")
+    assert error.value.code == 404
+
+
+def test_least_recently_used_files_are_evicted(tmp_path, upstream):
+    store = PackageStore(str(tmp_path / "cache"), 4096, [upstream])
+    store.get(PACKAGE)
+    store.get("core/os/x86_64/core.db")
+    assert list(store.entries) == ["core/os/x86_64/core.db"]
+    assert store.total_size == 100
+
+
+def test_proxy_is_only_included_by_the_host(tmp_path):
+    pacman_conf = tmp_path / "pacman.conf"
+    pacman_conf.write_text("[options]\nParallelDownloads = 5\n\n[core]\nInclude = /etc/pacman.d/mirrorlist\n\n"
+                           "[extra]\nSigLevel = Required\nInclude = /etc/pacman.d/mirrorlist\n")
+    mirrorlist = tmp_path / "lan-cache-mirrorlist"
+    cache_proxy.use_cache_proxy("http://10.0.0.2:7879", str(mirrorlist), str(pacman_conf))
+    cache_proxy.use_cache_proxy("http://10.0.0.2:7879", str(mirrorlist), str(pacman_conf))
+
+    assert "Server = http://10.0.0.2:7879/$repo/os/$arch\n" in mirrorlist.read_text()
+    include = f"Include = {mirrorlist}\n"
+    assert pacman_conf.read_text() == (
+        "[options]\nParallelDownloads = 5\n\n"
+        f"[core]\n{include}Include = /etc/pacman.d/mirrorlist\n\n"
+        f"[extra]\nSigLevel = Required\n{include}Include = /etc/pacman.d/mirrorlist\n")
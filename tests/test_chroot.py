@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from libs import chroot
+from libs.chroot import ChrootSession
+from libs.trace import tracer
+
+
+@pytest.fixture
+def session(tmp_path):
+    """A worker chrooted into / so the protocol can be exercised without a target or mounts."""
+    if os.geteuid() != 0:
+        pytest.skip("chroot needs root")
+    session = ChrootSession("/", log_file=str(tmp_path / "install_log.txt"))
+    session._start_worker()
+    yield session
+    session.stop()
+
+
+def test_worker_is_a_fresh_interpreter(session):
+    assert session.process.pid != os.getpid()
+    assert session.process.poll() is None
+
+
+def test_run_streams_output_and_exit_status(session):
+    lines = []
+    result = session.run("echo out; echo err >&2; exit 3", [lambda stream, line: lines.append((stream, line))])
+    assert result.returncode == 3
+    assert (result.stdout, result.stderr) == ("out\n", "err\n")
+    assert sorted(lines) == [("stderr", "err\n"), ("stdout", "out\n")]
+
+
+def test_worker_reports_the_cpu_time_of_its_commands(session):
+    session.run("i=0; while [ $i -lt 300000 ]; do i=$((i+1)); done")
+    span = tracer.spans[-1]
+    assert span.usage_reported
+    assert span.cpu_user + span.cpu_system > 0.05 and span.max_rss_kib > 0
+
+
+def test_write_file(session, tmp_path):
+    path = str(tmp_path / "hostname")
+    session.write_file(path, "arch\n")
+    session.write_file(path, "box\n", append=True)
+    with open(path) as f:
+        assert f.read() == "arch\nbox\n"
+
+
+def test_stop_ends_the_worker(tmp_path, session):
+    process = session.process
+    session.stop()
+    assert process.returncode == 0
+    with pytest.raises(Exception):
+        session.run("true")
+
+
+def test_target_path_without_session():
+    assert chroot.target_path("/etc/fstab") == "/etc/fstab"
+
+
+def test_input_goes_to_stdin(session):
+    result = session.run("cat", input="root:secret\n")
+    assert result.stdout == "root:secret\n"
+
+
+def test_run_in_target_without_session_passes_input(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = chroot.run_in_target("cat", input="user:pw\n")
+    assert result.stdout == "user:pw\n"
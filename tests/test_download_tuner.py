@@ -0,0 +1,55 @@
+import pytest
+
+from libs import download_tuner
+from libs.download_tuner import DownloadTuning, choose_parallel_downloads
+
+
+def test_choose_stops_when_throughput_flattens():
+    measurements = {1: 10e6, 2: 19e6, 4: 30e6, 8: 31e6}
+    assert choose_parallel_downloads(measurements) == 4
+
+
+def test_choose_falls_back_when_every_download_failed():
+    measurements = {1: 0.0, 2: 0.0, 4: 0.0}
+    assert choose_parallel_downloads(measurements) == download_tuner.DEFAULT_PARALLEL_DOWNLOADS
+
+
+def test_report_of_fallback_has_no_measurement():
+    measurements = {1: 0.0, 2: 0.0, 4: 0.0}
+    tuning = DownloadTuning(choose_parallel_downloads(measurements), measurements, "https://mirror/$repo")
+    assert tuning.aggregate is None
+    assert "default, no measurement" in tuning.report()
+
+
+def test_report_with_measurements():
+    tuning = DownloadTuning(4, {1: 1048576.0, 4: 4 * 1048576.0}, "https://mirror/$repo")
+    assert tuning.report() == ("ParallelDownloads = 4: 4.0 MiB/s aggregate, 1.0 MiB/s per connection "
+                               "from https://mirror/$repo")
+
+
+def test_saved_tuning_round_trips(tmp_path):
+    result_file = str(tmp_path / "tuning.json")
+    download_tuner.save_tuning(DownloadTuning(8, {1: 1.0, 8: 6.0}, "m"), result_file)
+    loaded = download_tuner.load_tuning(result_file)
+    assert (loaded.parallel_downloads, loaded.measurements, loaded.mirror) == (8, {1: 1.0, 8: 6.0}, "m")
+
+
+def test_tuning_uses_the_given_ranking(tmp_path, monkeypatch):
+    conf = tmp_path / "pacman.conf"
+    conf.write_text("[options]\n#ParallelDownloads = 5\n")
+    monkeypatch.setattr(download_tuner.mirrors, "rank_mirrors", lambda: pytest.fail("benchmarked the mirrors again"))
+    monkeypatch.setattr(download_tuner, "measure_download_concurrency",
+                        lambda url: DownloadTuning(3, {1: 1.0, 2: 2.0, 3: 3.0}, url))
+    ranked = [download_tuner.mirrors.MirrorResult("https://fast/$repo/os/$arch", 0.01, 1e6)]
+    monkeypatch.setattr(download_tuner, "save_tuning", lambda tuning: None)
+    assert download_tuner.tune_parallel_downloads(str(conf), ranked).mirror == "https://fast/$repo/os/$arch"
+    assert "ParallelDownloads = 3" in conf.read_text()
+
+
+def test_tuning_outside_a_private_directory_is_ignored(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    download_tuner.save_tuning(DownloadTuning(8, {1: 1.0, 8: 6.0}, "m"), str(shared / "tuning.json"))
+    assert not (shared / "tuning.json").exists()
+    assert download_tuner.load_tuning(str(shared / "tuning.json")) is None
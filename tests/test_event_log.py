@@ -0,0 +1,49 @@
+import json
+import logging
+
+from libs import event_log
+
+
+def make_record(message, **extra):
+    record = logging.LogRecord("trace", logging.INFO, __file__, 1, message, None, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def test_formatter_writes_structured_fields():
+    line = event_log.JsonLineFormatter().format(make_record("command finished", event="command",
+                                                            step="Rank mirrors", duration=1.5, exit_code=0))
+    event = json.loads(line)
+    assert (event["event"], event["step"], event["duration"], event["exit_code"]) == ("command", "Rank mirrors", 1.5, 0)
+
+
+def test_formatter_never_writes_secrets():
+    command = "echo 'root:hunter2' | chpasswd"
+    line = event_log.JsonLineFormatter().format(make_record(f"command finished: {command}", command=command))
+    assert "hunter2" not in line
+
+
+def test_query_cli_masks_secrets_of_old_logs(tmp_path, capsys):
+    path = tmp_path / "install_events.jsonl"
+    events = [
+        {"ts": "t1", "level": "INFO", "event": "command", "step": "Set root password", "duration": 0.1,
+         "command": 'echo "root:hunter2" | chpasswd', "message": 'command finished: echo "root:hunter2" | chpasswd'},
+        {"ts": "t2", "level": "INFO", "event": "command", "step": "Rank mirrors", "duration": 40.0,
+         "command": "reflector", "message": "command finished: reflector"},
+    ]
+    path.write_text("".join(json.dumps(event) + "\n" for event in events) + '{"cut short')
+    for argv in ([], ["--json"]):
+        assert event_log.main(["--file", str(path)] + argv) == 0
+        assert "hunter2" not in capsys.readouterr().out
+
+    event_log.main(["--file", str(path), "--slow", "30"])
+    assert capsys.readouterr().out.count("\n") == 1
+
+
+def test_rotated_backups_are_read_oldest_first(tmp_path):
+    path = tmp_path / "install_events.jsonl"
+    (tmp_path / "install_events.jsonl.2").write_text('{"message": "first"}\n')
+    (tmp_path / "install_events.jsonl.1").write_text('{"message": "second"}\n')
+    path.write_text('{"message": "third"}\n')
+    assert [event["message"] for event in event_log.read_events(str(path))] == ["first", "second", "third"]
@@ -0,0 +1,47 @@
+from libs import graphics, hardware
+from libs.hardware import HardwareProfile, PciDevice
+
+INTEL_IGPU = PciDevice("0000:00:02.0", hardware.PCI_VENDOR_INTEL, 0x9a49, 0x030000, "i915")
+NVIDIA_TURING = PciDevice("0000:01:00.0", hardware.PCI_VENDOR_NVIDIA, 0x1f95, 0x030200)
+NVIDIA_PASCAL = PciDevice("0000:01:00.0", hardware.PCI_VENDOR_NVIDIA, 0x1c8d, 0x030200)
+NVIDIA_AUDIO = PciDevice("0000:01:00.1", hardware.PCI_VENDOR_NVIDIA, 0x10fa, 0x040300)
+
+
+def machine(*devices):
+    return HardwareProfile(pci_devices=list(devices))
+
+
+def test_hybrid_intel_nvidia_laptop_gets_prime_offload():
+    plan = graphics.plan_graphics(machine(INTEL_IGPU, NVIDIA_TURING, NVIDIA_AUDIO), ["linux"], multilib=False)
+    assert plan.vendors == ["Intel", "NVIDIA"]
+    assert "nvidia-open" in plan.packages and "intel-media-driver" in plan.packages
+    assert "nvidia-prime" in plan.packages
+    assert plan.modules == ["i915"] + graphics.NVIDIA_MODULES
+    assert plan.kernel_params == graphics.NVIDIA_PARAMS
+    assert plan.removed_hooks == ["kms"]
+
+
+def test_pre_turing_nvidia_falls_back_to_nouveau():
+    plan = graphics.plan_graphics(machine(NVIDIA_PASCAL), ["linux"], multilib=True)
+    assert plan.vendors == ["NVIDIA (nouveau)"]
+    assert "vulkan-nouveau" in plan.packages and "lib32-vulkan-nouveau" in plan.packages
+    assert not any(package.startswith("nvidia") for package in plan.packages)
+    assert plan.modules == ["nouveau"]
+    assert plan.kernel_params == [] and plan.removed_hooks == []
+    assert plan.notes
+
+
+def test_kernels_without_prebuilt_modules_use_dkms():
+    plan = graphics.plan_graphics(machine(NVIDIA_TURING), ["linux", "linux-zen"], multilib=False)
+    assert "nvidia-open-dkms" in plan.packages
+    assert "linux-headers" in plan.packages and "linux-zen-headers" in plan.packages
+    assert "nvidia-open" not in plan.packages
+
+    prebuilt = graphics.plan_graphics(machine(NVIDIA_TURING), ["linux", "linux-lts"], multilib=False)
+    assert "nvidia-open" in prebuilt.packages and "nvidia-open-lts" in prebuilt.packages
+    assert "nvidia-open-dkms" not in prebuilt.packages
+
+
+def test_no_display_controller_means_no_packages():
+    plan = graphics.plan_graphics(machine(NVIDIA_AUDIO), ["linux"], multilib=False)
+    assert plan.packages == [] and plan.report() == "no GPU: no packages"
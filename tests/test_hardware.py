@@ -0,0 +1,86 @@
+from libs import hardware
+from libs.hardware import HardwareProfile
+from libs.system_config import select_optimized_repos
+
+V1 = "fpu cx8 cmov mmx fxsr sse sse2 syscall lm"
+V2 = V1 + " pni ssse3 cx16 sse4_1 sse4_2 popcnt lahf_lm"
+V3 = V2 + " avx avx2 bmi1 bmi2 f16c fma abm movbe xsave"
+V4 = V3 + " avx512f avx512bw avx512cd avx512dq avx512vl"
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def make_root(tmp_path, flags=V3):
+    cpu = f"vendor_id\t: GenuineIntel\nmodel name\t: Test CPU\nflags\t\t: {flags} hypervisor\n\n"
+    write(tmp_path / "proc" / "cpuinfo", "processor\t: 0\n" + cpu + "processor\t: 1\n" + cpu)
+    write(tmp_path / "proc" / "meminfo", "MemTotal: 8000 kB\nMemFree: 2000 kB\nMemAvailable: 4000 kB\n")
+    write(tmp_path / "proc" / "modules", "snd_sof_pci 16384 0 - Live 0x0\nkvm 1 0 - Live 0x0\n")
+    devices = tmp_path / "sys" / "bus" / "pci" / "devices"
+    for slot, vendor, device, pci_class in (("0000:00:02.0", "0x8086", "0x9a49", "0x030000"),
+                                            ("0000:01:00.0", "0x10de", "0x2520", "0x030200"),
+                                            ("0000:02:00.0", "0x10de", "0x228b", "0x040300")):
+        write(devices / slot / "vendor", vendor + "\n")
+        write(devices / slot / "device", device + "\n")
+        write(devices / slot / "class", pci_class + "\n")
+    (tmp_path / "drivers" / "nvidia").mkdir(parents=True)
+    (devices / "0000:01:00.0" / "driver").symlink_to(tmp_path / "drivers" / "nvidia")
+    (tmp_path / "sys" / "class" / "net" / "wlan0" / "wireless").mkdir(parents=True)
+    (tmp_path / "sys" / "class" / "net" / "eth0").mkdir(parents=True)
+    write(tmp_path / "sys" / "devices" / "virtual" / "dmi" / "id" / "sys_vendor", "QEMU\n")
+    write(tmp_path / "sys" / "devices" / "virtual" / "dmi" / "id" / "product_name", "Standard PC\n")
+    (tmp_path / "sys" / "firmware" / "efi").mkdir(parents=True)
+    return tmp_path
+
+
+def test_probe_reads_a_fake_root(tmp_path):
+    profile = HardwareProfile.probe(str(make_root(tmp_path)))
+    assert profile.cpu_vendor == "GenuineIntel"
+    assert profile.cpu_model == "Test CPU"
+    assert profile.cpu_count == 2
+    assert profile.mem_total == 8000 * 1024
+    assert profile.mem_available == 4000 * 1024
+    assert profile.modules == ["snd_sof_pci", "kvm"]
+    assert [device.driver for device in profile.pci_devices] == ["", "nvidia", ""]
+    assert profile.has_nvidia_graphics and profile.has_intel_graphics and not profile.has_amd_graphics
+    assert profile.wifi_interfaces == ["wlan0"]
+    assert profile.uefi
+    assert profile.virtualization == "qemu" and profile.is_vm
+    assert profile.requires_sof_fw and not profile.requires_alsa_fw
+    assert profile.isa_level == 3
+
+
+def test_probe_of_an_empty_root_falls_back_to_defaults(tmp_path):
+    profile = HardwareProfile.probe(str(tmp_path))
+    assert profile.cpu_flags == []
+    assert profile.pci_devices == []
+    assert profile.virtualization == "none"
+    assert not profile.uefi
+    assert profile.isa_level == 0
+
+
+def test_profile_round_trips_through_json(tmp_path):
+    profile = HardwareProfile.probe(str(make_root(tmp_path)))
+    profile.save(str(tmp_path / "profile.json"))
+    loaded = HardwareProfile.load(str(tmp_path / "profile.json"))
+    assert loaded.to_dict() == profile.to_dict()
+    assert loaded.has_nvidia_graphics
+
+
+def test_isa_level_from_flags():
+    assert hardware.isa_level_from_flags(set(V1.split())) == 1
+    assert hardware.isa_level_from_flags(set(V2.split())) == 2
+    assert hardware.isa_level_from_flags(set(V3.split())) == 3
+    assert hardware.isa_level_from_flags(set(V4.split())) == 4
+    # Levels are cumulative: AVX-512 without the v2 flags is still v1
+    assert hardware.isa_level_from_flags(set(V1.split()) | hardware.ISA_LEVEL_FLAGS[4]) == 1
+    assert hardware.isa_level_from_flags(set()) == 0
+
+
+def test_select_optimized_repos_picks_the_highest_supported_level():
+    assert [name for name, _ in select_optimized_repos(4)] == ["cachyos-v4", "cachyos-core-v4", "cachyos-extra-v4"]
+    assert [name for name, _ in select_optimized_repos(3)] == ["cachyos-v3", "cachyos-core-v3", "cachyos-extra-v3"]
+    assert select_optimized_repos(2) == []
+    assert select_optimized_repos(4, {3: [("v3", "list")]}) == [("v3", "list")]
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from libs.install_plan import InstallPlan, PlanStep
+
+
+def recorder(log, name, delay=0.0):
+    def step():
+        log.append(("start", name))
+        time.sleep(delay)
+        log.append(("end", name))
+    return step
+
+
+def test_dependencies_and_missing_artifacts():
+    plan = InstallPlan(provided={"mounted"})
+    plan.add_step(PlanStep("a", None, inputs={"mounted"}, outputs={"x"}))
+    plan.add_step(PlanStep("b", None, inputs={"x"}, outputs={"y"}))
+    assert plan.dependencies() == {"a": set(), "b": {"a"}}
+    assert plan.topological_order() == ["a", "b"]
+    plan.add_step(PlanStep("c", None, inputs={"nowhere"}))
+    with pytest.raises(ValueError, match="nowhere"):
+        plan.dependencies()
+    with pytest.raises(ValueError):
+        plan.add_step(PlanStep("a", None))
+
+
+def test_cycles_are_rejected_before_anything_runs():
+    plan = InstallPlan()
+    plan.add_step(PlanStep("a", lambda: pytest.fail("ran"), inputs={"y"}, outputs={"x"}))
+    plan.add_step(PlanStep("b", lambda: pytest.fail("ran"), inputs={"x"}, outputs={"y"}))
+    with pytest.raises(ValueError, match="cycle"):
+        plan.run()
+
+
+def test_independent_steps_run_at_the_same_time():
+    barrier = threading.Barrier(2, timeout=5)
+    plan = InstallPlan(max_workers=2)
+    plan.add_step(PlanStep("a", barrier.wait))
+    plan.add_step(PlanStep("b", barrier.wait))
+    # Each step only returns once the other one is running too
+    assert plan.run() == []
+
+
+def test_steps_wait_for_their_inputs_and_report_events():
+    log, events = [], []
+    plan = InstallPlan(max_workers=4)
+    plan.add_step(PlanStep("fetch", recorder(log, "fetch", 0.05), outputs={"data"}))
+    plan.add_step(PlanStep("use", recorder(log, "use"), inputs={"data"}))
+    assert plan.run(on_event=lambda event, step: events.append((event, step.name))) == []
+    assert log.index(("end", "fetch")) < log.index(("start", "use"))
+    assert events == [("start", "fetch"), ("done", "fetch"), ("start", "use"), ("done", "use")]
+
+
+def test_exclusive_resources_never_overlap():
+    log = []
+    plan = InstallPlan(max_workers=4)
+    for name in ("a", "b", "c"):
+        plan.add_step(PlanStep(name, recorder(log, name, 0.02), resources={"pacman"}))
+    assert plan.run() == []
+    # Every start is directly followed by its own end
+    assert all(log[idx][0] == "start" and log[idx + 1] == ("end", log[idx][1]) for idx in range(0, len(log), 2))
+
+
+def test_a_failure_stops_scheduling_new_steps():
+    def boom():
+        raise RuntimeError("pacstrap failed")
+    plan = InstallPlan(max_workers=1)
+    plan.add_step(PlanStep("install", boom, outputs={"base"}, estimate=10))
+    plan.add_step(PlanStep("other", lambda: pytest.fail("started after a failure")))
+    plan.add_step(PlanStep("configure", lambda: pytest.fail("dependent ran"), inputs={"base"}))
+    failed = plan.run()
+    assert [step.name for step in failed] == ["install"]
+    assert str(failed[0].error) == "pacstrap failed"
+
+
+def test_the_longest_chain_starts_first():
+    log = []
+    plan = InstallPlan(max_workers=1)
+    # "a-short" sorts first by name, but "z-long" heads the chain with the most work behind it
+    plan.add_step(PlanStep("a-short", recorder(log, "a-short"), estimate=5))
+    plan.add_step(PlanStep("z-long", recorder(log, "z-long"), outputs={"base"}, estimate=2))
+    plan.add_step(PlanStep("configure", recorder(log, "configure"), inputs={"base"}, estimate=10))
+    assert plan.priorities() == {"a-short": 5, "z-long": 12, "configure": 10}
+    assert plan.run() == []
+    assert [name for event, name in log if event == "start"] == ["z-long", "configure", "a-short"]
+
+
+def test_critical_path_follows_the_measured_durations():
+    plan = InstallPlan()
+    for name, inputs, outputs, duration in [("mirrors", (), {"m"}, 3), ("pacstrap", {"m"}, {"base"}, 60),
+                                            ("aur", {"m"}, {"aur"}, 90), ("fstab", {"base"}, (), 1),
+                                            ("finish", {"base", "aur"}, (), 5)]:
+        step = plan.add_step(PlanStep(name, None, inputs=inputs, outputs=outputs))
+        step.started, step.finished = 0.0, float(duration)
+    assert plan.critical_path() == (["mirrors", "aur", "finish"], 98.0)
+    assert plan.total_step_time() == 159.0
+    assert InstallPlan().critical_path() == ([], 0.0)
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from libs import install_session
+from libs.install_session import DEFERRED_HOOKS, InstallSession
+from libs.packages import PackageTransaction
+
+
+@pytest.fixture
+def transaction(monkeypatch):
+    transaction = PackageTransaction()
+    monkeypatch.setattr(install_session, "transaction", transaction)
+    return transaction
+
+
+@pytest.fixture
+def session(tmp_path, transaction):
+    return InstallSession(root=str(tmp_path / "mnt"), host_hook_dir=str(tmp_path / "hooks"))
+
+
+def test_host_hooks_are_masked_and_restored(session, tmp_path, transaction):
+    hooks = tmp_path / "hooks"
+    hooks.mkdir()
+    (hooks / "05-snap-pac-pre.hook").write_text("[Trigger]\n")  # The user's own override
+    with session:
+        assert session.mask_target_hooks in transaction.before_commit
+        for hook in DEFERRED_HOOKS:
+            if hook != "05-snap-pac-pre.hook":
+                assert os.readlink(hooks / hook) == "/dev/null"
+    assert sorted(os.listdir(hooks)) == ["05-snap-pac-pre.hook"]
+    assert (hooks / "05-snap-pac-pre.hook").read_text() == "[Trigger]\n"
+    assert transaction.before_commit == []
+
+
+def test_target_hooks_are_masked_only_once_it_is_mounted(session, tmp_path, monkeypatch):
+    target_hooks = tmp_path / "mnt" / "etc/pacman.d/hooks"
+    session.begin()
+    session.mask_target_hooks()
+    assert not target_hooks.exists()
+    monkeypatch.setattr(install_session.os.path, "ismount", lambda path: True)
+    session.mask_target_hooks()
+    session.mask_target_hooks()  # Runs before every transaction; the masks are made once
+    assert sorted(os.listdir(target_hooks)) == sorted(DEFERRED_HOOKS)
+    assert len(session.masks) == 2 * len(DEFERRED_HOOKS)
+    session.end()
+    assert os.listdir(target_hooks) == []
+
+
+def test_kernels_are_installed_once_at_the_end(session, tmp_path, transaction, monkeypatch):
+    for version in ("6.10.1-arch1-1", "6.6.40-1-lts"):
+        (tmp_path / "mnt" / "usr/lib/modules" / version).mkdir(parents=True)
+        (tmp_path / "mnt" / "usr/lib/modules" / version / "vmlinuz").write_bytes(b"")
+    installed = []
+    monkeypatch.setattr(session, "install_kernel", installed.append)
+    transaction.committed_batches.extend([["base", "linux"], ["linux-lts"], ["nano"]])
+    with session:
+        pass
+    assert installed == ["usr/lib/modules/6.10.1-arch1-1/vmlinuz", "usr/lib/modules/6.6.40-1-lts/vmlinuz"]
+    assert session.hook_runs_deferred == {"mkinitcpio": 2, "snapshots": 0}
+
+
+def test_nothing_is_rebuilt_without_a_kernel_transaction(session, transaction, monkeypatch):
+    monkeypatch.setattr(session, "rebuild_initramfs", lambda: pytest.fail("rebuilt"))
+    transaction.committed_batches.append(["nano"])
+    with session:
+        pass
+    assert session.report().startswith("Deferred 0 initramfs rebuild(s)")
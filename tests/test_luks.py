@@ -0,0 +1,79 @@
+import os
+import shutil
+
+import pytest
+
+from libs.disks import luks
+from libs.disks.partitions import DiskTopology, GiB
+
+BENCHMARK = """\
+# Tests are approximate using memory only (no storage IO).
+PBKDF2-sha1      1791002 iterations per second for 256-bit key
+argon2id     10 iterations, 1048576 memory, 4 parallel threads (CPUs) for 256-bit key (requested 2000 ms time)
+#     Algorithm |       Key |      Encryption |      Decryption
+        aes-cbc        128b      1234.5 MiB/s      4000.1 MiB/s
+        aes-xts        256b      3500.0 MiB/s      3600.0 MiB/s
+        aes-xts        512b      3400.0 MiB/s      3450.0 MiB/s
+    serpent-xts        512b       800.0 MiB/s       790.0 MiB/s
+"""
+
+
+@pytest.fixture
+def disk_size(monkeypatch):
+    sizes = {}
+    monkeypatch.setattr(luks.partitions.DiskTopology, "read",
+                        classmethod(lambda cls, device, root="/": DiskTopology(device, sizes.get(device, 0))))
+    return sizes
+
+
+def test_parse_benchmark_keeps_only_xts_ciphers():
+    ciphers, argon2 = luks.parse_benchmark(BENCHMARK)
+    assert ciphers == [("aes-xts", 256, 3500.0, 3600.0), ("aes-xts", 512, 3400.0, 3450.0),
+                       ("serpent-xts", 512, 800.0, 790.0)]
+    assert argon2 == (10, 1048576, 4, 2000)
+
+
+def test_parse_benchmark_of_unexpected_output():
+    assert luks.parse_benchmark("cryptsetup: command not found") == ([], None)
+
+
+def test_choose_cipher_prefers_the_larger_key_unless_clearly_slower():
+    ciphers, _ = luks.parse_benchmark(BENCHMARK)
+    assert luks.choose_cipher(ciphers) == ("aes-xts-plain64", 512, 3400.0)
+    slow_512 = [("aes-xts", 256, 3500.0, 3600.0), ("aes-xts", 512, 3000.0, 3100.0)]
+    assert luks.choose_cipher(slow_512) == ("aes-xts-plain64", 256, 3500.0)
+    assert luks.choose_cipher([]) == ("aes-xts-plain64", 512, None)
+
+
+def test_plan_luks_for_flash_with_plenty_of_memory(disk_size):
+    disk_size["/dev/nvme0n1p2"] = 100 * GiB
+    plan = luks.plan_luks("/dev/nvme0n1p2", BENCHMARK, mem_available=8 * GiB, rotational=False, cpu_count=8)
+    assert (plan.cipher, plan.key_size, plan.sector_size) == ("aes-xts-plain64", 512, 4096)
+    assert (plan.pbkdf_memory, plan.pbkdf_parallel, plan.pbkdf_iterations) == (luks.ARGON2_MAX_MEMORY, 4, 10)
+    assert plan.open_args() == ["--perf-no_read_workqueue", "--perf-no_write_workqueue", "--persistent"]
+    assert plan.format_args()[plan.format_args().index("--sector-size") + 1] == "4096"
+
+
+def test_plan_luks_scales_iterations_to_the_memory_it_can_use(disk_size):
+    disk_size["/dev/sda2"] = 100 * GiB + 512
+    plan = luks.plan_luks("/dev/sda2", BENCHMARK, mem_available=GiB, rotational=True, cpu_count=2)
+    # A quarter of the benchmark's memory and half its lanes: the same work takes 10 x 4 / 2 passes
+    assert (plan.pbkdf_memory, plan.pbkdf_parallel, plan.pbkdf_iterations) == (256 * 1024, 2, 20)
+    assert plan.sector_size == 512  # Not a multiple of 4 KiB
+    assert plan.perf_flags == [] and plan.open_args() == []
+
+
+def test_plan_luks_without_argon2_results(disk_size):
+    plan = luks.plan_luks("/dev/sdb1", "", mem_available=128 * 1024 ** 2, rotational=True, cpu_count=1)
+    assert plan.cipher == "aes-xts-plain64" and plan.throughput is None
+    assert (plan.pbkdf_memory, plan.pbkdf_iterations, plan.pbkdf_parallel) == (luks.ARGON2_MIN_MEMORY,
+                                                                               luks.ARGON2_MIN_ITERATIONS, 1)
+    assert "dm-crypt workqueues kept" in plan.report()
+
+
+@pytest.mark.skipif(os.geteuid() != 0 or shutil.which("cryptsetup") is None,
+                    reason="formatting a loop device needs root and cryptsetup")
+def test_tuned_settings_reach_the_luks2_header(tmp_path):
+    plan, missing = luks.verify_luks_tuning(image=str(tmp_path / "luks.img"))
+    assert missing == [], plan.report()
+    assert not (tmp_path / "luks.img").exists()
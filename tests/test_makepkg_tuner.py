@@ -0,0 +1,72 @@
+import pytest
+
+from libs import chroot, makepkg_tuner
+from libs.makepkg_tuner import MakepkgTuning, get_variable, plan_makepkg_tuning, set_variable, tune_makepkg_text
+
+GiB = 1024 ** 3
+
+STOCK = """#!/hint/bash
+#-- Compiler and Linker Flags
+CFLAGS="-march=x86-64 -mtune=generic -O2 -pipe -fno-plt -fexceptions \\
+        -Wp,-D_FORTIFY_SOURCE=3 -Wformat -Werror=format-security"
+CXXFLAGS="$CFLAGS -Wp,-D_GLIBCXX_ASSERTIONS"
+#-- Make Flags: change this for DistCC/SMP systems
+#MAKEFLAGS="-j2"
+#-- Specify a directory for package building.
+#BUILDDIR=/tmp/makepkg
+COMPRESSZST=(zstd -c -z -q -)
+"""
+
+
+def test_get_variable_reads_quoted_arrays_and_multiline_values():
+    assert get_variable(STOCK, "COMPRESSZST") == "(zstd -c -z -q -)"
+    assert get_variable(STOCK, "CFLAGS").endswith('-Werror=format-security"')
+    assert "\\\n" in get_variable(STOCK, "CFLAGS")
+    assert get_variable(STOCK, "MAKEFLAGS") is None
+    assert get_variable(STOCK, "BUILDDIR") is None
+
+
+def test_set_variable_replaces_active_then_commented_then_appends():
+    assert get_variable(set_variable(STOCK, "COMPRESSZST", "(zstd -T0 -)"), "COMPRESSZST") == "(zstd -T0 -)"
+    text = set_variable(STOCK, "MAKEFLAGS", '"-j8"')
+    assert '\nMAKEFLAGS="-j8"\n' in text and "#MAKEFLAGS" not in text
+    assert set_variable("A=1", "B", "2") == "A=1\nB=2\n"
+    assert set_variable(set_variable(STOCK, "MAKEFLAGS", '"-j8"'), "MAKEFLAGS", '"-j8"') == text
+
+
+def test_plan_limits_jobs_by_memory_and_picks_the_isa_level():
+    plan = plan_makepkg_tuning(cores=16, memory=8 * GiB, level=3)
+    assert (plan.jobs, plan.cpu_target, plan.builddir) == (4, "x86-64-v3", None)
+    plan = plan_makepkg_tuning(cores=4, memory=32 * GiB, level=1)
+    assert (plan.jobs, plan.cpu_target, plan.builddir) == (4, "x86-64", makepkg_tuner.BUILDDIR)
+    assert plan_makepkg_tuning(cores=4, memory=GiB, level=2, native=True).cpu_target == "native"
+    assert plan_makepkg_tuning(cores=4, memory=GiB, level=0).cpu_target is None
+    assert plan_makepkg_tuning(cores=4, memory=GiB, level=2).jobs == 1
+
+
+def test_tune_makepkg_text_edits_a_stock_config():
+    tuned = tune_makepkg_text(STOCK, MakepkgTuning(6, "x86-64-v3", "/tmp/makepkg"))
+    assert get_variable(tuned, "MAKEFLAGS") == '"-j6"'
+    assert get_variable(tuned, "COMPRESSZST") == "(zstd -c -z -q -T0 -)"
+    assert get_variable(tuned, "BUILDDIR") == "/tmp/makepkg"
+    cflags = get_variable(tuned, "CFLAGS")
+    assert cflags.startswith('"-march=x86-64-v3 -mtune=generic -O2')
+    # The line continuation of the stock CFLAGS survives
+    assert "\\\n        -Wp,-D_FORTIFY_SOURCE=3" in cflags
+    assert 'CXXFLAGS="$CFLAGS -Wp,-D_GLIBCXX_ASSERTIONS"' in tuned
+    assert tune_makepkg_text(tuned, MakepkgTuning(6, "x86-64-v3", "/tmp/makepkg")) == tuned
+
+
+def test_tune_makepkg_text_without_a_cpu_target_keeps_cflags():
+    tuned = tune_makepkg_text("COMPRESSZST=(zstd -c -T4 -)\n", MakepkgTuning(2, None))
+    assert get_variable(tuned, "COMPRESSZST") == "(zstd -c -T0 -)"
+    assert get_variable(tuned, "CFLAGS") is None and get_variable(tuned, "BUILDDIR") is None
+    native = tune_makepkg_text('CFLAGS="-O2"\n', MakepkgTuning(2, "native"))
+    assert get_variable(native, "CFLAGS") == '"-mtune=native -march=native -O2"'
+
+
+def test_tune_makepkg_never_touches_the_live_system(monkeypatch):
+    monkeypatch.setattr(chroot.utils, "is_inside_chroot", lambda: False)
+    monkeypatch.setattr(makepkg_tuner, "apply_makepkg_tuning", lambda tuning: pytest.fail("tuned the host"))
+    with pytest.raises(Exception, match="No target system"):
+        makepkg_tuner.tune_makepkg()
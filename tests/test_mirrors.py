@@ -0,0 +1,147 @@
+import functools
+import json
+import os
+import time
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from libs import mirrors
+from libs.mirrors import MirrorResult
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThrottledHandler(QuietHandler):
+    """Sends the body in 16 KiB pieces about 20 ms apart, like a distant mirror."""
+    def copyfile(self, source, outputfile):
+        while True:
+            chunk = source.read(16 * 1024)
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            outputfile.flush()
+            time.sleep(0.02)
+
+
+def serve_mirror(root, handler):
+    (root / "core/os/x86_64").mkdir(parents=True)
+    (root / "core/os/x86_64/core.db").write_bytes(b"d" * (mirrors.TEST_BYTES * 2))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/$repo/os/$arch"
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    """A local mirror serving a core.db larger than the benchmark reads."""
+    server, url = serve_mirror(tmp_path / "mirror", QuietHandler)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def slow_mirror(tmp_path):
+    server, url = serve_mirror(tmp_path / "slow-mirror", ThrottledHandler)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+def test_read_mirrorlist_includes_commented_servers(tmp_path):
+    path = tmp_path / "mirrorlist"
+    path.write_text("## Germany\n#Server = https://a.example/$repo/os/$arch\n"
+                    "Server = https://b.example/$repo/os/$arch\nServer = https://b.example/$repo/os/$arch\n")
+    assert mirrors.read_mirrorlist(str(path)) == ["https://a.example/$repo/os/$arch", "https://b.example/$repo/os/$arch"]
+    assert mirrors.read_mirrorlist(str(tmp_path / "missing")) == []
+
+
+def test_benchmark_against_a_local_mirror(mirror):
+    broken = mirror.replace("$repo/os/$arch", "missing/$repo")
+    good, missing = mirrors.benchmark_mirrors([mirror, broken], timeout=2)
+    assert good.ok and good.url == mirror and good.latency >= 0 and good.throughput > 0
+    assert not missing.ok and "404" in missing.error
+    assert mirrors.sort_results([missing, good]) == [good]
+
+
+def test_ranking_puts_the_fast_mirror_first(mirror, slow_mirror, tmp_path, monkeypatch):
+    monkeypatch.setattr(mirrors, "last_ranked", [])
+    ranked = mirrors.rank_mirrors([slow_mirror, mirror], cache_file=str(tmp_path / "mirrors.json"), timeout=5)
+    assert [result.url for result in ranked] == [mirror, slow_mirror]
+    # 256 KiB in 16 throttled pieces takes at least 0.3 s; the local server needs a few milliseconds
+    assert ranked[1].throughput < mirrors.TEST_BYTES / 0.3
+    assert ranked[0].throughput / ranked[1].throughput > 5
+    assert mirrors.ranked_mirrors() == ranked
+
+
+def test_sort_results_by_throughput_then_latency():
+    slow = MirrorResult("slow", 0.01, 1000)
+    fast_far = MirrorResult("fast-far", 0.3, 5000)
+    fast_near = MirrorResult("fast-near", 0.05, 5000)
+    failed = MirrorResult("failed", error="timeout")
+    assert [r.url for r in mirrors.sort_results([slow, failed, fast_far, fast_near])] == ["fast-near", "fast-far", "slow"]
+
+
+def test_cache_round_trip_and_expiry(tmp_path):
+    cache = str(tmp_path / "mirrors.json")
+    results = [MirrorResult("a", 0.1, 2048), MirrorResult("b", error="timeout")]
+    mirrors.save_cached_results(["a", "b"], results, cache)
+    loaded = mirrors.load_cached_results(["b", "a"], cache)
+    assert [result.to_dict() for result in loaded] == [result.to_dict() for result in reversed(results)]
+    assert mirrors.load_cached_results(["a", "c"], cache) is None
+    assert mirrors.load_cached_results(["a", "b"], cache, ttl=-1) is None
+    assert mirrors.cached_best_throughput(cache) == 2048
+    assert mirrors.cached_best_throughput(str(tmp_path / "missing.json")) is None
+
+
+def test_cache_answers_for_the_ranked_subset_only(tmp_path):
+    cache = str(tmp_path / "mirrors.json")
+    mirrors.save_cached_results(["a", "b", "c"], [MirrorResult("a", 0.1, 2048), MirrorResult("b", 0.1, 1024),
+                                                  MirrorResult("evil", 0.1, 10 ** 9)], cache)
+    # The rewritten mirrorlist holds the fastest of the benchmarked servers
+    assert [result.url for result in mirrors.load_cached_results(["a"], cache)] == ["a"]
+    assert [result.url for result in mirrors.load_cached_results(["a", "b", "c"], cache)] == ["a", "b"]
+
+
+def test_cache_outside_a_private_directory_is_ignored(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o777)
+    shared.chmod(0o777)
+    cache = str(shared / "mirrors.json")
+    mirrors.save_cached_results(["a"], [MirrorResult("a", 0.1, 2048)], cache)
+    assert not os.path.exists(cache)
+    with open(cache, "w") as f:
+        json.dump({"timestamp": time.time(), "servers": ["a"], "results": [{"url": "a", "throughput": 1}]}, f)
+    assert mirrors.load_cached_results(["a"], cache) is None
+
+
+def test_rank_mirrors_reuses_a_fresh_benchmark(tmp_path, monkeypatch):
+    monkeypatch.setattr(mirrors, "last_ranked", [])
+    cache = str(tmp_path / "mirrors.json")
+    mirrors.save_cached_results(["a"], [MirrorResult("a", 0.1, 2048)], cache)
+    monkeypatch.setattr(mirrors, "benchmark_mirrors", lambda servers, **kwargs: pytest.fail("benchmarked again"))
+    assert [result.url for result in mirrors.rank_mirrors(["a"], cache_file=cache)] == ["a"]
+
+
+def test_write_mirrorlist_keeps_the_fastest(tmp_path):
+    path = tmp_path / "etc" / "pacman.d" / "mirrorlist"
+    ranked = [MirrorResult(f"https://m{idx}.example/$repo/os/$arch", 0.02, 4096 * (3 - idx)) for idx in range(3)]
+    mirrors.write_mirrorlist(ranked, str(path), count=2)
+    lines = path.read_text().splitlines()
+    assert lines[0].startswith("## Ranked by arch-install")
+    assert lines[1:] == ["## 12 KiB/s, 20 ms", "Server = https://m0.example/$repo/os/$arch",
+                         "## 8 KiB/s, 20 ms", "Server = https://m1.example/$repo/os/$arch"]
+    assert mirrors.read_mirrorlist(str(path)) == [result.url for result in ranked[:2]]
+
+
+def test_rank_and_write_keeps_the_mirrorlist_when_nothing_answers(tmp_path, monkeypatch):
+    path = tmp_path / "mirrorlist"
+    path.write_text("Server = https://old.example/$repo/os/$arch\n")
+    monkeypatch.setattr(mirrors, "rank_mirrors", lambda: [])
+    assert mirrors.rank_and_write_mirrorlists(targets=(str(path),)) == []
+    assert path.read_text() == "Server = https://old.example/$repo/os/$arch\n"
@@ -0,0 +1,132 @@
+import errno
+import hashlib
+import os
+
+import pytest
+
+from libs import package_cache
+from libs.package_cache import SeedResult
+from libs.sync_db import SyncIndex
+
+
+def index_for(sync_dir, tmp_path):
+    return SyncIndex(str(sync_dir), str(tmp_path / "cache"), str(tmp_path / "pacman.conf"))
+
+
+def test_requested_packages_include_dependencies(sync_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(package_cache, "index", index_for(sync_dir, tmp_path))
+    assert package_cache.requested_packages(["base"]) == [
+        "base", "bash", "filesystem", "glibc", "linux-api-headers", "readline"]
+
+
+def test_requested_packages_without_sync_databases(tmp_path, monkeypatch):
+    monkeypatch.setattr(package_cache, "index", index_for(tmp_path / "empty", tmp_path))
+    assert package_cache.requested_packages(["base", "nano"]) == ["base", "nano"]
+
+
+def test_hit_rate_counts_the_dependency_closure(sync_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(package_cache, "index", index_for(sync_dir, tmp_path))
+    result = SeedResult()
+    result.requested = package_cache.requested_packages(["base"])
+    result.seeded = {"base-1.0-1-x86_64.pkg.tar.zst": 2000, "glibc-2.40-1-x86_64.pkg.tar.zst": 10000,
+                     "nano-1.0-1-x86_64.pkg.tar.zst": 600}
+    # Only base and glibc of the six packages pacstrap downloads were cached; nano is not requested
+    assert result.hit_rate() == 2 / 6
+    assert result.bytes_saved() == 12000
+
+
+def test_package_name():
+    assert package_cache.package_name("linux-api-headers-6.10-1-any.pkg.tar.zst") == "linux-api-headers"
+
+
+class FakeIndex:
+    def __init__(self, checksums):
+        self.sums = checksums
+
+    def closure(self, names):
+        return set(names), []
+
+    def checksums(self):
+        return self.sums
+
+
+def write_package(directory, filename, data):
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / filename).write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def raising(code, calls=None):
+    def fail(*args):
+        if calls is not None:
+            calls.append(args)
+        raise OSError(code, os.strerror(code))
+    return fail
+
+
+def test_clone_file_on_the_same_file_system(tmp_path):
+    (tmp_path / "a.pkg").write_bytes(b"package")
+    method = package_cache.clone_file(str(tmp_path / "a.pkg"), str(tmp_path / "b.pkg"))
+    assert method in ("reflink", "hardlink")
+    assert (tmp_path / "b.pkg").read_bytes() == b"package"
+
+
+def test_clone_file_falls_back_when_reflinks_are_unsupported(tmp_path, monkeypatch):
+    (tmp_path / "a.pkg").write_bytes(b"package")
+    calls = []
+    monkeypatch.setattr(package_cache.fcntl, "ioctl", raising(errno.EXDEV, calls))
+    assert package_cache.clone_file(str(tmp_path / "a.pkg"), str(tmp_path / "b.pkg")) == "hardlink"
+    assert calls, "FICLONE was not tried"
+    monkeypatch.setattr(package_cache.os, "link", raising(errno.EXDEV))
+    monkeypatch.setattr(package_cache.fcntl, "ioctl", raising(errno.EOPNOTSUPP))
+    assert package_cache.clone_file(str(tmp_path / "a.pkg"), str(tmp_path / "c.pkg")) == "copy"
+    assert (tmp_path / "c.pkg").read_bytes() == b"package"
+
+
+def test_clone_file_reports_real_errors(tmp_path, monkeypatch):
+    (tmp_path / "a.pkg").write_bytes(b"package")
+    monkeypatch.setattr(package_cache.fcntl, "ioctl", raising(errno.ENOSPC))
+    with pytest.raises(OSError):
+        package_cache.clone_file(str(tmp_path / "a.pkg"), str(tmp_path / "b.pkg"))
+    assert not (tmp_path / "b.pkg").exists()
+
+
+def test_verify_package_by_checksum_and_signature(tmp_path, monkeypatch):
+    digest = write_package(tmp_path, "nano-1.0-1-x86_64.pkg.tar.zst", b"nano")
+    path = str(tmp_path / "nano-1.0-1-x86_64.pkg.tar.zst")
+    assert package_cache.verify_package(path, {"nano-1.0-1-x86_64.pkg.tar.zst": digest})
+    assert not package_cache.verify_package(path, {"nano-1.0-1-x86_64.pkg.tar.zst": "0" * 64})
+    assert not package_cache.verify_package(path, {})
+    (tmp_path / "nano-1.0-1-x86_64.pkg.tar.zst.sig").write_bytes(b"sig")
+    verified = []
+    monkeypatch.setattr(package_cache.subprocess, "run", lambda args, **kwargs: verified.append(args) or
+                        package_cache.subprocess.CompletedProcess(args, 1))
+    # A signature takes precedence, and a bad one is not rescued by the checksum
+    assert not package_cache.verify_package(path, {"nano-1.0-1-x86_64.pkg.tar.zst": digest})
+    assert verified == [["pacman-key", "--verify", path + ".sig", path]]
+
+
+def test_seed_package_cache(tmp_path, monkeypatch):
+    host = tmp_path / "host"
+    good = write_package(host, "base-1.0-1-x86_64.pkg.tar.zst", b"b" * 2000)
+    write_package(host, "nano-1.0-1-x86_64.pkg.tar.zst", b"tampered")
+    write_package(host, "glibc-1.0-1-x86_64.pkg.tar.zst", b"g" * 100)
+    write_package(tmp_path / "root" / "var/cache/pacman/pkg", "glibc-1.0-1-x86_64.pkg.tar.zst", b"g" * 100)
+    monkeypatch.setattr(package_cache, "index", FakeIndex({"base-1.0-1-x86_64.pkg.tar.zst": good,
+                                                           "nano-1.0-1-x86_64.pkg.tar.zst": "0" * 64}))
+    monkeypatch.setattr(package_cache.transaction, "pending", lambda: ["base", "glibc", "nano", "vim"])
+    monkeypatch.setattr(package_cache, "copy_sync_databases", lambda root: 0)
+    result = package_cache.seed_package_cache([str(host), str(tmp_path / "missing")], root=str(tmp_path / "root"),
+                                              workers=2)
+    assert result.seeded == {"base-1.0-1-x86_64.pkg.tar.zst": 2000}
+    assert result.rejected == ["nano-1.0-1-x86_64.pkg.tar.zst"]
+    assert result.skipped == 1
+    assert sum(result.methods.values()) == 1
+    assert (tmp_path / "root/var/cache/pacman/pkg/base-1.0-1-x86_64.pkg.tar.zst").read_bytes() == b"b" * 2000
+    assert not (tmp_path / "root/var/cache/pacman/pkg/nano-1.0-1-x86_64.pkg.tar.zst").exists()
+    assert result.hit_rate() == 1 / 4
+
+
+def test_copy_sync_databases(sync_dir, tmp_path):
+    assert package_cache.copy_sync_databases(str(tmp_path / "root"), str(sync_dir)) == 1
+    assert (tmp_path / "root" / str(sync_dir).lstrip("/") / "core.db").exists()
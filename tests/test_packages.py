@@ -0,0 +1,54 @@
+from libs import packages
+from libs.packages import PackageTransaction, estimate_hook_runs
+
+
+def test_estimate_hook_runs():
+    batches = [["base", "linux"], ["snap-pac", "snapper"], ["nano"], ["linux-firmware-intel"], ["vim"]]
+    # Kernel and firmware batches rebuild the initramfs; every transaction after snap-pac takes two snapshots
+    assert estimate_hook_runs(batches) == {"mkinitcpio": 2, "snapshots": 6}
+    assert estimate_hook_runs([]) == {"mkinitcpio": 0, "snapshots": 0}
+    assert estimate_hook_runs([["base", "linux", "amd-ucode", "snap-pac"]]) == {"mkinitcpio": 1, "snapshots": 0}
+
+
+def committed(transaction, monkeypatch):
+    commands = []
+    monkeypatch.setattr(packages.chroot, "active_session", lambda: None)
+    monkeypatch.setattr(packages.utils, "run_command", lambda command: commands.append(command))
+    transaction.commit()
+    return commands
+
+
+def test_queued_requests_become_one_transaction(monkeypatch):
+    transaction = PackageTransaction(root="/target")
+    transaction.add("base linux", "Essential packages")
+    transaction.add(["linux", "intel-ucode"], "Microcode")
+    transaction.add(["snap-pac"], "Snapshots")
+    transaction.add(["firefox"], "Desktop")
+    assert transaction.pending() == ["base", "linux", "intel-ucode", "snap-pac", "firefox"]
+    commands = committed(transaction, monkeypatch)
+    assert commands == ["pacstrap /target base linux intel-ucode snap-pac firefox"]
+    assert transaction.pending() == [] and transaction.commit() is None
+    # Four separate transactions would have rebuilt the initramfs twice and taken two snapshots after snap-pac
+    assert transaction.savings() == {"requests": 4, "transactions": 1, "transactions_saved": 3,
+                                     "mkinitcpio_saved": 1, "snapshots_saved": 2}
+    assert transaction.report().startswith("4 package requests installed in 1 transaction(s)")
+
+
+def test_commit_callbacks_surround_the_transaction(monkeypatch):
+    transaction = PackageTransaction()
+    calls = []
+    transaction.before_commit.append(lambda: calls.append("before"))
+    transaction.after_commit.append(lambda: calls.append("after"))
+    transaction.add(["base"])
+    monkeypatch.setattr(packages.chroot, "active_session", lambda: None)
+    monkeypatch.setattr(packages.utils, "run_command", lambda command: calls.append("install"))
+    transaction.commit()
+    assert calls == ["before", "install", "after"]
+
+
+def test_discard_drops_only_the_steps_own_packages():
+    transaction = PackageTransaction()
+    transaction.add(["linux", "tuned"], "Power")
+    transaction.add(["linux", "nano"], "Editor")
+    transaction.discard("Power")
+    assert transaction.pending() == ["linux", "nano"]
@@ -0,0 +1,179 @@
+import os
+
+import pytest
+
+from libs import pacman_conf
+from libs.pacman_conf import PacmanConf
+
+STOCK = """#
+# /etc/pacman.conf
+#
+# See the pacman.conf(5) manpage for option and repository directives
+
+#
+# GENERAL OPTIONS
+#
+[options]
+# The following paths are commented out with their default values listed.
+# If you wish to use different paths, uncomment and update the paths.
+#RootDir     = /
+#DBPath      = /var/lib/pacman/
+#CacheDir    = /var/cache/pacman/pkg/
+#LogFile     = /var/log/pacman.log
+#GPGDir      = /etc/pacman.d/gnupg/
+#HookDir     = /etc/pacman.d/hooks/
+HoldPkg     = pacman glibc
+#XferCommand = /usr/bin/curl -L -C - -f -o %o %u
+#XferCommand = /usr/bin/wget --passive-ftp -c -O %o %u
+#CleanMethod = KeepInstalled
+Architecture = auto
+
+# Pacman won't upgrade packages listed in IgnorePkg and members of IgnoreGroup
+#IgnorePkg   =
+#IgnoreGroup =
+
+#NoUpgrade   =
+#NoExtract   =
+
+# Misc options
+#UseSyslog
+#Color
+#NoProgressBar
+CheckSpace
+#VerbosePkgLists
+#ParallelDownloads = 5
+DownloadUser = alpm
+#DisableSandbox
+
+# By default, pacman accepts packages signed by keys that its local keyring
+# trusts (see pacman-key and its man page), as well as unsigned packages.
+SigLevel    = Required DatabaseOptional
+LocalFileSigLevel = Optional
+#RemoteFileSigLevel = Required
+
+#
+# REPOSITORIES
+#
+#[core-testing]
+#Include = /etc/pacman.d/mirrorlist
+
+[core]
+Include = /etc/pacman.d/mirrorlist
+
+#[extra-testing]
+#Include = /etc/pacman.d/mirrorlist
+
+[extra]
+Include = /etc/pacman.d/mirrorlist
+
+# If you want to run 32 bit applications on your x86_64 system,
+# enable the multilib repositories as required here.
+
+#[multilib-testing]
+#Include = /etc/pacman.d/mirrorlist
+
+#[multilib]
+#Include = /etc/pacman.d/mirrorlist
+
+# An example of a custom package repository.  See the pacman manpage for
+# tips on creating your own repositories.
+#[custom]
+#SigLevel = Optional TrustAll
+#Server = file:///home/custompkgs
+"""
+
+
+def test_unmodified_stock_config_round_trips_exactly():
+    conf = PacmanConf(STOCK)
+    assert conf.render() == STOCK
+    assert not conf.changed and conf.diff() == ""
+    assert conf.repos() == ["core", "extra"]
+    assert conf.section("options").get("HoldPkg") == "pacman glibc"
+    assert conf.section("options").get("CheckSpace") == ""
+    assert conf.section("options").get("Color") is None
+
+
+def test_set_option_reuses_the_commented_default_and_is_idempotent():
+    conf = PacmanConf(STOCK)
+    conf.set_option("ParallelDownloads", 8)
+    conf.set_option("Color")
+    once = conf.render()
+    assert "\nParallelDownloads = 8\n" in once and "#ParallelDownloads" not in once
+    assert "\nColor\n" in once and "#Color" not in once
+    assert len(once.splitlines()) == len(STOCK.splitlines())
+    conf.set_option("ParallelDownloads", 8)
+    conf.set_option("Color")
+    assert conf.render() == once
+    conf.set_option("ParallelDownloads", 3)
+    assert conf.section("options").get("ParallelDownloads") == "3"
+
+
+def test_enable_repo_uncomments_multilib_once():
+    conf = PacmanConf(STOCK)
+    assert conf.enable_repo("multilib")
+    once = conf.render()
+    assert "\n[multilib]\nInclude = /etc/pacman.d/mirrorlist\n" in once
+    assert conf.repos() == ["core", "extra", "multilib"]
+    assert conf.enable_repo("multilib") and conf.render() == once
+    assert not conf.enable_repo("missing")
+
+
+def test_add_repo_before_core_is_idempotent():
+    conf = PacmanConf(STOCK)
+    conf.add_repo("local", servers=["file:///var/cache/local"], sig_level="Optional TrustAll", before="core")
+    once = conf.render()
+    assert conf.repos() == ["local", "core", "extra"]
+    assert "[local]\nSigLevel = Optional TrustAll\nServer = file:///var/cache/local\n\n[core]\n" in once
+    conf.add_repo("local", servers=["file:///var/cache/local"], sig_level="Optional TrustAll", before="core")
+    assert conf.render() == once
+    assert PacmanConf(once).render() == once
+    conf.remove_repo("local")
+    assert conf.render() == STOCK
+
+
+def test_add_repo_updates_an_existing_repository_in_place():
+    conf = PacmanConf(STOCK)
+    conf.add_repo("custom", servers=["file:///srv/repo"], sig_level="Optional TrustAll")
+    assert conf.repos() == ["core", "extra", "custom"]
+    section = conf.section("custom")
+    assert [(key, value) for _, key, value, _ in section.directives()] == [
+        ("SigLevel", "Optional TrustAll"), ("Server", "file:///srv/repo")]
+
+
+def test_edit_writes_only_when_something_changed(tmp_path):
+    path = tmp_path / "pacman.conf"
+    path.write_text(STOCK)
+    os.chmod(path, 0o640)
+    previews = []
+    with pacman_conf.edit(str(path), preview=previews.append):
+        pass
+    assert previews == []
+    with pacman_conf.edit(str(path), preview=previews.append) as conf:
+        conf.enable_repo("multilib")
+    assert "+[multilib]" in previews[0]
+    assert "[multilib]\nInclude" in path.read_text()
+    assert os.stat(path).st_mode & 0o777 == 0o640
+
+
+def test_atomic_write_replaces_the_file_and_leaves_no_temporary(tmp_path):
+    path = tmp_path / "pacman.conf"
+    pacman_conf.atomic_write(str(path), "first\n")
+    assert path.read_text() == "first\n" and os.stat(path).st_mode & 0o777 == 0o644
+    old_inode = os.stat(path).st_ino
+    pacman_conf.atomic_write(str(path), "second\n")
+    assert path.read_text() == "second\n"
+    assert os.stat(path).st_ino != old_inode
+    assert os.listdir(tmp_path) == ["pacman.conf"]
+
+
+def test_atomic_write_keeps_the_old_file_when_writing_fails(tmp_path, monkeypatch):
+    path = tmp_path / "pacman.conf"
+    path.write_text(STOCK)
+
+    def fail(fd):
+        raise OSError("disk full")
+    monkeypatch.setattr(pacman_conf.os, "fsync", fail)
+    with pytest.raises(OSError):
+        pacman_conf.atomic_write(str(path), "truncated")
+    assert path.read_text() == STOCK
+    assert os.listdir(tmp_path) == ["pacman.conf"]
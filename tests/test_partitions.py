@@ -0,0 +1,80 @@
+import pytest
+
+from libs.disks import partitions
+from libs.disks.partitions import DiskTopology, MiB, GiB
+
+
+def test_partition_device_naming():
+    assert partitions.partition_device("/dev/nvme0n1", 2) == "/dev/nvme0n1p2"
+    assert partitions.partition_device("/dev/mmcblk0", 1) == "/dev/mmcblk0p1"
+    assert partitions.partition_device("/dev/loop3", 1) == "/dev/loop3p1"
+    assert partitions.partition_device("/dev/sda", 2) == "/dev/sda2"
+    assert partitions.partition_device("/dev/vdb", 3) == "/dev/vdb3"
+
+
+def test_topology_read_from_a_fake_sysfs(tmp_path):
+    disk = tmp_path / "sys" / "class" / "block" / "mmcblk0"
+    (disk / "queue").mkdir(parents=True)
+    (disk / "device").mkdir()
+    (disk / "size").write_text("62333952\n")
+    (disk / "queue" / "logical_block_size").write_text("512\n")
+    (disk / "queue" / "physical_block_size").write_text("512\n")
+    (disk / "queue" / "discard_granularity").write_text("4194304\n")
+    (disk / "device" / "preferred_erase_size").write_text("4194304\n")
+    topology = DiskTopology.read("/dev/mmcblk0", str(tmp_path))
+    assert topology.name == "mmcblk0"
+    assert topology.size == 62333952 * 512
+    assert (topology.minimum_io_size, topology.optimal_io_size) == (0, 0)
+    assert topology.erase_size == 4 * MiB
+    assert topology.alignment() == 4 * MiB
+
+
+def test_alignment_is_the_lcm_of_the_hints():
+    assert DiskTopology("sda", GiB).alignment() == MiB
+    assert DiskTopology("sda", GiB, 512, 4096).alignment() == MiB
+    # A 768 KiB RAID stripe and 1 MiB only line up every 3 MiB
+    assert DiskTopology("md0", GiB, minimum_io_size=512 * 1024, optimal_io_size=768 * 1024).alignment() == 3 * MiB
+
+
+def test_alignment_ignores_bogus_hints():
+    # 33553920 bytes is a common nonsense optimal_io_size of USB bridges
+    assert DiskTopology("sdb", GiB, optimal_io_size=33553920).alignment() == MiB
+    assert DiskTopology("sdb", GiB, optimal_io_size=64 * MiB).alignment() == 64 * MiB
+    assert DiskTopology("sdb", GiB, optimal_io_size=128 * MiB).alignment() == MiB
+
+
+def test_plan_layout_on_a_512_byte_disk():
+    layout = partitions.plan_layout("/dev/nvme0n1", DiskTopology("nvme0n1", 100 * GiB), swap_size=4 * GiB)
+    esp, swap, root = layout.partitions
+    assert (esp.start, esp.sectors) == (2048, 2 * 1024 * 1024)
+    assert swap.start == esp.start + esp.sectors and swap.sectors == 8 * 1024 * 1024
+    assert root.start == swap.start + swap.sectors
+    # Root ends on the last 1 MiB boundary before the backup GPT
+    assert (root.start + root.sectors) % 2048 == 0
+    assert root.start + root.sectors == 100 * GiB // 512 - 2048
+    assert (layout.esp, layout.swap, layout.root) == ("/dev/nvme0n1p1", "/dev/nvme0n1p2", "/dev/nvme0n1p3")
+    assert layout.sfdisk_script().splitlines()[:3] == ["label: gpt", "unit: sectors", ""]
+    assert layout.sfdisk_script().splitlines()[3] == (
+        f'start=2048, size=2097152, type={partitions.TYPE_ESP}, name="EFI system partition"')
+
+
+def test_plan_layout_on_a_4k_disk_with_cache():
+    topology = DiskTopology("sda", 64 * GiB, 4096, 4096)
+    layout = partitions.plan_layout("/dev/sda", topology, cache_size=8 * GiB)
+    esp, root, cache = layout.partitions
+    assert esp.start == 256 and esp.sectors == GiB // 4096
+    assert cache.start == root.start + root.sectors and cache.sectors == 8 * GiB // 4096
+    assert cache.start + cache.sectors <= 64 * GiB // 4096 - 1 - (1 + partitions.GPT_ENTRIES_BYTES // 4096)
+    assert layout.swap is None and layout.root == "/dev/sda2"
+    assert "sector-size: 4096" in layout.sfdisk_script()
+
+
+def test_plan_layout_respects_the_alignment_offset():
+    topology = DiskTopology("sdc", 16 * GiB, 512, 4096, alignment_offset=3584)
+    layout = partitions.plan_layout("/dev/sdc", topology)
+    assert all((part.start * 512 + 3584) % MiB == 0 for part in layout.partitions)
+
+
+def test_plan_layout_rejects_a_disk_that_is_too_small():
+    with pytest.raises(ValueError):
+        partitions.plan_layout("/dev/sdd", DiskTopology("sdd", 512 * MiB))
@@ -0,0 +1,106 @@
+import pytest
+
+from libs import chroot, power_tuner
+from libs.hardware import HardwareProfile
+from libs.power_tuner import CpuFreqInfo, plan_power, read_cpufreq
+
+AMD = HardwareProfile(cpu_vendor="AuthenticAMD", cpu_model="AMD Ryzen 7 7840U")
+
+
+def make_sysfs(root, driver, governors, governor, epp=None, status=None):
+    cpu_dir = root / "sys" / "devices" / "system" / "cpu"
+    policy = cpu_dir / "cpufreq" / "policy0"
+    policy.mkdir(parents=True)
+    (policy / "scaling_driver").write_text(driver + "\n")
+    (policy / "scaling_available_governors").write_text(governors + "\n")
+    (policy / "scaling_governor").write_text(governor + "\n")
+    if epp:
+        (policy / "energy_performance_preference").write_text(epp[0] + "\n")
+        (policy / "energy_performance_available_preferences").write_text(epp[1] + "\n")
+    if status:
+        (cpu_dir / "amd_pstate").mkdir()
+        (cpu_dir / "amd_pstate" / "status").write_text(status + "\n")
+    return root
+
+
+def test_read_cpufreq_from_a_fake_sysfs(tmp_path):
+    make_sysfs(tmp_path, "amd-pstate-epp", "performance powersave", "powersave",
+               epp=("balance_performance", "default performance balance_performance balance_power power"),
+               status="active")
+    info = read_cpufreq(str(tmp_path), AMD)
+    assert info.driver == "amd-pstate-epp"
+    assert info.governors == ["performance", "powersave"]
+    assert info.epp == "balance_performance"
+    assert info.pstate_status == "active"
+    assert info.cpu_model == "AMD Ryzen 7 7840U"
+    assert info.has_epp
+
+
+def test_read_cpufreq_without_cpufreq_support(tmp_path):
+    info = read_cpufreq(str(tmp_path), AMD)
+    assert info.driver == "" and info.governors == [] and not info.has_epp
+
+
+def test_epp_driver_profiles():
+    info = CpuFreqInfo("AuthenticAMD", driver="amd-pstate-epp", governors=["performance", "powersave"],
+                       epp_choices=["performance", "balance_performance", "power"], pstate_status="active")
+    latency = plan_power(info, "latency")
+    assert (latency.governor, latency.epp, latency.daemon) == ("performance", "performance", "tuned")
+    assert latency.kernel_params == []
+    efficiency = plan_power(info, "efficiency")
+    assert (efficiency.governor, efficiency.epp, efficiency.daemon) == ("powersave", "power", None)
+    assert efficiency.tmpfiles().splitlines()[-1].endswith("energy_performance_preference - - - - power")
+
+
+def test_acpi_cpufreq_on_amd_enables_amd_pstate():
+    info = CpuFreqInfo("AuthenticAMD", driver="acpi-cpufreq", governors=["ondemand", "performance", "schedutil"])
+    plan = plan_power(info, "efficiency")
+    assert plan.kernel_params == ["amd_pstate=active"]
+    assert plan.governor == "powersave"
+
+
+def test_plain_governors_and_the_balanced_daemon():
+    info = CpuFreqInfo("GenuineIntel", driver="acpi-cpufreq", governors=["ondemand", "performance", "conservative"])
+    assert plan_power(info, "efficiency").governor == "conservative"
+    balanced = plan_power(info, "balanced")
+    assert balanced.daemon == "power-profiles-daemon" and balanced.governor is None
+    assert balanced.tmpfiles() == ""
+    with pytest.raises(ValueError):
+        plan_power(info, "turbo")
+
+
+def test_queue_power_profile_only_queues(monkeypatch):
+    queued = []
+    monkeypatch.setattr(power_tuner.transaction, "add", lambda packages, step=None: queued.extend(packages))
+    monkeypatch.setattr(power_tuner.transaction, "commit", lambda: pytest.fail("committed while queueing"))
+    monkeypatch.setattr(power_tuner, "selected_plan", None)
+    info = CpuFreqInfo("GenuineIntel", driver="intel_pstate", epp_choices=["performance"], pstate_status="active")
+    plan = power_tuner.queue_power_profile("latency", info)
+    assert queued == ["tuned"]
+    assert power_tuner.selected_plan is plan
+
+
+def test_a_new_choice_replaces_the_queued_profile(monkeypatch):
+    monkeypatch.setattr(power_tuner, "transaction", power_tuner.transaction.__class__())
+    monkeypatch.setattr(power_tuner, "boot_options", power_tuner.boot_options.__class__())
+    monkeypatch.setattr(power_tuner, "selected_plan", None)
+    power_tuner.transaction.add(["linux"], "Kernel")
+    info = CpuFreqInfo("AuthenticAMD", driver="acpi-cpufreq", governors=["performance", "schedutil"])
+    power_tuner.queue_power_profile("latency", info)
+    assert power_tuner.transaction.pending() == ["linux", "tuned"]
+    power_tuner.queue_power_profile("balanced", info)
+    assert power_tuner.transaction.pending() == ["linux", "power-profiles-daemon"]
+    assert power_tuner.boot_options.params == ["amd_pstate=active"]
+    # The install plan step plans the menu's choice again instead of falling back to balanced
+    power_tuner.queue_power_profile("efficiency", info)
+    assert power_tuner.queue_power_profile(info=info).profile == "efficiency"
+    assert power_tuner.transaction.pending() == ["linux"]
+
+
+def test_configure_never_touches_the_live_system(monkeypatch):
+    monkeypatch.setattr(chroot.utils, "is_inside_chroot", lambda: False)
+    monkeypatch.setattr(power_tuner, "run_in_target", lambda command: pytest.fail(f"ran {command} on the host"))
+    monkeypatch.setattr(power_tuner, "write_target_file", lambda path, content: pytest.fail(f"wrote {path} on the host"))
+    plan = plan_power(CpuFreqInfo("GenuineIntel", driver="intel_pstate", epp_choices=["power"]), "balanced")
+    with pytest.raises(Exception, match="No target system"):
+        power_tuner.configure_power_profile(plan)
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from libs.trace import tracer
+from libs.utils import ProbeEngine
+
+
+def test_probes_run_once_and_are_cached_until_invalidated(tmp_path):
+    counter = tmp_path / "count"
+    engine = ProbeEngine({"count": f"echo x >> {counter}; wc -l < {counter}"})
+    engine.start()
+    assert engine.get("count").stdout.strip() == "1"
+    assert engine.get("count").stdout.strip() == "1"
+    engine.invalidate("count")
+    assert engine.get("count").stdout.strip() == "2"
+
+
+def test_failed_and_timed_out_probes_still_return():
+    engine = ProbeEngine({"fails": "exit 3", "slow": "sleep 5"}, timeout=0.2)
+    assert engine.get("fails").returncode == 3
+    slow = engine.get("slow")
+    assert slow.returncode == -1 and "Timed out" in slow.stderr
+
+
+def test_a_probe_that_raises_releases_its_waiters(monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("event loop trouble")
+    monkeypatch.setattr(asyncio, "create_subprocess_shell", broken)
+    monkeypatch.setattr("threading.excepthook", lambda args: None)
+    result = ProbeEngine({"drives": "lsblk"}).get("drives")
+    assert result.returncode == -1
+
+
+def test_probes_are_traced():
+    ProbeEngine({"traced": "echo traced-probe"}).get("traced")
+    span = next(span for span in tracer.spans if span.name == "echo traced-probe")
+    assert (span.kind, span.exit_status, span.output_bytes) == ("command", 0, len("traced-probe\n"))
+    assert span.end >= span.start
+
+
+def test_unknown_probes_fail_immediately():
+    engine = ProbeEngine({"known": "true"})
+    with pytest.raises(KeyError, match="missing"):
+        engine.get("missing")
+    with pytest.raises(KeyError):
+        engine.start(["known", "missing"])
+    assert engine.pending == {}
@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+from libs import sync_db
+from libs.sync_db import SyncIndex
+
+
+def make_index(sync_dir, cache_dir):
+    return SyncIndex(str(sync_dir), str(cache_dir), str(sync_dir / "missing-pacman.conf"))
+
+
+def test_strip_version():
+    assert sync_db.strip_version("glibc>=2.38") == "glibc"
+    assert sync_db.strip_version("sh: for scripts") == "sh"
+
+
+def test_estimate_covers_the_dependency_closure(sync_dir, tmp_path):
+    estimate = make_index(sync_dir, tmp_path / "cache").estimate(["bash", "unknown-package"], throughput=1000)
+    assert estimate.packages == ["bash", "filesystem", "glibc", "linux-api-headers", "readline"]
+    assert estimate.download_size == 1800 + 100 + 10000 + 1500 + 400
+    assert estimate.installed_size == estimate.download_size * 4
+    assert estimate.missing == ["unknown-package"]
+    assert estimate.seconds == estimate.download_size / 1000
+
+
+def test_index_cache_is_json_in_a_private_directory(sync_dir, tmp_path):
+    cache_dir = tmp_path / "cache"
+    make_index(sync_dir, cache_dir).packages
+    assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+    assert os.listdir(cache_dir) == ["core.db.json"]
+
+    # A second index reads the cache instead of the database
+    (cache_dir / "core.db.json").write_text((cache_dir / "core.db.json").read_text().replace(
+        '"nano"', '"nano-from-cache"'))
+    assert "nano-from-cache" in make_index(sync_dir, cache_dir).packages
+
+
+def test_index_cache_in_a_shared_directory_is_ignored(sync_dir, tmp_path):
+    cache_dir = tmp_path / "shared"
+    cache_dir.mkdir()
+    (cache_dir / "core.db.json").write_text('{"key": [], "packages": {"evil": {}}}')
+    os.chmod(cache_dir, 0o777)
+    packages = make_index(sync_dir, cache_dir).packages
+    assert "evil" not in packages and "nano" in packages
+
+
+def test_concurrent_lookups_load_the_index_once(sync_dir, tmp_path, monkeypatch):
+    parse = sync_db.parse_database
+    calls = []
+
+    def slow_parse(path):
+        calls.append(path)
+        time.sleep(0.05)
+        return parse(path)
+    monkeypatch.setattr(sync_db, "parse_database", slow_parse)
+    index = make_index(sync_dir, tmp_path / "cache")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(index.find("bash")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [["bash"]] * 8
@@ -0,0 +1,36 @@
+import json
+
+from libs import trace
+from libs.trace import Tracer
+
+
+def test_redact_masks_secrets():
+    assert trace.redact('echo "root:S3cr#t pw" | chpasswd') == "echo *** | chpasswd"
+    assert trace.redact("echo -n p4ss | cryptsetup luksFormat /dev/sda2 -") == \
+        "echo -n *** | cryptsetup luksFormat /dev/sda2 -"
+    assert trace.redact("iwctl station wlan0 connect Home --passphrase hunter2") == \
+        "iwctl station wlan0 connect Home --passphrase ***"
+    assert trace.redact("pacstrap /mnt base linux") == "pacstrap /mnt base linux"
+
+
+def test_secrets_never_reach_the_trace(tmp_path):
+    tracer = Tracer()
+    with tracer.step("Set root password"):
+        with tracer.command("echo 'root:hunter2' | chpasswd"):
+            pass
+        tracer.run(["true", "--password", "hunter2"])
+    tracer.export(str(tmp_path / "trace.json"), str(tmp_path / "trace.txt"))
+    for name in ("trace.json", "trace.txt"):
+        assert "hunter2" not in (tmp_path / name).read_text()
+
+
+def test_spans_nest_and_record_exit_status():
+    tracer = Tracer()
+    with tracer.step("Outer") as outer:
+        result = tracer.run(["sh", "-c", "echo hi; exit 2"], capture_output=True, text=True)
+    assert result.returncode == 2
+    command = tracer.spans[1]
+    assert (command.parent, command.exit_status, command.output_bytes) == (outer.id, 2, 3)
+    assert tracer.step_of(command) == "Outer"
+    events = json.loads(json.dumps(tracer.chrome_trace()))["traceEvents"]
+    assert [event["name"] for event in events] == ["Outer", "sh -c echo hi; exit 2"]
@@ -0,0 +1,43 @@
+import pytest
+
+from libs import utils
+
+
+def test_stream_command_keeps_only_the_tail(tmp_path):
+    log = tmp_path / "install_log.txt"
+    result = utils.stream_command("seq 1 1000; echo oops >&2", log_file=str(log), tail_lines=3)
+    assert result.returncode == 0
+    assert result.stdout == "998\n999\n1000\n"
+    assert result.stderr == "oops\n"
+    # The log holds every line, not just the tail
+    assert log.read_text().count("\n") == 1001
+
+
+def test_stream_command_hands_every_line_to_the_callbacks(tmp_path):
+    lines = []
+    result = utils.stream_command("echo one; echo two >&2; echo three; exit 4", log_file=str(tmp_path / "log"),
+                                  callbacks=[lambda stream, line: lines.append((stream, line))])
+    assert result.returncode == 4
+    assert [line for line in lines if line[0] == "stdout"] == [("stdout", "one\n"), ("stdout", "three\n")]
+    assert ("stderr", "two\n") in lines
+
+
+def test_a_failing_callback_does_not_stop_the_stream(tmp_path):
+    seen = []
+
+    def broken(stream, line):
+        raise RuntimeError("bad progress bar")
+    result = utils.stream_command("echo a; echo b", log_file=str(tmp_path / "log"),
+                                  callbacks=[broken, lambda stream, line: seen.append(line)])
+    assert result.stdout == "a\nb\n" and seen == ["a\n", "b\n"]
+
+
+def test_stream_command_feeds_input_on_stdin(tmp_path):
+    result = utils.stream_command("cat", log_file=str(tmp_path / "log"), input="root:secret\n")
+    assert result.stdout == "root:secret\n"
+
+
+def test_run_command_exits_on_failure(tmp_path):
+    assert utils.run_command("echo ok", log_file=str(tmp_path / "log")).stdout == "ok\n"
+    with pytest.raises(SystemExit):
+        utils.run_command("exit 1", log_file=str(tmp_path / "log"))